@@ -1,8 +1,8 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from config import config
+from .routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 
 def create_app(config_name):
@@ -12,6 +12,22 @@ def create_app(config_name):
 
     db.init_app(app)
 
+    from app import database
+    database.init_app(app)
+
+    from app import dashboard, events, idempotency, instrumentation, metrics, passwords, profiling, ratelimit, routing, sharding
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    idempotency.init_app(app)
+    dashboard.init_app(app)
+    passwords.init_app(app)
+    routing.init_app(app)
+    sharding.init_app(app)
+    events.init_app(app)
+    # Outermost, so that shed requests cost as little as possible
+    ratelimit.init_app(app)
+
     # Register blueprints
     from app.api_1_0 import api
     app.register_blueprint(api, url_prefix='/api/v1.0')
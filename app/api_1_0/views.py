@@ -1,34 +1,88 @@
+import re
 from datetime import datetime, timedelta
 from functools import wraps
+from time import perf_counter
 
 import jwt
-from flask import jsonify, url_for, request
-from werkzeug.security import check_password_hash
+from flask import jsonify, url_for, request, current_app, g
 
 from config import Config
 from . import api
 from .. import db
 
-from ..models import User, Wallet, ParentCategory, Category, Transaction
+from ..changes import changes_since
+from ..dashboard import dashboard
+from ..database import retry_on_lock
+from ..events import EVENT_STREAM, EventStream, to_message
+from ..idempotency import idempotent
+from ..instrumentation import add_timing
+from ..jobs import enqueue, stats
+from ..passwords import hash_password, needs_rehash, verify_password
+from ..ratelimit import rate_limit
+from ..search import matching_transactions
+from ..models import User, Wallet, ParentCategory, Category, Transaction, Job, RefreshToken, Change, Alert
+from ..ownership import claims, load_claims, owns_wallet
+from ..sharding import select_shard, on_user_shard, for_each_shard, shards
 
 
 def token_required(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
+        # Sub-requests of a batch reuse the user authenticated by the batch
+        if getattr(g, 'batch_user', None) is not None:
+            return rate_limit(g.batch_user) or func(g.batch_user, *args, **kwargs)
         token = request.headers.get('x-access-token', None)
         if not token:
             return jsonify({'message': 'Token is missing!',
                             'code': 401})
+        start = perf_counter()
         try:
             data = jwt.decode(token, Config.SECRET_KEY)
+            g.user_id = data['id']
             current_user = User.query.filter_by(id=data['id']).first()
         except:
             return jsonify({'message': 'Token is invalid!',
                             'code': 401})
-        return func(current_user, *args, **kwargs)
+        finally:
+            add_timing('auth', perf_counter() - start)
+        # The token outlives its user, who may have been deleted since
+        if current_user is None:
+            return jsonify({'message': 'Token is invalid!',
+                            'code': 401})
+        load_claims(current_user, data)
+        select_shard(current_user)
+        return rate_limit(current_user) or func(current_user, *args, **kwargs)
     return wrapper
 
 
+def is_heavy(transactions):
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    threshold = current_app.config['JOBS_ASYNC_THRESHOLD']
+    return threshold is not None and transactions.count() > threshold
+
+
+def accepted(job):
+    response = jsonify(job.to_json())
+    response.status_code = 202
+    response.headers['Location'] = url_for('.get_job', id=job.id, _external=True)
+    return response
+
+
+def paginate_transactions(query, endpoint, **values):
+    after = request.args.get('after', 0, type=int)
+    limit = max(1, min(request.args.get('limit', current_app.config['TRANSACTIONS_PER_PAGE'], type=int),
+                       current_app.config['TRANSACTIONS_MAX_PER_PAGE']))
+    transactions = query.filter(Transaction.id > after) \
+        .order_by(Transaction.id).limit(limit + 1).all()
+    next_url = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_url = url_for(endpoint, after=transactions[-1].id, limit=limit, _external=True, **values)
+    return jsonify({'transactions': [transaction.to_json() for transaction in transactions],
+                    'next': next_url}), 200
+
+
 @api.route('/login/', methods=['POST'])
 def login():
     auth = request.authorization
@@ -41,14 +95,62 @@ def login():
     if not user:
         return jsonify({'message': 'User doesn\'t exists!',
                         'code': 404})
-    if check_password_hash(user.password, password):
-        token = jwt.encode({'id': user.id,
-                            'exp': datetime.utcnow() + timedelta(minutes=15)},
-                           Config.SECRET_KEY)
-        return jsonify({'token': token.decode('UTF-8')})
+    if user.password and verify_password(user.password, password):
+        if needs_rehash(user.password):
+            user.password = hash_password(password)
+        refresh_token = RefreshToken.issue(user.id)
+        db.session.commit()
+        return jsonify({'token': access_token(user),
+                        'refresh_token': refresh_token})
     return jsonify({'message': 'Couldn\'t verify password!'})
 
 
+def access_token(user):
+    data = {'id': user.id,
+            'exp': datetime.utcnow() + timedelta(minutes=current_app.config['ACCESS_TOKEN_MINUTES'])}
+    data.update(claims(user))
+    token = jwt.encode(data, Config.SECRET_KEY)
+    return token.decode('UTF-8')
+
+
+@api.route('/token/refresh', methods=['POST'])
+def refresh_token():
+    # Costs an HMAC and an indexed lookup instead of a password hash
+    token = (request.json or {}).get('refresh_token')
+    refresh_token = RefreshToken.lookup(token) if token and isinstance(token, str) else None
+    if refresh_token is None:
+        return jsonify({'message': 'Refresh token is invalid!',
+                        'code': 401})
+    user = User.query.filter_by(id=refresh_token.user_id).first()
+    return jsonify({'token': access_token(user)})
+
+
+@api.route('/token/refresh', methods=['DELETE'])
+def revoke_refresh_token():
+    token = (request.json or {}).get('refresh_token')
+    refresh_token = RefreshToken.lookup(token) if token and isinstance(token, str) else None
+    if refresh_token is None:
+        return jsonify({'message': 'Refresh token is invalid!',
+                        'code': 401})
+    db.session.delete(refresh_token)
+    db.session.commit()
+    return jsonify({'message': 'The refresh token has been revoked.',
+                    'code': 200})
+
+
+@api.route('/changes', methods=['GET'])
+@token_required
+def get_changes(current_user):
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', current_app.config['CHANGES_PER_PAGE'], type=int),
+                       current_app.config['CHANGES_MAX_PER_PAGE']))
+    changes, last_seq, more = changes_since(current_user, since, limit)
+    next_url = url_for('.get_changes', since=last_seq, limit=limit, _external=True) if more else None
+    return jsonify({'changes': changes,
+                    'last_seq': last_seq,
+                    'next': next_url}), 200
+
+
 @api.route('/', methods=['GET'])
 @token_required
 def index(current_user):
@@ -65,7 +167,15 @@ def index(current_user):
 @token_required
 def get_all_users(current_user):
     users = User.query.all()
-    return jsonify({'users': [user.to_json() for user in users]})
+    counts = {}
+    for shard in for_each_shard():
+        counts.update(db.session.query(Transaction.maker_id, db.func.count(Transaction.id))
+                      .group_by(Transaction.maker_id))
+    json = []
+    for user in users:
+        with on_user_shard(user):
+            json.append(user.to_json(transactions_count=counts.get(user.id, 0)))
+    return jsonify({'users': json})
 
 
 @api.route('/users/<int:id>', methods=['GET'])
@@ -76,11 +186,32 @@ def get_user(current_user, id):
     except:
         return jsonify({'message': 'The user doesn\'t exists.',
                         'code': 404})
-    return jsonify(user.to_json()), 200
+    with on_user_shard(user):
+        return jsonify(user.to_json()), 200
+
+
+@api.route('/users/<int:id>/dashboard', methods=['GET'])
+@token_required
+def get_user_dashboard(current_user, id):
+    if current_user.id != id:
+        return jsonify({'message': 'You can\'t see the dashboard of other users!',
+                        'code': 403})
+    return jsonify(dashboard(current_user)), 200
+
+
+@api.route('/users/<int:id>/transactions', methods=['GET'])
+@token_required
+def get_user_transactions(current_user, id):
+    user = User.query.filter_by(id=id).first() if shards() else None
+    with on_user_shard(user):
+        return paginate_transactions(Transaction.query.filter_by(maker_id=id),
+                                     '.get_user_transactions', id=id)
 
 
 @api.route('/users/', methods=['POST'])
 @token_required
+@idempotent
+@retry_on_lock
 def create_user(current_user):
     user = User.from_json(request.json)
     db.session.add(user)
@@ -90,6 +221,7 @@ def create_user(current_user):
 
 @api.route('/users/<int:id>', methods=['PUT'])
 @token_required
+@retry_on_lock
 def update_user(current_user, id):
     try:
         user = User.query.filter_by(id=id).first()
@@ -107,6 +239,7 @@ def update_user(current_user, id):
 
 @api.route('/users/<int:id>', methods=['DELETE'])
 @token_required
+@retry_on_lock
 def delete_user(current_user, id):
     try:
         user = User.query.filter_by(id=id).first()
@@ -114,6 +247,8 @@ def delete_user(current_user, id):
         return jsonify({'message': 'The user doesn\'t exists.',
                         'code': 404})
     if current_user is user:
+        if is_heavy(Transaction.query.filter_by(maker_id=user.id)):
+            return accepted(enqueue('delete_user', owner_id=current_user.id, id=user.id))
         user.delete()
         db.session.commit()
         return jsonify({'message': 'The user has been deleted.',
@@ -141,8 +276,100 @@ def get_wallet(current_user, id):
     return jsonify(wallet.to_json()), 200
 
 
+@api.route('/wallets/<int:id>/tree', methods=['GET'])
+@token_required
+def get_wallet_tree(current_user, id):
+    wallet = Wallet.query.filter_by(id=id).first()
+    if wallet is None:
+        return jsonify({'message': 'The wallet doesn\'t exists.',
+                        'code': 404})
+    rows = db.session.query(ParentCategory, Category) \
+        .outerjoin(Category, Category.parent_category_id == ParentCategory.id) \
+        .filter(ParentCategory.wallet_id == wallet.id) \
+        .order_by(ParentCategory.id, Category.id).all()
+
+    parent_categories = {}
+    for parent_category, category in rows:
+        if parent_category.id not in parent_categories:
+            parent_categories[parent_category.id] = {
+                'url': url_for('.get_parent_category', id=parent_category.id, _external=True),
+                'id': parent_category.id,
+                'title': parent_category.title,
+                'budget': parent_category.budget,
+                'is_income': parent_category.is_income,
+                'categories': [],
+            }
+        if category is None:
+            continue
+        json = {
+            'url': url_for('.get_category', id=category.id, _external=True),
+            'id': category.id,
+            'title': category.title,
+            'budget': category.budget,
+            'has_bills': category.has_bills,
+        }
+        if request.args.get('totals', type=int):
+            json['transactions_count'] = category.transactions_count
+            json['transactions_total'] = category.transactions_total
+        parent_categories[parent_category.id]['categories'].append(json)
+
+    return jsonify({'url': url_for('.get_wallet', id=wallet.id, _external=True),
+                    'id': wallet.id,
+                    'title': wallet.title,
+                    'created_at': wallet.created_at,
+                    'currency': wallet.currency,
+                    'initial_balance': wallet.initial_balance,
+                    'owner': url_for('.get_user', id=wallet.owner_id, _external=True),
+                    'parent_categories': list(parent_categories.values())}), 200
+
+
+@api.route('/wallets/<int:id>/alerts', methods=['GET'])
+@token_required
+def get_wallet_alerts(current_user, id):
+    if not owns_wallet(current_user, id):
+        return jsonify({'message': 'You can\'t see the alerts of other users!',
+                        'code': 403})
+    alerts = Alert.query.filter_by(wallet_id=id).order_by(Alert.id.desc()) \
+        .limit(current_app.config['ALERTS_PER_PAGE']).all()
+    return jsonify({'alerts': [alert.to_json() for alert in alerts]}), 200
+
+
+@api.route('/wallets/<int:id>/events', methods=['GET'])
+@token_required
+def get_wallet_events(current_user, id):
+    if not owns_wallet(current_user, id):
+        return jsonify({'message': 'You can\'t watch the wallets of other users!',
+                        'code': 403})
+    config = current_app.config
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = db.session.query(db.func.max(Change.seq)).scalar() or 0
+    broker = current_app.extensions['events']
+    subscription = broker.subscribe(id, since)
+    # Read after subscribing, so nothing falls between the two
+    try:
+        missed = Change.query.filter(Change.wallet_id == id, Change.seq > since) \
+            .order_by(Change.seq).limit(config['EVENTS_REPLAY_LIMIT'] + 1).all()
+    except Exception:
+        broker.unsubscribe(id, subscription)
+        raise
+    if len(missed) > config['EVENTS_REPLAY_LIMIT']:
+        # Too far behind, the client reloads the wallet instead
+        missed = []
+        subscription.overflowed = True
+    stream = EventStream(broker, id, subscription, [to_message(change) for change in missed], since,
+                         config['EVENTS_HEARTBEAT'], config['EVENTS_STREAM_SECONDS'])
+    request.environ[EVENT_STREAM] = stream
+    response = current_app.response_class(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @api.route('/wallets/', methods=['POST'])
 @token_required
+@idempotent
+@retry_on_lock
 def create_wallet(current_user):
     data = request.json
     data['owner_id'] = current_user.id
@@ -154,14 +381,14 @@ def create_wallet(current_user):
 
 @api.route('/wallets/<int:id>', methods=['PUT'])
 @token_required
+@retry_on_lock
 def update_wallet(current_user, id):
     try:
         wallet = Wallet.query.filter_by(id=id).first()
     except:
         return jsonify({'message': 'Wallet doesn\'t exists.',
                        'code': 404})
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, wallet.id):
         data = request.json
         wallet.update(data)
         db.session.commit()
@@ -172,19 +399,21 @@ def update_wallet(current_user, id):
 
 @api.route('/wallets/<int:id>', methods=["DELETE"])
 @token_required
+@retry_on_lock
 def delete_wallet(current_user, id):
     try:
         wallet = Wallet.query.filter_by(id=id).first()
     except:
         return jsonify({'message': 'The wallet not found!',
                         'code': 404})
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, wallet.id):
+        if is_heavy(Transaction.query.join(Category).join(ParentCategory)
+                    .filter(ParentCategory.wallet_id == wallet.id)):
+            return accepted(enqueue('delete_wallet', owner_id=current_user.id, id=wallet.id))
         wallet.delete()
         db.session.commit()
         return jsonify({'message': 'The wallet has been deleted.',
                         'code': 200})
-    print(current_user, wallet_owner)
     return jsonify({'message': 'You can\'t delete the wallets of other users!',
                     'code': 403})
 
@@ -212,15 +441,11 @@ def get_parent_category(current_user, id):
 
 @api.route('/parent-categories/', methods=['POST'])
 @token_required
+@idempotent
+@retry_on_lock
 def create_parent_category(current_user):
     data = request.json
-    try:
-        wallet = Wallet.query.filter_by(id=data['wallet_id']).first()
-    except:
-        return jsonify({'message': 'The wallet doesn\'t exists!',
-                        'code': 404})
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, data.get('wallet_id')):
         new_parent_category = ParentCategory.from_json(data)
         db.session.add(new_parent_category)
         db.session.commit()
@@ -231,15 +456,14 @@ def create_parent_category(current_user):
 
 @api.route('/parent-categories/<int:id>', methods=['PUT'])
 @token_required
+@retry_on_lock
 def update_parent_category(current_user, id):
     try:
         parent_category = ParentCategory.query.filter_by(id=id).first()
     except:
         return jsonify({'message': 'The parent category doesn\'t exists.',
                         'code': 404})
-    wallet = Wallet.query.filter_by(id=parent_category.wallet_id).first()
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, parent_category.wallet_id):
         data = request.json
         parent_category.update(data)
         db.session.commit()
@@ -250,16 +474,19 @@ def update_parent_category(current_user, id):
 
 @api.route('/parent-categories/<int:id>', methods=['DELETE'])
 @token_required
+@retry_on_lock
 def delete_parent_category(current_user, id):
     try:
         parent_category = ParentCategory.query.filter_by(id=id).first()
     except:
         return jsonify({'message': 'The parent category doesn\'t exists!',
                         'code': 404})
-    wallet = Wallet.query.filter_by(id=parent_category.wallet_id).first()
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
-        db.session.delete(parent_category)
+    if owns_wallet(current_user, parent_category.wallet_id):
+        if is_heavy(Transaction.query.join(Category)
+                    .filter(Category.parent_category_id == parent_category.id)):
+            return accepted(enqueue('delete_parent_category', owner_id=current_user.id,
+                                    id=parent_category.id))
+        parent_category.delete()
         db.session.commit()
         return jsonify({'message': 'The parent category has been deleted.',
                         'code': 200})
@@ -286,8 +513,17 @@ def get_category(current_user, id):
     return jsonify(category.to_json()), 200
 
 
+@api.route('/categories/<int:id>/transactions', methods=['GET'])
+@token_required
+def get_category_transactions(current_user, id):
+    return paginate_transactions(Transaction.query.filter_by(category_id=id),
+                                 '.get_category_transactions', id=id)
+
+
 @api.route('/categories/', methods=['POST'])
 @token_required
+@idempotent
+@retry_on_lock
 def create_category(current_user):
     data = request.json
     try:
@@ -295,9 +531,7 @@ def create_category(current_user):
     except:
         return jsonify({'message': 'The parent category doesn\'t exists!',
                         'code': 404})
-    wallet = Wallet.query.filter_by(id=parent_category.wallet_id).first()
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, parent_category.wallet_id):
         new_category = Category.from_json(data)
         db.session.add(new_category)
         db.session.commit()
@@ -308,6 +542,7 @@ def create_category(current_user):
 
 @api.route('/categories/<int:id>', methods=['PUT'])
 @token_required
+@retry_on_lock
 def update_category(current_user, id):
     try:
         category = Category.query.filter_by(id=id).first()
@@ -315,9 +550,7 @@ def update_category(current_user, id):
         return jsonify({'message': 'The category doesn\'t exists.',
                         'code': 404})
     parent_category = ParentCategory.query.filter_by(id=category.parent_category_id).first()
-    wallet = Wallet.query.filter_by(id=parent_category.wallet_id).first()
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, parent_category.wallet_id):
         data = request.json
         category.update(data)
         db.session.commit()
@@ -328,6 +561,7 @@ def update_category(current_user, id):
 
 @api.route('/categories/<int:id>', methods=['DELETE'])
 @token_required
+@retry_on_lock
 def delete_category(current_user, id):
     try:
         category = Category.query.filter_by(id=id).first()
@@ -335,9 +569,9 @@ def delete_category(current_user, id):
         return jsonify({'message': 'The category doesn\'t exists!',
                         'code': 404})
     parent_category = ParentCategory.query.filter_by(id=category.parent_category_id).first()
-    wallet = Wallet.query.filter_by(id=parent_category.wallet_id).first()
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, parent_category.wallet_id):
+        if is_heavy(Transaction.query.filter_by(category_id=category.id)):
+            return accepted(enqueue('delete_category', owner_id=current_user.id, id=category.id))
         category.delete()
         db.session.commit()
         return jsonify({'message': 'The category has been deleted.',
@@ -354,6 +588,26 @@ def get_all_transactions(current_user):
     return jsonify({'transactions': [transaction.to_json() for transaction in transactions]})
 
 
+@api.route('/transactions/search', methods=['GET'])
+@token_required
+def search_transactions(current_user):
+    query = request.args.get('q', '')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = max(1, min(request.args.get('limit', current_app.config['SEARCH_PER_PAGE'], type=int),
+                       current_app.config['SEARCH_MAX_PER_PAGE']))
+    # Ranked results have no stable key to page after, unlike paginate_transactions
+    transactions = matching_transactions(current_user, query, limit + 1, offset)
+    if transactions is None:
+        return jsonify({'message': 'The search query has no words!',
+                        'code': 400})
+    next_url = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_url = url_for('.search_transactions', q=query, offset=offset + limit, limit=limit, _external=True)
+    return jsonify({'transactions': [transaction.to_json() for transaction in transactions],
+                    'next': next_url}), 200
+
+
 @api.route('/transactions/<int:id>', methods=['GET'])
 @token_required
 def get_transaction(current_user, id):
@@ -367,6 +621,8 @@ def get_transaction(current_user, id):
 
 @api.route('/transactions/', methods=['POST'])
 @token_required
+@idempotent
+@retry_on_lock
 def create_transaction(current_user):
     data = request.json
     try:
@@ -375,9 +631,7 @@ def create_transaction(current_user):
         return jsonify({'message': 'The category doesn\'t exists!',
                         'code': 404})
     parent_category = ParentCategory.query.filter_by(id=category.parent_category_id).first()
-    wallet = Wallet.query.filter_by(id=parent_category.wallet_id).first()
-    wallet_owner = User.query.filter_by(id=wallet.owner_id).first()
-    if current_user is wallet_owner:
+    if owns_wallet(current_user, parent_category.wallet_id):
         data['maker_id'] = current_user.id
         new_transaction = Transaction.from_json(data)
         db.session.add(new_transaction)
@@ -389,14 +643,14 @@ def create_transaction(current_user):
 
 @api.route('/transactions/<int:id>', methods=['PUT'])
 @token_required
+@retry_on_lock
 def update_transaction(current_user, id):
     try:
         transaction = Transaction.query.filter_by(id=id).first()
     except:
         return jsonify({'message': 'The transaction doesn\'t exists.',
                         'code': 404})
-    maker = User.query.filter_by(id=transaction.maker_id).first()
-    if current_user is maker:
+    if transaction.maker_id == current_user.id:
         data = request.json
         transaction.update(data)
         db.session.commit()
@@ -407,17 +661,132 @@ def update_transaction(current_user, id):
 
 @api.route('/transactions/<int:id>', methods=['DELETE'])
 @token_required
+@retry_on_lock
 def delete_transaction(current_user, id):
     try:
         transaction = Transaction.query.filter_by(id=id).first()
     except:
         return jsonify({'message': 'The transaction doesn\'t exists!',
                         'code': 404})
-    maker = User.query.filter_by(id=transaction.maker_id).first()
-    if current_user is maker:
+    if transaction.maker_id == current_user.id:
         transaction.delete()
         db.session.commit()
         return jsonify({'message': 'The transaction has been deleted.',
                         'code': 200})
     return jsonify({'message': 'You can\'t delete the transactions of other users!',
                     'code': 403})
+
+
+# Job
+@api.route('/jobs/stats', methods=['GET'])
+@token_required
+def get_job_stats(current_user):
+    return jsonify(stats()), 200
+
+
+@api.route('/jobs/<int:id>', methods=['GET'])
+@token_required
+def get_job(current_user, id):
+    job = Job.query.filter_by(id=id).first()
+    if job is None:
+        return jsonify({'message': 'The job doesn\'t exists.',
+                        'code': 404})
+    if job.owner_id != current_user.id:
+        return jsonify({'message': 'You can\'t see the jobs of other users!',
+                        'code': 403})
+    return jsonify(job.to_json()), 200
+
+
+# Batch
+REFERENCE = re.compile(r'\$\{(\d+)\.([\w.]+)\}')
+
+
+def lookup_reference(results, index, field):
+    index = int(index)
+    if index >= len(results) or results[index]['status'] >= 400:
+        raise LookupError(index)
+    value = results[index]['body']
+    # Most errors are answered with 200 and their code in the body
+    if isinstance(value, dict) and isinstance(value.get('code'), int) and value['code'] >= 400:
+        raise LookupError(index)
+    try:
+        for part in field.split('.'):
+            value = value[int(part)] if isinstance(value, list) else value[part]
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise LookupError(index)
+    return value
+
+
+def resolve_references(value, results):
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        if match:
+            return lookup_reference(results, *match.groups())
+        return REFERENCE.sub(lambda m: str(lookup_reference(results, *m.groups())), value)
+    if isinstance(value, dict):
+        return {k: resolve_references(v, results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve_references(v, results) for v in value]
+    return value
+
+
+def dispatch_subrequest(sub, results):
+    prefix = url_for('.index').rstrip('/')
+    if not isinstance(sub, dict) or not isinstance(sub.get('path', ''), str) \
+            or not isinstance(sub.get('method', 'GET'), str) \
+            or not isinstance(sub.get('headers') or {}, dict):
+        return {'status': 400,
+                'body': {'message': 'A request needs a path and a method as strings!',
+                         'code': 400}}
+    try:
+        path = str(resolve_references(sub.get('path', ''), results))
+        body = resolve_references(sub.get('body'), results)
+    except LookupError as e:
+        return {'status': 424,
+                'body': {'message': 'The referenced request {} has failed!'.format(e.args[0]),
+                         'code': 424}}
+    if not path.startswith(prefix):
+        path = prefix + path
+    if path.rstrip('/') == url_for('.batch').rstrip('/'):
+        return {'status': 400,
+                'body': {'message': 'Batches can\'t be nested!',
+                         'code': 400}}
+    headers = {k: v for k, v in (sub.get('headers') or {}).items()
+               if k.lower() not in ('x-access-token', 'authorization')}
+    with current_app.test_request_context(path,
+                                          method=sub.get('method', 'GET').upper(),
+                                          json=body,
+                                          headers=headers,
+                                          base_url=request.host_url):
+        try:
+            response = current_app.full_dispatch_request()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Batch sub-request %s failed', path)
+            return {'status': 500,
+                    'body': {'message': 'The request has failed!',
+                             'code': 500}}
+    return {'status': response.status_code,
+            'body': response.get_json(silent=True)}
+
+
+@api.route('/batch', methods=['POST'])
+@token_required
+@idempotent
+def batch(current_user):
+    body = request.json if request.json is not None else {}
+    subrequests = body.get('requests') or [] if isinstance(body, dict) else None
+    if not isinstance(subrequests, list):
+        return jsonify({'message': 'A batch needs a list of requests!',
+                        'code': 400}), 400
+    if len(subrequests) > current_app.config['BATCH_MAX_REQUESTS']:
+        return jsonify({'message': 'Too many requests in the batch!',
+                        'code': 400}), 400
+    results = []
+    g.batch_user = current_user
+    try:
+        for sub in subrequests:
+            results.append(dispatch_subrequest(sub, results))
+    finally:
+        g.batch_user = None
+    return jsonify({'responses': results}), 200
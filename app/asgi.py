@@ -0,0 +1,148 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from . import database
+from .events import EVENT_STREAM
+from .ratelimit import overloaded
+from .routing import READ_METHODS
+from .server import warm_up
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    # The body has been read whole, chunked uploads included
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def call_wsgi(app, environ):
+    response = []
+    body = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return body.append
+
+    iterable = app(environ, start_response)
+    if EVENT_STREAM in environ:
+        # Left open, AsgiApp.stream sends it from the event loop
+        status, headers = response
+        return int(status.split(' ', 1)[0]), headers, iterable
+    try:
+        body.extend(iterable)
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+    status, headers = response
+    return int(status.split(' ', 1)[0]), headers, b''.join(body)
+
+
+class AsgiApp:
+    # Serves the Flask app to ASGI servers. Connections, slow uploads and
+    # slow downloads are handled by the event loop; a thread is only taken
+    # while the view runs. Reads and writes get separate pools so that
+    # writers waiting on the SQLite lock never starve the readers.
+
+    def __init__(self, app):
+        self.app = app
+        self.readers = ThreadPoolExecutor(app.config['ASGI_READ_THREADS'], thread_name_prefix='asgi-read')
+        self.writers = ThreadPoolExecutor(app.config['ASGI_WRITE_THREADS'], thread_name_prefix='asgi-write')
+        # Requests waiting for or running in a thread
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+
+    async def http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        environ = build_environ(scope, b''.join(body))
+        limit = self.app.config['SHED_MAX_IN_FLIGHT']
+        if limit and self.in_flight >= limit:
+            # The queue of the pools is where latency builds up here
+            status, headers, content = call_wsgi(overloaded(self.app), environ)
+        else:
+            executor = self.readers if scope['method'] in READ_METHODS else self.writers
+            self.in_flight += 1
+            try:
+                status, headers, content = await asyncio.get_running_loop().run_in_executor(
+                    executor, call_wsgi, self.app, environ)
+            finally:
+                self.in_flight -= 1
+        await send({'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers]})
+        if EVENT_STREAM in environ:
+            await self.stream(environ[EVENT_STREAM], content, receive, send)
+        else:
+            await send({'type': 'http.response.body', 'body': content})
+
+    async def stream(self, events, iterable, receive, send):
+        # An open event stream costs no thread, only its queue
+        disconnected = asyncio.ensure_future(self.disconnect(receive))
+        try:
+            async for chunk in events.chunks():
+                if disconnected.done():
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            iterable.close()
+
+    @staticmethod
+    async def disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await loop.run_in_executor(self.readers, warm_up, self.app)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.readers.shutdown()
+                self.writers.shutdown()
+                self.app.extensions['passwords'].shutdown()
+                for bind, engine in database.engines(self.app):
+                    engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,337 @@
+import json
+import threading
+import uuid
+from base64 import b64encode
+from collections import namedtuple
+from datetime import datetime
+from time import perf_counter
+
+from flask import url_for
+
+from . import db
+from .jobs import enqueue
+from .models import User, Wallet, ParentCategory, Category, Transaction
+from .seed import seed as bulk_seed
+
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench_password'
+
+Scenario = namedtuple('Scenario', 'endpoint method prepare')
+Call = namedtuple('Call', 'url body headers')
+
+
+def token_headers(token):
+    return {'x-access-token': token,
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'}
+
+
+def basic_headers(username, password):
+    credentials = b64encode('{}:{}'.format(username, password).encode('utf-8')).decode('utf-8')
+    return {'Authorization': 'Basic ' + credentials}
+
+
+def login(client, username, password):
+    response = client.post(url_for('api.login'), headers=basic_headers(username, password))
+    return response.get_json()['token']
+
+
+def new_refresh_token(client):
+    response = client.post(url_for('api.login'), headers=basic_headers(BENCH_USERNAME, BENCH_PASSWORD))
+    return response.get_json()['refresh_token']
+
+
+def seed(users, wallets, parent_categories, categories, transactions, random_seed=0):
+    """
+    Fill the database with users x wallets x parent categories x
+    categories x transactions rows, plus a bench user that owns one
+    of each, and return the bench user. The counts per parent can be
+    distributions, see app/seed.py.
+    """
+    bulk_seed(db.get_engine(), users, wallets, parent_categories, categories, transactions,
+              seed=random_seed)
+
+    user = User.from_json({'username': BENCH_USERNAME,
+                           'email': 'bench@example.com',
+                           'password': BENCH_PASSWORD,
+                           'confirmed': True})
+    db.session.add(user)
+    db.session.commit()
+    wallet = Wallet.from_json({'title': 'bench', 'currency': 'usd', 'initial_balance': 0,
+                               'owner_id': user.id})
+    db.session.add(wallet)
+    db.session.commit()
+    parent_category = ParentCategory.from_json({'title': 'bench', 'budget': 0, 'is_income': False,
+                                                'wallet_id': wallet.id})
+    db.session.add(parent_category)
+    db.session.commit()
+    category = Category.from_json({'title': 'bench', 'budget': 0, 'has_bills': False,
+                                   'parent_category_id': parent_category.id})
+    db.session.add(category)
+    db.session.commit()
+    for i in range(10):
+        db.session.add(Transaction.from_json({'amount': i, 'description': 'bench',
+                                              'category_id': category.id, 'maker_id': user.id}))
+    db.session.commit()
+    return user
+
+
+class Bench:
+    def __init__(self, client, user):
+        self.client = client
+        self.user_id = user.id
+        self.token = login(client, BENCH_USERNAME, BENCH_PASSWORD)
+        self.headers = token_headers(self.token)
+        self.refresh_token = new_refresh_token(client)
+        self.wallet_id = Wallet.query.filter_by(owner_id=user.id).first().id
+        self.parent_category_id = ParentCategory.query.filter_by(wallet_id=self.wallet_id).first().id
+        self.category_id = Category.query.filter_by(parent_category_id=self.parent_category_id).first().id
+        self.transaction_id = Transaction.query.filter_by(category_id=self.category_id).first().id
+        self.job_id = enqueue('delete_category', owner_id=user.id, id=0).id
+
+    def call(self, url, body=None, headers=None):
+        return Call(url, body, headers or self.headers)
+
+    def create(self, endpoint, body):
+        # Targets of the write benchmarks are made before the clock starts
+        response = self.client.post(url_for(endpoint), headers=self.headers, data=json.dumps(body))
+        return response.get_json()['id']
+
+    def new_user(self):
+        username = 'bench_{}'.format(uuid.uuid4().hex)
+        response = self.client.post(url_for('api.create_user'), headers=self.headers,
+                                    data=json.dumps({'username': username,
+                                                     'email': '{}@example.com'.format(username),
+                                                     'password': BENCH_PASSWORD}))
+        return response.get_json()['id'], login(self.client, username, BENCH_PASSWORD)
+
+    def new_wallet(self):
+        return self.create('api.create_wallet', {'title': 'bench', 'currency': 'usd', 'initial_balance': 0})
+
+    def new_parent_category(self):
+        return self.create('api.create_parent_category', {'title': 'bench', 'budget': 0, 'is_income': False,
+                                                          'wallet_id': self.wallet_id})
+
+    def new_category(self):
+        return self.create('api.create_category', {'title': 'bench', 'budget': 0, 'has_bills': False,
+                                                   'parent_category_id': self.parent_category_id})
+
+    def new_transaction(self):
+        return self.create('api.create_transaction', {'amount': 1, 'description': 'bench',
+                                                      'category_id': self.category_id})
+
+
+def _new_user_call(bench):
+    username = 'bench_{}'.format(uuid.uuid4().hex)
+    return bench.call(url_for('api.create_user'), {'username': username,
+                                                   'email': '{}@example.com'.format(username),
+                                                   'password': BENCH_PASSWORD})
+
+
+def _delete_user_call(bench):
+    user_id, token = bench.new_user()
+    return bench.call(url_for('api.delete_user', id=user_id), headers=token_headers(token))
+
+
+def _login_call(bench):
+    return bench.call(url_for('api.login'), headers=basic_headers(BENCH_USERNAME, BENCH_PASSWORD))
+
+
+SCENARIOS = [
+    Scenario('api.login', 'POST', _login_call),
+    Scenario('api.refresh_token', 'POST',
+             lambda b: b.call(url_for('api.refresh_token'), {'refresh_token': b.refresh_token})),
+    Scenario('api.revoke_refresh_token', 'DELETE',
+             lambda b: b.call(url_for('api.revoke_refresh_token'), {'refresh_token': new_refresh_token(b.client)})),
+    Scenario('api.index', 'GET', lambda b: b.call(url_for('api.index'))),
+    Scenario('api.get_changes', 'GET', lambda b: b.call(url_for('api.get_changes', since=0))),
+
+    Scenario('api.get_all_users', 'GET', lambda b: b.call(url_for('api.get_all_users'))),
+    Scenario('api.get_user', 'GET', lambda b: b.call(url_for('api.get_user', id=b.user_id))),
+    Scenario('api.get_user_transactions', 'GET',
+             lambda b: b.call(url_for('api.get_user_transactions', id=b.user_id))),
+    Scenario('api.get_user_dashboard', 'GET',
+             lambda b: b.call(url_for('api.get_user_dashboard', id=b.user_id))),
+    Scenario('api.create_user', 'POST', _new_user_call),
+    Scenario('api.update_user', 'PUT',
+             lambda b: b.call(url_for('api.update_user', id=b.user_id), {'first_name': 'bench'})),
+    Scenario('api.delete_user', 'DELETE', _delete_user_call),
+
+    Scenario('api.get_all_wallets', 'GET', lambda b: b.call(url_for('api.get_all_wallets'))),
+    Scenario('api.get_wallet', 'GET', lambda b: b.call(url_for('api.get_wallet', id=b.wallet_id))),
+    Scenario('api.get_wallet_tree', 'GET',
+             lambda b: b.call(url_for('api.get_wallet_tree', id=b.wallet_id, totals=1))),
+    Scenario('api.get_wallet_alerts', 'GET',
+             lambda b: b.call(url_for('api.get_wallet_alerts', id=b.wallet_id))),
+    Scenario('api.get_wallet_events', 'GET',
+             lambda b: b.call(url_for('api.get_wallet_events', id=b.wallet_id))),
+    Scenario('api.create_wallet', 'POST',
+             lambda b: b.call(url_for('api.create_wallet'),
+                              {'title': 'bench', 'currency': 'usd', 'initial_balance': 0})),
+    Scenario('api.update_wallet', 'PUT',
+             lambda b: b.call(url_for('api.update_wallet', id=b.wallet_id), {'title': 'bench'})),
+    Scenario('api.delete_wallet', 'DELETE',
+             lambda b: b.call(url_for('api.delete_wallet', id=b.new_wallet()))),
+
+    Scenario('api.get_all_parent_categories', 'GET',
+             lambda b: b.call(url_for('api.get_all_parent_categories'))),
+    Scenario('api.get_parent_category', 'GET',
+             lambda b: b.call(url_for('api.get_parent_category', id=b.parent_category_id))),
+    Scenario('api.create_parent_category', 'POST',
+             lambda b: b.call(url_for('api.create_parent_category'),
+                              {'title': 'bench', 'budget': 0, 'is_income': False, 'wallet_id': b.wallet_id})),
+    Scenario('api.update_parent_category', 'PUT',
+             lambda b: b.call(url_for('api.update_parent_category', id=b.parent_category_id),
+                              {'title': 'bench'})),
+    Scenario('api.delete_parent_category', 'DELETE',
+             lambda b: b.call(url_for('api.delete_parent_category', id=b.new_parent_category()))),
+
+    Scenario('api.get_all_categories', 'GET', lambda b: b.call(url_for('api.get_all_categories'))),
+    Scenario('api.get_category', 'GET', lambda b: b.call(url_for('api.get_category', id=b.category_id))),
+    Scenario('api.get_category_transactions', 'GET',
+             lambda b: b.call(url_for('api.get_category_transactions', id=b.category_id))),
+    Scenario('api.create_category', 'POST',
+             lambda b: b.call(url_for('api.create_category'),
+                              {'title': 'bench', 'budget': 0, 'has_bills': False,
+                               'parent_category_id': b.parent_category_id})),
+    Scenario('api.update_category', 'PUT',
+             lambda b: b.call(url_for('api.update_category', id=b.category_id), {'title': 'bench'})),
+    Scenario('api.delete_category', 'DELETE',
+             lambda b: b.call(url_for('api.delete_category', id=b.new_category()))),
+
+    Scenario('api.get_all_transactions', 'GET', lambda b: b.call(url_for('api.get_all_transactions'))),
+    Scenario('api.get_transaction', 'GET',
+             lambda b: b.call(url_for('api.get_transaction', id=b.transaction_id))),
+    Scenario('api.search_transactions', 'GET',
+             lambda b: b.call(url_for('api.search_transactions', q='ben'))),
+    Scenario('api.create_transaction', 'POST',
+             lambda b: b.call(url_for('api.create_transaction'),
+                              {'amount': 1, 'description': 'bench', 'category_id': b.category_id})),
+    Scenario('api.update_transaction', 'PUT',
+             lambda b: b.call(url_for('api.update_transaction', id=b.transaction_id), {'amount': 2})),
+    Scenario('api.delete_transaction', 'DELETE',
+             lambda b: b.call(url_for('api.delete_transaction', id=b.new_transaction()))),
+
+    Scenario('api.batch', 'POST',
+             lambda b: b.call(url_for('api.batch'),
+                              {'requests': [{'method': 'GET', 'path': '/wallets/{}'.format(b.wallet_id)},
+                                            {'method': 'GET', 'path': '/categories/{}'.format(b.category_id)}]})),
+    Scenario('api.get_job_stats', 'GET', lambda b: b.call(url_for('api.get_job_stats'))),
+    Scenario('api.get_job', 'GET', lambda b: b.call(url_for('api.get_job', id=b.job_id))),
+]
+
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def failed(response):
+    if response.status_code >= 400:
+        return True
+    body = response.get_json(silent=True)
+    return isinstance(body, dict) and isinstance(body.get('code'), int) and body['code'] >= 400
+
+
+def run_scenario(app, scenario, calls, concurrency):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def work(chunk):
+        client = app.test_client()
+        for call in chunk:
+            started = perf_counter()
+            try:
+                response = client.open(call.url, method=scenario.method, headers=call.headers,
+                                       data=json.dumps(call.body) if call.body is not None else None)
+                status = response.status_code if not failed(response) else max(response.status_code, 400)
+                # Event streams are timed until their first chunk, the rest
+                # of them is waiting for changes
+                next(iter(response.response), None)
+                response.close()
+            except Exception:
+                # The test client re-raises view errors when the app is testing
+                status = 500
+            latency = perf_counter() - started
+            with lock:
+                latencies.append(latency)
+                if status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=work, args=(calls[i::concurrency],)) for i in range(concurrency)]
+    started = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = perf_counter() - started
+
+    latencies.sort()
+    return {'requests': len(latencies),
+            'errors': len(errors),
+            'seconds': seconds,
+            'throughput': len(latencies) / seconds if seconds else 0.0,
+            'mean': sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            'p50': percentile(latencies, 0.50) * 1000 if latencies else 0.0,
+            'p95': percentile(latencies, 0.95) * 1000 if latencies else 0.0,
+            'p99': percentile(latencies, 0.99) * 1000 if latencies else 0.0}
+
+
+def run(app, user, requests=100, concurrency=4, endpoints=None):
+    """
+    Drive every scenario through the test client from concurrent threads.
+    Must run inside a request context of the app, so url_for works.
+    """
+    client = app.test_client()
+    bench = Bench(client, user)
+    results = {}
+    for scenario in SCENARIOS:
+        if endpoints and scenario.endpoint not in endpoints:
+            continue
+        calls = [scenario.prepare(bench) for i in range(requests)]
+        # The threads open their own sessions, this one must not hold locks
+        db.session.remove()
+        results[scenario.endpoint] = run_scenario(app, scenario, calls, concurrency)
+    return results
+
+
+def report(results, stream):
+    stream.write('{:<32} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}\n'.format(
+        'endpoint', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms'))
+    for endpoint, result in results.items():
+        stream.write('{:<32} {:>8.1f} {:>7} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}\n'.format(
+            endpoint, result['throughput'], result['errors'],
+            result['p50'], result['p95'], result['p99'], result['mean']))
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Return (endpoint, metric, before, after) for every endpoint whose p50 or
+    p95 latency grew, or whose throughput fell, by more than threshold.
+    """
+    regressions = []
+    for endpoint, result in results.items():
+        before = baseline.get(endpoint)
+        if before is None:
+            continue
+        for metric in ('p50', 'p95'):
+            if result[metric] > before[metric] * (1 + threshold):
+                regressions.append((endpoint, metric, before[metric], result[metric]))
+        if result['throughput'] < before['throughput'] * (1 - threshold):
+            regressions.append((endpoint, 'throughput', before['throughput'], result['throughput']))
+    return regressions
+
+
+def save(path, results, **settings):
+    with open(path, 'w') as f:
+        json.dump({'created_at': datetime.utcnow().isoformat(),
+                   'settings': settings,
+                   'endpoints': results}, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['endpoints']
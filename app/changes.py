@@ -0,0 +1,168 @@
+from datetime import datetime
+
+from flask import g, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.util import identity_key
+
+from . import db
+from .models import User, Wallet, ParentCategory, Category, Transaction, Change, IdSequence
+
+
+SYNCED_MODELS = (User, Wallet, ParentCategory, Category, Transaction)
+MODELS_BY_KIND = {model.__tablename__: model for model in SYNCED_MODELS}
+# Counter caches move without a change of their own, see app/counters.py
+COUNTER_COLUMNS = {'transactions_count', 'transactions_total', 'period', 'period_spent'}
+# Bookkeeping columns, changing only these is not a change for clients
+INTERNAL_COLUMNS = {'seq', 'updated_at', 'ownership_version', 'shard'} | COUNTER_COLUMNS
+PRIVATE_COLUMNS = {'password', 'ownership_version', 'shard'} | COUNTER_COLUMNS
+
+
+def _reserve(session, count):
+    # The counter row stays locked until the commit, so sequence numbers are
+    # committed in order and a reader never skips a change committed late.
+    table = IdSequence.__table__
+    connection = session.connection(mapper=IdSequence.__mapper__)
+    updated = connection.execute(table.update()
+                                 .where(table.c.name == Change.__tablename__)
+                                 .values(next_value=table.c.next_value + count))
+    if not updated.rowcount:
+        connection.execute(table.insert().values(name=Change.__tablename__, next_value=1 + count))
+        return 1
+    return connection.execute(db.select([table.c.next_value])
+                              .where(table.c.name == Change.__tablename__)).scalar() - count
+
+
+def _modified(obj):
+    state = inspect(obj)
+    return any(state.attrs[attr.key].history.has_changes()
+               for attr in state.mapper.column_attrs if attr.key not in INTERNAL_COLUMNS)
+
+
+def _wallet_owner(session, wallet_id, owners):
+    if wallet_id not in owners:
+        # Most writes are checked against the claims of the token already
+        owned = g.get('owned_wallets') if has_app_context() else None
+        if owned and wallet_id in owned:
+            owners[wallet_id] = g.user_id
+        else:
+            wallet = session.query(Wallet).get(wallet_id) if wallet_id else None
+            owners[wallet_id] = wallet.owner_id if wallet else None
+    return owners[wallet_id]
+
+
+def _parent_wallet_id(session, parent_category_id):
+    parent = session.query(ParentCategory).get(parent_category_id) if parent_category_id else None
+    return parent.wallet_id if parent else None
+
+
+def _wallet_id(session, obj):
+    # New wallets and users only get their ids in the flush, see write_changes
+    if isinstance(obj, (User, Wallet)):
+        return None
+    if isinstance(obj, ParentCategory):
+        return obj.wallet_id
+    if isinstance(obj, Category):
+        return _parent_wallet_id(session, obj.parent_category_id)
+    if obj.category_id is None:
+        return None
+    category = session.identity_map.get(identity_key(Category, obj.category_id))
+    if category is not None:
+        return _parent_wallet_id(session, category.parent_category_id)
+    return session.query(ParentCategory.wallet_id).join(Category) \
+        .filter(Category.id == obj.category_id).scalar()
+
+
+def _owner_id(session, obj, wallet_id, owners):
+    if isinstance(obj, User):
+        return None
+    if isinstance(obj, Wallet):
+        return obj.owner_id
+    if isinstance(obj, Transaction):
+        return obj.maker_id
+    return _wallet_owner(session, wallet_id, owners)
+
+
+def record_changes(session, flush_context, instances):
+    pending = [(obj, 'create') for obj in session.new if isinstance(obj, SYNCED_MODELS)]
+    pending += [(obj, 'update') for obj in session.dirty if isinstance(obj, SYNCED_MODELS) and _modified(obj)]
+    pending += [(obj, 'delete') for obj in session.deleted if isinstance(obj, SYNCED_MODELS)]
+    if not pending:
+        return
+    seq = _reserve(session, len(pending))
+    now = datetime.utcnow()
+    owners = {}
+    recorded = session.info.setdefault('changes', [])
+    for obj, op in pending:
+        if op != 'delete':
+            obj.seq = seq
+            obj.updated_at = now
+        wallet_id = _wallet_id(session, obj)
+        recorded.append((seq, obj, op, wallet_id, _owner_id(session, obj, wallet_id, owners), now))
+        seq += 1
+
+
+def write_changes(session, flush_context):
+    # New rows only have their ids once they are flushed
+    recorded = session.info.pop('changes', None)
+    if not recorded:
+        return
+    rows = [{'seq': seq, 'kind': obj.__tablename__, 'object_id': obj.id, 'op': op,
+             'wallet_id': obj.id if isinstance(obj, Wallet) else wallet_id,
+             'user_id': obj.id if isinstance(obj, User) else user_id,
+             'created_at': created_at}
+            for seq, obj, op, wallet_id, user_id, created_at in recorded]
+    session.connection(mapper=Change.__mapper__).execute(Change.__table__.insert(), rows)
+    # Event streams of these wallets are woken up once this commits
+    session.info.setdefault('changed_wallets', set()).update(row['wallet_id'] for row in rows)
+    # And so are the cached dashboards of these users, see app/dashboard.py
+    session.info.setdefault('changed_users', set()).update(row['user_id'] for row in rows)
+
+
+def discard_changes(session, previous_transaction):
+    session.info.pop('changes', None)
+    session.info.pop('changed_wallets', None)
+    session.info.pop('changed_users', None)
+
+
+event.listen(db.session, 'before_flush', record_changes)
+event.listen(db.session, 'after_flush', write_changes)
+event.listen(db.session, 'after_soft_rollback', discard_changes)
+
+
+def _data(obj):
+    return {column.key: getattr(obj, column.key)
+            for column in inspect(obj).mapper.column_attrs if column.key not in PRIVATE_COLUMNS}
+
+
+def changes_since(user, since, limit):
+    """
+    The changes to rows of the user after the sequence number since, at
+    most limit of them. An object changed more than once is only returned
+    with its last change, and with its current data unless it was deleted.
+    """
+    changes = Change.query.filter(Change.user_id == user.id, Change.seq > since) \
+        .order_by(Change.seq).limit(limit + 1).all()
+    more = len(changes) > limit
+    changes = changes[:limit]
+    latest = {}
+    for change in changes:
+        latest[change.kind, change.object_id] = change
+
+    ids = {}
+    for kind, object_id in latest:
+        ids.setdefault(kind, []).append(object_id)
+    rows = {}
+    for kind, object_ids in ids.items():
+        model = MODELS_BY_KIND[kind]
+        rows.update(((kind, obj.id), obj) for obj in model.query.filter(model.id.in_(object_ids)))
+
+    result = []
+    for key, change in sorted(latest.items(), key=lambda item: item[1].seq):
+        # Missing rows were deleted after this change, their tombstone follows
+        obj = None if change.op == 'delete' else rows.get(key)
+        result.append({'seq': change.seq,
+                       'type': change.kind,
+                       'id': change.object_id,
+                       'deleted': obj is None,
+                       'data': _data(obj) if obj is not None else None})
+    return result, changes[-1].seq if changes else since, more
@@ -0,0 +1,239 @@
+from datetime import datetime
+
+from sqlalchemy import event, select, text
+from sqlalchemy.orm.attributes import get_history
+
+from . import db
+from .models import Wallet, ParentCategory, Category, Transaction, Alert
+
+
+# Every level keeps the number and total of its transactions, and the total
+# of the current month. They are adjusted with relative updates right before
+# the commit that writes the transactions, so they commit or roll back together.
+UPDATE = ('UPDATE {table} SET '
+          'transactions_count = transactions_count + :count, '
+          'transactions_total = transactions_total + :total, '
+          'period_spent = CASE WHEN period = :period THEN period_spent ELSE 0 END + :spent, '
+          'period = :period '
+          'WHERE id = :id RETURNING {returning}')
+UPDATE_CATEGORY = text(UPDATE.format(table='categories',
+                                     returning='parent_category_id, title, budget, period_spent'))
+UPDATE_PARENT_CATEGORY = text(UPDATE.format(table='parent_categories',
+                                            returning='wallet_id, title, budget, period_spent'))
+UPDATE_WALLET = text(UPDATE.format(table='wallets', returning='owner_id'))
+
+
+def period_of(moment=None):
+    return (moment or datetime.utcnow()).strftime('%Y-%m')
+
+
+def _before_and_after(obj, key):
+    history = get_history(obj, key)
+    if history.has_changes():
+        return history.deleted[0] if history.deleted else None, history.added[0] if history.added else None
+    value = history.unchanged[0] if history.unchanged else getattr(obj, key)
+    return value, value
+
+
+def _counters(obj):
+    # What the row counted when it was loaded, counters only change on commit
+    spent = obj.period_spent if obj.period == period_of() else 0
+    return obj.transactions_count or 0, obj.transactions_total or 0, spent or 0
+
+
+def record_counters(session, flush_context, instances):
+    deltas = session.info.setdefault('counter_deltas', [])
+    moves = session.info.setdefault('counter_moves', [])
+    # Rows deleted in this commit take their counters away from their parent
+    gone = session.info.setdefault('counter_gone', {})
+    now = datetime.utcnow()
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            deltas.append((obj.category_id, 1, obj.amount or 0, period_of(obj.created_at or now)))
+    for obj in session.deleted:
+        if isinstance(obj, Transaction):
+            deltas.append((obj.category_id, -1, -(obj.amount or 0), period_of(obj.created_at or now)))
+        elif isinstance(obj, Category):
+            gone['categories', obj.id] = (_before_and_after(obj, 'parent_category_id')[0], _counters(obj))
+        elif isinstance(obj, ParentCategory):
+            gone['parent_categories', obj.id] = (_before_and_after(obj, 'wallet_id')[0], _counters(obj))
+        elif isinstance(obj, Wallet):
+            gone['wallets', obj.id] = (None, None)
+    for obj in session.dirty:
+        if isinstance(obj, Transaction):
+            old_category_id, category_id = _before_and_after(obj, 'category_id')
+            old_amount, amount = _before_and_after(obj, 'amount')
+            old_created_at, created_at = _before_and_after(obj, 'created_at')
+            if (old_category_id, old_amount, old_created_at) != (category_id, amount, created_at):
+                deltas.append((old_category_id, -1, -(old_amount or 0), period_of(old_created_at or now)))
+                deltas.append((category_id, 1, amount or 0, period_of(created_at or now)))
+        elif isinstance(obj, Category):
+            old_parent_category_id, parent_category_id = _before_and_after(obj, 'parent_category_id')
+            if old_parent_category_id != parent_category_id:
+                moves.append((obj.id, old_parent_category_id, parent_category_id))
+
+
+def _add(totals, key, count, total, spent):
+    if key is None:
+        return
+    counts = totals.setdefault(key, [0, 0, 0])
+    counts[0] += count
+    counts[1] += total
+    counts[2] += spent
+
+
+def _crossed(thresholds, budget, spent, delta):
+    # Only the highest threshold passed by this write is reported
+    if not budget or delta <= 0:
+        return None
+    passed = [threshold for threshold in thresholds if spent - delta <= budget * threshold < spent]
+    return max(passed) if passed else None
+
+
+def apply_counters(session):
+    # Deletes cascade over several autoflushes, so the counters are applied
+    # once per commit and rows deleted anywhere in it are skipped
+    session.flush()
+    deltas = session.info.pop('counter_deltas', None)
+    moves = session.info.pop('counter_moves', None)
+    gone = session.info.pop('counter_gone', None) or {}
+    if not deltas and not moves and not gone:
+        return
+    period = period_of()
+    thresholds = session.app.config['BUDGET_ALERT_THRESHOLDS']
+    connection = session.connection(mapper=Category.__mapper__)
+    alerts = []
+
+    categories = {}
+    for category_id, count, amount, amount_period in deltas or ():
+        _add(categories, category_id, count, amount, amount if amount_period == period else 0)
+    parent_categories = {}
+    wallets = {}
+    # Whatever a deleted row counted leaves its parent with it. Its own
+    # deltas of this commit then no longer matter, whether its transactions
+    # were deleted along or left behind.
+    for (table, _), (parent_id, counters) in gone.items():
+        if not any(counters or ()):
+            continue
+        if table == 'categories':
+            _add(parent_categories, parent_id, *[-value for value in counters])
+        elif table == 'parent_categories':
+            _add(wallets, parent_id, *[-value for value in counters])
+    for category_id, (count, total, spent) in categories.items():
+        if ('categories', category_id) in gone:
+            continue
+        row = connection.execute(UPDATE_CATEGORY, id=category_id, count=count, total=total,
+                                 spent=spent, period=period).first()
+        if row is None:
+            continue
+        _add(parent_categories, row.parent_category_id, count, total, spent)
+        threshold = _crossed(thresholds, row.budget, row.period_spent, spent)
+        if threshold is not None:
+            alerts.append(['categories', category_id, row.title, threshold, row.budget, row.period_spent,
+                           row.parent_category_id])
+
+    # A category that changes parents takes its counters along
+    for category_id, old_parent_category_id, parent_category_id in moves or ():
+        row = connection.execute(select([Category.__table__]).where(Category.id == category_id)).first()
+        if row is None:
+            continue
+        spent = row.period_spent if row.period == period else 0
+        _add(parent_categories, old_parent_category_id, -row.transactions_count, -row.transactions_total, -spent)
+        _add(parent_categories, parent_category_id, row.transactions_count, row.transactions_total, spent)
+
+    wallet_ids = {}
+    for parent_category_id, (count, total, spent) in parent_categories.items():
+        if ('parent_categories', parent_category_id) in gone:
+            continue
+        row = connection.execute(UPDATE_PARENT_CATEGORY, id=parent_category_id, count=count, total=total,
+                                 spent=spent, period=period).first()
+        if row is None:
+            continue
+        wallet_ids[parent_category_id] = row.wallet_id
+        _add(wallets, row.wallet_id, count, total, spent)
+        threshold = _crossed(thresholds, row.budget, row.period_spent, spent)
+        if threshold is not None:
+            alerts.append(['parent_categories', parent_category_id, row.title, threshold, row.budget,
+                           row.period_spent, parent_category_id])
+
+    owners = {}
+    for wallet_id, (count, total, spent) in wallets.items():
+        if ('wallets', wallet_id) in gone:
+            continue
+        row = connection.execute(UPDATE_WALLET, id=wallet_id, count=count, total=total,
+                                 spent=spent, period=period).first()
+        if row is not None:
+            owners[wallet_id] = row.owner_id
+
+    if alerts:
+        rows = []
+        for kind, object_id, title, threshold, budget, spent, parent_category_id in alerts:
+            wallet_id = wallet_ids.get(parent_category_id)
+            rows.append({'kind': kind, 'object_id': object_id, 'title': title, 'period': period,
+                         'threshold': threshold, 'budget': budget, 'spent': spent,
+                         'created_at': datetime.utcnow(), 'wallet_id': wallet_id,
+                         'user_id': owners.get(wallet_id)})
+        session.connection(mapper=Alert.__mapper__).execute(Alert.__table__.insert(), rows)
+        session.info.setdefault('budget_alerts', []).extend(rows)
+
+
+def report_alerts(session):
+    for alert in session.info.pop('budget_alerts', None) or ():
+        session.app.extensions['metrics'].inc('wallets_budget_alerts_total', {'type': alert['kind']})
+        session.app.logger.info('%s %s of wallet %s is at %d%% of its budget',
+                                alert['kind'], alert['object_id'], alert['wallet_id'],
+                                alert['spent'] * 100 / alert['budget'])
+
+
+def discard_counters(session, previous_transaction):
+    session.info.pop('counter_deltas', None)
+    session.info.pop('counter_moves', None)
+    session.info.pop('counter_gone', None)
+    session.info.pop('budget_alerts', None)
+
+
+event.listen(db.session, 'before_flush', record_counters)
+event.listen(db.session, 'before_commit', apply_counters)
+event.listen(db.session, 'after_commit', report_alerts)
+event.listen(db.session, 'after_soft_rollback', discard_counters)
+
+
+def _repair(connection, table, sums, period):
+    # The sums are grouped once and joined in, only rows that drifted are
+    # written, so the row count says how many
+    return connection.execute(text(
+        'UPDATE {table} SET transactions_count = s.count, transactions_total = s.total, '
+        'period_spent = s.spent, period = :period FROM ({sums}) AS s '
+        'WHERE {table}.id = s.id AND ({table}.period IS NOT :period '
+        'OR {table}.transactions_count IS NOT s.count OR {table}.transactions_total IS NOT s.total '
+        'OR {table}.period_spent IS NOT s.spent)'.format(table=table, sums=sums)), period=period).rowcount
+
+
+def _sums(table, child, key, count, total, spent):
+    # Every row of table with the sums of its children, zero without any
+    return ('SELECT p.id AS id, COALESCE(c.count, 0) AS count, COALESCE(c.total, 0) AS total, '
+            'COALESCE(c.spent, 0) AS spent FROM {table} p LEFT JOIN ('
+            'SELECT {key} AS parent_id, SUM({count}) AS count, SUM({total}) AS total, SUM({spent}) AS spent '
+            'FROM {child} GROUP BY {key}) c ON c.parent_id = p.id'
+            .format(table=table, child=child, key=key, count=count, total=total, spent=spent))
+
+
+def repair_counters(connection, now=None):
+    """
+    Recompute every counter from the transactions. Return the number of
+    categories, parent categories and wallets whose counters were off.
+    """
+    now = now or datetime.utcnow()
+    period = period_of(now)
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).strftime('%Y-%m-%d %H:%M:%S.%f')
+    this_month = "CASE WHEN created_at >= '{}' THEN amount ELSE 0 END".format(start)
+    return {
+        'categories': _repair(connection, 'categories', _sums(
+            'categories', 'transactions', 'category_id', '1', 'amount', this_month), period),
+        'parent_categories': _repair(connection, 'parent_categories', _sums(
+            'parent_categories', 'categories', 'parent_category_id',
+            'transactions_count', 'transactions_total', 'period_spent'), period),
+        'wallets': _repair(connection, 'wallets', _sums(
+            'wallets', 'parent_categories', 'wallet_id',
+            'transactions_count', 'transactions_total', 'period_spent'), period),
+    }
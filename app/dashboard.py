@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import current_app, url_for
+from sqlalchemy import case, event
+
+from . import db
+from .counters import period_of
+from .metrics import count_cache
+from .models import Wallet, ParentCategory, Category
+from .sharding import on_user_shard
+
+
+class DashboardCache:
+    # Dashboards of the users of this worker for DASHBOARD_TTL seconds.
+    # Commits of this worker drop the dashboards they change, those of other
+    # workers show up once the entry expires.
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, dashboard = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return dashboard
+
+    def set(self, user_id, dashboard, ttl, size):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + ttl, dashboard)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def month_start(now=None):
+    return (now or datetime.utcnow()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def build_dashboard(user):
+    """
+    The wallets of the user with their balance, the income and expense of
+    this month and the number of categories over budget this month, in two
+    queries however many wallets there are. Both only read counter caches.
+    """
+    period = period_of()
+    wallets = Wallet.query.filter_by(owner_id=user.id).order_by(Wallet.id).all()
+    this_month = case([(ParentCategory.period == period, ParentCategory.period_spent)], else_=0)
+    over_budget = db.and_(Category.parent_category_id == ParentCategory.id,
+                          Category.period == period,
+                          Category.budget > 0,
+                          Category.period_spent > Category.budget)
+    totals = db.session.query(ParentCategory.wallet_id, ParentCategory.is_income,
+                              ParentCategory.transactions_total, this_month, db.func.count(Category.id)) \
+        .join(Wallet, Wallet.id == ParentCategory.wallet_id) \
+        .outerjoin(Category, over_budget) \
+        .filter(Wallet.owner_id == user.id) \
+        .group_by(ParentCategory.id).all()
+
+    summaries = {wallet.id: {'url': url_for('api.get_wallet', id=wallet.id, _external=True),
+                             'id': wallet.id,
+                             'title': wallet.title,
+                             'currency': wallet.currency,
+                             'balance': wallet.initial_balance or 0,
+                             'transactions_count': wallet.transactions_count,
+                             'month_income': 0,
+                             'month_expense': 0,
+                             'categories_over_budget': 0}
+                 for wallet in wallets}
+    for wallet_id, is_income, total, month_total, categories_over_budget in totals:
+        summary = summaries[wallet_id]
+        if is_income:
+            summary['balance'] += total or 0
+            summary['month_income'] += month_total or 0
+        else:
+            summary['balance'] -= total or 0
+            summary['month_expense'] += month_total or 0
+            summary['categories_over_budget'] += categories_over_budget
+    return {'month_start': month_start(), 'wallets': list(summaries.values())}
+
+
+def dashboard(user):
+    cache = current_app.extensions['dashboards']
+    cached = cache.get(user.id)
+    count_cache('dashboard', cached is not None)
+    if cached is not None:
+        return cached
+    with on_user_shard(user):
+        result = build_dashboard(user)
+    cache.set(user.id, result, current_app.config['DASHBOARD_TTL'], current_app.config['DASHBOARD_CACHE_SIZE'])
+    return result
+
+
+def discard_dashboards(session):
+    user_ids = session.info.pop('changed_users', None)
+    if user_ids:
+        session.app.extensions['dashboards'].discard(user_ids)
+
+
+def init_app(app):
+    app.extensions['dashboards'] = DashboardCache()
+
+
+event.listen(db.session, 'after_commit', discard_dashboards)
@@ -0,0 +1,96 @@
+import random
+import time
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from . import db
+
+
+def engines(app):
+    yield None, db.get_engine(app)
+    for bind in app.config.get('SQLALCHEMY_BINDS') or {}:
+        yield bind, db.get_engine(app, bind)
+
+
+def set_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+        cursor.close()
+
+
+def init_app(app):
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    for bind, engine in engines(app):
+        if engine.dialect.name == 'sqlite':
+            set_pragmas(engine, pragmas)
+
+
+def is_locked(error):
+    return 'database is locked' in str(error.orig) or 'database is busy' in str(error.orig)
+
+
+def retry_on_lock(func):
+    # Reruns the whole view, because a failed flush discards the unit of work
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = current_app.config['SQLITE_LOCK_RETRIES']
+        backoff = current_app.config['SQLITE_LOCK_BACKOFF']
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt == retries or not is_locked(e):
+                    raise
+                db.session.rollback()
+                current_app.logger.warning('Database is locked, retrying %s (attempt %d)',
+                                           func.__name__, attempt + 1)
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def _execute(engine, statement):
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(statement)
+        rows = cursor.fetchall()
+        cursor.close()
+        connection.commit()
+        return rows
+    finally:
+        connection.close()
+
+
+def checkpoint(engine, mode='TRUNCATE'):
+    return _execute(engine, 'PRAGMA wal_checkpoint({})'.format(mode))
+
+
+def analyze(engine):
+    _execute(engine, 'ANALYZE')
+    return _execute(engine, 'PRAGMA optimize')
+
+
+def vacuum(engine):
+    return _execute(engine, 'VACUUM')
+
+
+def replicas(app):
+    for bind in app.config.get('SQLALCHEMY_REPLICA_BINDS') or []:
+        yield bind, db.get_engine(app, bind)
+
+
+def copy_database(source, target):
+    # Uses the SQLite online backup API, so the source stays writable
+    source_connection = source.raw_connection()
+    target_connection = target.raw_connection()
+    try:
+        source_connection.connection.backup(target_connection.connection)
+    finally:
+        target_connection.close()
+        source_connection.close()
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+
+from . import db
+from .models import Change
+
+
+TAIL_BATCH = 500
+# The WSGI environ key of the EventStream of a response
+EVENT_STREAM = 'wallets.event_stream'
+
+
+class Subscription:
+    def __init__(self, size):
+        self.messages = queue.Queue(size)
+        self.overflowed = False
+        # Set by streams served from an event loop, see EventStream.chunks
+        self.wake = None
+
+    def put(self, message):
+        try:
+            self.messages.put_nowait(message)
+        except queue.Full:
+            # A stream that can't keep up is told to start over
+            self.overflowed = True
+        if self.wake is not None:
+            self.wake()
+
+
+class Broker:
+    # Fans the changes of wallets out to their event streams. A single tail
+    # thread per process reads new rows of the changes table, which is how
+    # the commits of other workers arrive, and it only runs while somebody
+    # is subscribed. Commits of this process wake it up right away, those of
+    # other workers are seen within EVENTS_POLL_INTERVAL.
+
+    def __init__(self, app):
+        self.app = app
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_seq = 0
+
+    def subscribe(self, wallet_id, since):
+        """
+        Start receiving the changes of the wallet. Changes up to since are
+        never delivered by a tail started for this subscription.
+        """
+        subscription = Subscription(self.app.config['EVENTS_QUEUE_SIZE'])
+        with self._lock:
+            self._subscribers.setdefault(wallet_id, set()).add(subscription)
+            # A forked worker doesn't inherit the thread of its master
+            if self._thread is None or not self._thread.is_alive():
+                self._last_seq = since
+                self._thread = threading.Thread(target=self._run, name='events-tail', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, wallet_id, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(wallet_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[wallet_id]
+
+    def notify(self, wallet_ids):
+        with self._lock:
+            subscribed = any(wallet_id in self._subscribers for wallet_id in wallet_ids)
+        if subscribed:
+            self._wake.set()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        return
+                # Cleared first, so that a commit during the poll is not missed
+                self._wake.clear()
+                try:
+                    self._poll()
+                except Exception:
+                    self.app.logger.exception('Reading the changes table failed')
+                finally:
+                    db.session.remove()
+                self._wake.wait(self.app.config['EVENTS_POLL_INTERVAL'])
+
+    def _poll(self):
+        changes = Change.query.filter(Change.seq > self._last_seq) \
+            .order_by(Change.seq).limit(TAIL_BATCH).all()
+        if not changes:
+            return
+        with self._lock:
+            for change in changes:
+                for subscription in self._subscribers.get(change.wallet_id, ()):
+                    subscription.put(to_message(change))
+        self._last_seq = changes[-1].seq
+        if len(changes) == TAIL_BATCH:
+            self._wake.set()
+
+
+def to_message(change):
+    return {'seq': change.seq, 'op': change.op, 'type': change.kind, 'id': change.object_id}
+
+
+# Sent first, so the client and proxies see the stream open before any change
+OPEN = ': open\n\n'
+RESET = 'event: reset\ndata: {}\n\n'
+
+
+def format_message(message):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(message['seq'], message['op'], json.dumps(message))
+
+
+class EventStream:
+    # The text/event-stream of a wallet: the missed changes first, then the
+    # live ones. Comments are sent while idle so that proxies keep it open.
+    # After EVENTS_STREAM_SECONDS it ends, and the client reconnects with
+    # Last-Event-ID, possibly to a less busy worker. WSGI servers iterate it
+    # in a thread; the ASGI adapter waits for it on the event loop instead.
+
+    def __init__(self, broker, wallet_id, subscription, missed, since, heartbeat, seconds):
+        self.broker = broker
+        self.wallet_id = wallet_id
+        self.subscription = subscription
+        self.missed = missed
+        self.since = since
+        self.heartbeat = heartbeat
+        self.deadline = time.monotonic() + seconds
+
+    def _replay(self):
+        for message in self.missed:
+            self.since = message['seq']
+            yield format_message(message)
+
+    def _live(self, message):
+        # Changes of the replay may come again
+        if message['seq'] <= self.since:
+            return None
+        self.since = message['seq']
+        return format_message(message)
+
+    def _timeout(self):
+        return min(self.heartbeat, self.deadline - time.monotonic())
+
+    def __iter__(self):
+        try:
+            yield OPEN
+            yield from self._replay()
+            while not self.subscription.overflowed and self._timeout() > 0:
+                try:
+                    chunk = self._live(self.subscription.messages.get(timeout=self._timeout()))
+                except queue.Empty:
+                    chunk = ': keep-alive\n\n'
+                if chunk:
+                    yield chunk
+            if self.subscription.overflowed:
+                yield RESET
+        finally:
+            self.close()
+
+    async def chunks(self):
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        self.subscription.wake = lambda: loop.call_soon_threadsafe(wake.set)
+        yield OPEN
+        for chunk in self._replay():
+            yield chunk
+        while not self.subscription.overflowed and self._timeout() > 0:
+            try:
+                chunk = self._live(self.subscription.messages.get_nowait())
+            except queue.Empty:
+                wake.clear()
+                if not self.subscription.messages.empty():
+                    continue
+                try:
+                    await asyncio.wait_for(wake.wait(), max(self._timeout(), 0))
+                    continue
+                except asyncio.TimeoutError:
+                    chunk = ': keep-alive\n\n'
+            if chunk:
+                yield chunk
+        if self.subscription.overflowed:
+            yield RESET
+
+    def close(self):
+        self.broker.unsubscribe(self.wallet_id, self.subscription)
+
+
+def notify_commit(session):
+    wallet_ids = session.info.pop('changed_wallets', None)
+    if wallet_ids:
+        session.app.extensions['events'].notify(wallet_ids)
+
+
+def init_app(app):
+    app.extensions['events'] = Broker(app)
+
+
+event.listen(db.session, 'after_commit', notify_commit)
@@ -0,0 +1,232 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+from hashlib import sha256
+
+from flask import current_app, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .metrics import count_cache
+from .models import IdempotencyKey
+
+
+class ResponseCache:
+    # Completed responses never change, so every worker can keep its own LRU
+    # in front of the idempotency_keys table without invalidation.
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= datetime.utcnow():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, size):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_stored = 0
+
+
+def init_app(app):
+    app.extensions['idempotency_cache'] = ResponseCache()
+
+
+def get_cache():
+    return current_app.extensions['idempotency_cache']
+
+
+def _entry(row):
+    return {'fingerprint': row.fingerprint,
+            'status_code': row.status_code,
+            'body': row.body,
+            'expires_at': row.created_at + timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])}
+
+
+def fingerprint():
+    digest = sha256()
+    digest.update(request.method.encode('utf-8'))
+    digest.update(request.path.encode('utf-8'))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def replay(entry):
+    response = current_app.response_class(entry['body'],
+                                          status=entry['status_code'],
+                                          mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def in_progress():
+    response = jsonify({'message': 'A request with this idempotency key is in progress!',
+                        'code': 409})
+    response.status_code = 409
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+def mismatch():
+    response = jsonify({'message': 'The idempotency key was used for another request!',
+                        'code': 422})
+    response.status_code = 422
+    return response
+
+
+def lost():
+    # The request committed its writes, but its process died before it could
+    # store the response. Running it again would repeat them.
+    response = jsonify({'message': 'The request with this idempotency key was applied but its response was lost!',
+                        'code': 409})
+    response.status_code = 409
+    return response
+
+
+def purge_expired():
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+    count = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def _timed_out(row, now):
+    return row.created_at + timedelta(seconds=current_app.config['IDEMPOTENCY_LOCK_TIMEOUT']) <= now
+
+
+def _reserve(user_id, key, digest):
+    """
+    Return the stored row for a known key, or None after reserving the key
+    for the current request.
+    """
+    now = datetime.utcnow()
+    row = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+    if row is not None:
+        ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+        expired = row.created_at + ttl <= now
+        # Only a request that never committed its writes may run again
+        abandoned = row.status_code is None and not row.applied and _timed_out(row, now)
+        if not expired and not abandoned:
+            return row
+        db.session.delete(row)
+        db.session.flush()
+    db.session.add(IdempotencyKey(user_id=user_id, key=key, fingerprint=digest, created_at=now))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent retry reserved the key first
+        db.session.rollback()
+        return IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+    return None
+
+
+def _release(user_id, key):
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(user_id=user_id, key=key, status_code=None, applied=False) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+
+
+def mark_applied(session):
+    # Runs in every commit of the request, so the key is marked applied in
+    # the same transaction as its writes. Writes to a shard commit apart from
+    # the key, a crash between the two can still leave it unmarked.
+    pending = session.info.get('idempotency_key')
+    if pending is None:
+        return
+    user_id, key = pending
+    table = IdempotencyKey.__table__
+    session.execute(table.update()
+                    .where(db.and_(table.c.user_id == user_id, table.c.key == key,
+                                   table.c.status_code.is_(None)))
+                    .values(applied=True),
+                    mapper=IdempotencyKey.__mapper__)
+
+
+def _complete(user_id, key, response):
+    global _stored
+    row = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+    row.status_code = response.status_code
+    row.body = response.get_data(as_text=True)
+    entry = _entry(row)
+    db.session.commit()
+    get_cache().set((user_id, key), entry, current_app.config['IDEMPOTENCY_CACHE_SIZE'])
+    _stored += 1
+    if _stored % current_app.config['IDEMPOTENCY_PURGE_EVERY'] == 0:
+        purge_expired()
+
+
+def _restore_key(previous):
+    if previous is None:
+        db.session.info.pop('idempotency_key', None)
+    else:
+        db.session.info['idempotency_key'] = previous
+
+
+def idempotent(func):
+    @wraps(func)
+    def wrapper(current_user, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return func(current_user, *args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'message': 'The idempotency key is too long!',
+                            'code': 400}), 400
+
+        digest = fingerprint()
+        cache_key = (current_user.id, key)
+        entry = get_cache().get(cache_key)
+        count_cache('idempotency', entry is not None)
+        if entry is None:
+            row = _reserve(current_user.id, key, digest)
+            if row is not None:
+                if row.fingerprint != digest:
+                    return mismatch()
+                if row.status_code is None:
+                    return lost() if row.applied and _timed_out(row, datetime.utcnow()) else in_progress()
+                entry = _entry(row)
+                get_cache().set(cache_key, entry, current_app.config['IDEMPOTENCY_CACHE_SIZE'])
+        if entry is not None:
+            if entry['fingerprint'] != digest:
+                return mismatch()
+            return replay(entry)
+
+        # A sub-request of a batch has a key of its own, the batch's comes back after it
+        previous = db.session.info.get('idempotency_key')
+        db.session.info['idempotency_key'] = cache_key
+        try:
+            response = current_app.make_response(func(current_user, *args, **kwargs))
+        except Exception:
+            _restore_key(previous)
+            _release(current_user.id, key)
+            raise
+        _restore_key(previous)
+        if response.status_code >= 500:
+            _release(current_user.id, key)
+        else:
+            _complete(current_user.id, key, response)
+        return response
+    return wrapper
+
+
+event.listen(db.session, 'before_commit', mark_applied)
@@ -0,0 +1,104 @@
+import threading
+from collections import deque
+from datetime import datetime
+from time import perf_counter
+
+from flask import current_app, has_request_context, jsonify, request
+from flask.json import JSONEncoder
+from flask_sqlalchemy import get_debug_queries
+
+
+def add_timing(name, seconds):
+    if has_request_context():
+        timings = request.environ.setdefault('wallets.timings', {})
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+class TimedJSONEncoder(JSONEncoder):
+    def encode(self, o):
+        start = perf_counter()
+        try:
+            return JSONEncoder.encode(self, o)
+        finally:
+            add_timing('serialize', perf_counter() - start)
+
+
+class SlowRequestLog:
+    def __init__(self, size):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+
+def request_queries():
+    # The app context, and with it g and the recorded queries, can outlive a
+    # request (batch sub-requests, the test client). What belongs to a request
+    # is kept in its environ, so a batch counts the queries of its sub-requests
+    # and each sub-request only its own.
+    return get_debug_queries()[request.environ.get('wallets.query_offset', 0):]
+
+
+def server_timing(timings):
+    return ', '.join('{};dur={:.2f}'.format(name, seconds * 1000)
+                     for name, seconds in timings.items())
+
+
+def init_app(app):
+    app.json_encoder = TimedJSONEncoder
+    app.extensions['slow_requests'] = SlowRequestLog(app.config['SLOW_REQUEST_LOG_SIZE'])
+
+    @app.before_request
+    def start_timer():
+        request.environ['wallets.request_started'] = perf_counter()
+        request.environ['wallets.query_offset'] = len(get_debug_queries())
+        request.environ['wallets.timings'] = {}
+
+    @app.after_request
+    def record_queries(response):
+        started = request.environ.get('wallets.request_started')
+        if started is None:
+            return response
+        total = perf_counter() - started
+        queries = request_queries()
+        db_time = sum(query.duration for query in queries)
+        slowest = sorted(queries, key=lambda query: query.duration, reverse=True)
+        timings = dict(request.environ['wallets.timings'], db=db_time, total=total)
+        response.headers['Server-Timing'] = server_timing(timings)
+
+        config = current_app.config
+        current_app.logger.debug('%s %s: %d queries, db %.1f ms, total %.1f ms',
+                                 request.method, request.path, len(queries),
+                                 db_time * 1000, total * 1000)
+        if total >= config['SLOW_REQUEST_THRESHOLD'] or \
+                (slowest and slowest[0].duration >= config['SLOW_QUERY_THRESHOLD']):
+            current_app.logger.warning(
+                'Slow request %s %s: %d queries, db %.1f ms, total %.1f ms, slowest: %s',
+                request.method, request.path, len(queries), db_time * 1000, total * 1000,
+                '; '.join('{:.1f} ms {}'.format(query.duration * 1000, query.statement)
+                          for query in slowest[:config['QUERY_LOG_SLOWEST']]))
+            current_app.extensions['slow_requests'].append({
+                'method': request.method,
+                'path': request.full_path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'at': datetime.utcnow(),
+                'timings': timings,
+                'queries': [{'statement': query.statement,
+                             'parameters': repr(query.parameters),
+                             'duration': query.duration,
+                             'context': query.context}
+                            for query in queries],
+            })
+        return response
+
+    if app.config['SLOW_REQUEST_ENDPOINT']:
+        @app.route('/debug/slow-requests')
+        def slow_requests():
+            return jsonify({'slow_requests': current_app.extensions['slow_requests'].entries()})
@@ -0,0 +1,219 @@
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from . import db
+from .models import Job, User
+from .sharding import select_shard
+
+
+registry = {}
+
+
+class Task:
+    def __init__(self, func, max_attempts=3, concurrency=None):
+        self.func = func
+        self.max_attempts = max_attempts
+        self.concurrency = concurrency
+
+
+def task(name=None, max_attempts=3, concurrency=None):
+    """
+    Register a function as a background task.
+
+    concurrency limits how many jobs of this task run at once in one
+    worker process; the pool size limits the total.
+    """
+    def decorator(func):
+        registry[name or func.__name__] = Task(func, max_attempts, concurrency)
+        return func
+    return decorator
+
+
+def enqueue(name, owner_id=None, **kwargs):
+    job = Job(name=name,
+              args=json.dumps(kwargs),
+              status='queued',
+              attempts=0,
+              max_attempts=registry[name].max_attempts,
+              owner_id=owner_id)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+_running = Counter()
+_running_lock = threading.Lock()
+
+
+def _acquire(name):
+    limit = registry[name].concurrency
+    with _running_lock:
+        if limit is not None and _running[name] >= limit:
+            return False
+        _running[name] += 1
+        return True
+
+
+def _release(name):
+    with _running_lock:
+        _running[name] -= 1
+
+
+def _available_tasks():
+    with _running_lock:
+        return [name for name, t in registry.items()
+                if t.concurrency is None or _running[name] < t.concurrency]
+
+
+def claim_job():
+    names = _available_tasks()
+    if not names:
+        return None
+    now = datetime.utcnow()
+    job = Job.query.filter(Job.status == 'queued',
+                           Job.run_at <= now,
+                           Job.name.in_(names)) \
+        .order_by(Job.run_at, Job.id).first()
+    if job is None:
+        db.session.rollback()
+        return None
+    # Another worker may have taken the job between the select and the update
+    claimed = Job.query.filter_by(id=job.id, status='queued') \
+        .update({'status': 'running',
+                 'started_at': now,
+                 'attempts': Job.attempts + 1},
+                synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return None
+    if not _acquire(job.name):
+        # The concurrency limit was reached by a sibling thread meanwhile
+        Job.query.filter_by(id=job.id) \
+            .update({'status': 'queued',
+                     'attempts': Job.attempts - 1},
+                    synchronize_session=False)
+        db.session.commit()
+        return None
+    return job
+
+
+def run_job(job):
+    job_id = job.id
+    try:
+        select_shard(User.query.filter_by(id=job.owner_id).first())
+        result = registry[job.name].func(**json.loads(job.args))
+        job.status = 'succeeded'
+        job.result = json.dumps(result)
+        job.error = None
+        job.finished_at = datetime.utcnow()
+        # The task's changes and the job state are committed together
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job = Job.query.get(job_id)
+        job.error = repr(e)
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            backoff = current_app.config['JOBS_RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(seconds=backoff)
+        db.session.commit()
+    finally:
+        _release(job.name)
+    return job
+
+
+def run_once():
+    job = claim_job()
+    if job is None:
+        return None
+    return run_job(job)
+
+
+def requeue_stale():
+    timeout = current_app.config['JOBS_VISIBILITY_TIMEOUT']
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+    count = Job.query.filter(Job.status == 'running', Job.started_at < cutoff) \
+        .update({'status': 'queued', 'run_at': datetime.utcnow()},
+                synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def stats():
+    now = datetime.utcnow()
+    rows = db.session.query(Job.status,
+                            func.count(Job.id),
+                            func.sum(Job.attempts - 1),
+                            func.min(Job.created_at)) \
+        .group_by(Job.status).all()
+    data = {'queued': 0, 'running': 0, 'succeeded': 0, 'failed': 0,
+            'retries': 0, 'oldest_queued_seconds': None}
+    for status, count, retries, oldest in rows:
+        data[status] = count
+        data['retries'] += max(retries or 0, 0)
+        if status == 'queued' and oldest is not None:
+            data['oldest_queued_seconds'] = (now - oldest).total_seconds()
+    runtime = db.session.query(
+        func.avg((func.julianday(Job.finished_at) - func.julianday(Job.started_at)) * 86400)) \
+        .filter(Job.status == 'succeeded').scalar()
+    data['avg_runtime_seconds'] = runtime
+    return data
+
+
+class WorkerPool:
+    def __init__(self, app, size=None, poll_interval=None):
+        self.app = app
+        self.size = size or app.config['JOBS_WORKERS']
+        self.poll_interval = poll_interval or app.config['JOBS_POLL_INTERVAL']
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        with self.app.app_context():
+            requeue_stale()
+            db.session.remove()
+        for i in range(self.size):
+            thread = threading.Thread(target=self._work, name='job-worker-{}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run(self):
+        self.start()
+        try:
+            while not self._stop.is_set():
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def _work(self):
+        while not self._stop.is_set():
+            # A fresh app context per job keeps g and the recorded queries from piling up
+            with self.app.app_context():
+                try:
+                    job = run_once()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Job worker failed')
+                    job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+
+
+from . import tasks  # noqa: E402,F401
@@ -0,0 +1,275 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from time import perf_counter
+
+from flask import current_app, request
+from sqlalchemy import event
+
+from . import database
+from .instrumentation import request_queries
+
+
+METRICS = {
+    'wallets_requests_total': ('counter', 'Requests served, by endpoint, method and status.'),
+    'wallets_request_errors_total': ('counter', 'Requests answered with a 4xx or 5xx status or body code.'),
+    'wallets_request_duration_seconds': ('histogram', 'Time spent serving a request.'),
+    'wallets_request_db_seconds': ('histogram', 'Time a request spent in SQL statements.'),
+    'wallets_request_queries_total': ('counter', 'SQL statements issued by requests.'),
+    'wallets_rate_limited_total': ('counter', 'Requests refused with 429 by the rate limit.'),
+    'wallets_requests_shed_total': ('counter', 'Requests refused with 503 because the process was overloaded.'),
+    'wallets_budget_alerts_total': ('counter', 'Categories and parent categories that went over a budget threshold.'),
+    'wallets_cache_hits_total': ('counter', 'Cache lookups answered from the cache.'),
+    'wallets_cache_misses_total': ('counter', 'Cache lookups that missed.'),
+    'wallets_db_connections_opened_total': ('counter', 'DBAPI connections opened.'),
+    'wallets_db_connections_checked_out': ('gauge', 'Connections currently checked out of the pool.'),
+    'wallets_metrics_overhead_seconds_total': ('counter', 'Time spent recording metrics.'),
+}
+
+ERROR_BODY_LIMIT = 1024
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics:
+    # Every process records into its own registry. With a directory set,
+    # the registry is also written to <directory>/metrics-<pid>.json so that
+    # a scrape served by any prefork worker can add up all of them.
+
+    def __init__(self, buckets, directory=None, flush_interval=1.0):
+        self.buckets = tuple(sorted(buckets))
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # A forked worker must not report its parent's numbers as its own
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self._gauges = {}
+            self._flushed_at = 0.0
+
+    def clear_directory(self):
+        # Files of an earlier run would otherwise be added to this one
+        if not self.directory:
+            return
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def inc(self, name, labels=None, value=1):
+        key = _key(name, labels or {})
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add(self, name, labels=None, value=1):
+        key = _key(name, labels or {})
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets),
+                                                     'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'pid': os.getpid(),
+                    'counters': [[name, labels, value]
+                                 for (name, labels), value in self._counters.items()],
+                    'histograms': [[name, labels, dict(histogram, buckets=list(histogram['buckets']))]
+                                   for (name, labels), histogram in self._histograms.items()],
+                    'gauges': [[name, labels, value]
+                               for (name, labels), value in self._gauges.items()]}
+
+    def flush(self, force=False):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        self._flushed_at = now
+        snapshot = self.snapshot()
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path, os.path.join(self.directory, 'metrics-{}.json'.format(snapshot['pid'])))
+
+    def snapshots(self):
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def collect(self):
+        counters, histograms, gauges = {}, {}, {}
+        for snapshot in self.snapshots():
+            # Counters of exited workers still count, their gauges don't
+            alive = snapshot['pid'] == os.getpid() or _alive(snapshot['pid'])
+            for name, labels, value in snapshot['counters']:
+                key = _key(name, dict(labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in snapshot['histograms']:
+                key = _key(name, dict(labels))
+                total = histograms.setdefault(key, {'buckets': [0] * len(self.buckets),
+                                                    'sum': 0.0, 'count': 0})
+                total['buckets'] = [a + b for a, b in zip(total['buckets'], value['buckets'])]
+                total['sum'] += value['sum']
+                total['count'] += value['count']
+            if alive:
+                for name, labels, value in snapshot['gauges']:
+                    if self.directory:
+                        labels = list(labels) + [['pid', str(snapshot['pid'])]]
+                    gauges[_key(name, dict(labels))] = value
+        return counters, histograms, gauges
+
+    def render(self):
+        counters, histograms, gauges = self.collect()
+        samples = {}
+        for (name, labels), value in sorted(list(counters.items()) + list(gauges.items())):
+            samples.setdefault(name, []).append('{}{} {}'.format(name, _labels(labels), _number(value)))
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = samples.setdefault(name, [])
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', _number(bound)),)), count))
+            lines.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', '+Inf'),)), histogram['count']))
+            lines.append('{}_sum{} {}'.format(name, _labels(labels), _number(histogram['sum'])))
+            lines.append('{}_count{} {}'.format(name, _labels(labels), histogram['count']))
+        output = []
+        for name in sorted(samples):
+            kind, help_text = METRICS.get(name, ('untyped', name))
+            output.append('# HELP {} {}'.format(name, help_text))
+            output.append('# TYPE {} {}'.format(name, kind))
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def error_status(response):
+    """
+    The status of a failed response, or None. Most errors are answered with
+    200 and their code in a small JSON body, bigger bodies aren't parsed.
+    """
+    if response.status_code >= 400:
+        return response.status_code
+    if not response.is_json or response.is_streamed \
+            or (response.calculate_content_length() or 0) > ERROR_BODY_LIMIT:
+        return None
+    body = response.get_json(silent=True)
+    if isinstance(body, dict) and isinstance(body.get('code'), int) and body['code'] >= 400:
+        return body['code']
+    return None
+
+
+def count_cache(cache, hit):
+    current_app.extensions['metrics'].inc('wallets_cache_hits_total' if hit else 'wallets_cache_misses_total',
+                                          {'cache': cache})
+
+
+def watch_pool(metrics, bind, engine):
+    labels = {'bind': bind or 'default'}
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        metrics.inc('wallets_db_connections_opened_total', labels)
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.add('wallets_db_connections_checked_out', labels, 1)
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        metrics.add('wallets_db_connections_checked_out', labels, -1)
+
+
+def init_app(app):
+    directory = app.config.get('METRICS_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    metrics = app.extensions['metrics'] = Metrics(app.config['METRICS_BUCKETS'],
+                                                  directory,
+                                                  app.config['METRICS_FLUSH_INTERVAL'])
+    for bind, engine in database.engines(app):
+        watch_pool(metrics, bind, engine)
+
+    @app.before_request
+    def start_metrics():
+        # Kept in the environ, batch sub-requests share g with their batch
+        request.environ['wallets.metrics_started'] = perf_counter()
+
+    @app.after_request
+    def record_metrics(response):
+        started = request.environ.get('wallets.metrics_started')
+        if started is None:
+            return response
+        recording_started = perf_counter()
+        metrics = current_app.extensions['metrics']
+        endpoint = request.endpoint or 'unmatched'
+        status = response.status_code
+        metrics.inc('wallets_requests_total',
+                    {'endpoint': endpoint, 'method': request.method, 'status': str(status)})
+        error = error_status(response)
+        if error is not None:
+            metrics.inc('wallets_request_errors_total', {'endpoint': endpoint, 'status': str(error)})
+        metrics.observe('wallets_request_duration_seconds', {'endpoint': endpoint},
+                        recording_started - started)
+        queries = request_queries()
+        metrics.inc('wallets_request_queries_total', {'endpoint': endpoint}, len(queries))
+        metrics.observe('wallets_request_db_seconds', {'endpoint': endpoint},
+                        sum(query.duration for query in queries))
+        metrics.inc('wallets_metrics_overhead_seconds_total', {}, perf_counter() - recording_started)
+        metrics.flush()
+        return response
+
+    if app.config['METRICS_ENDPOINT']:
+        @app.route('/metrics', endpoint='metrics')
+        def export_metrics():
+            return current_app.response_class(current_app.extensions['metrics'].render(),
+                                              mimetype='text/plain; version=0.0.4')
@@ -1,9 +1,14 @@
-from datetime import datetime
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta
+from json import loads
 
-from flask import url_for
+from flask import current_app, url_for
 from werkzeug.security import generate_password_hash
 
 from app import db
+from .passwords import hash_password
 
 
 class Role(db.Model):
@@ -28,6 +33,11 @@ class User(db.Model):
     first_name = db.Column(db.String(64))
     last_name = db.Column(db.String(64))
     date_joined = db.Column(db.DateTime(), default=datetime.utcnow)
+    shard = db.Column(db.String(64))
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+    seq = db.Column(db.Integer)
+    # Bumped whenever a wallet of the user is added or removed
+    ownership_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
     wallets = db.relationship('Wallet', backref='owner', lazy='dynamic')
@@ -38,7 +48,7 @@ class User(db.Model):
         user = User()
         user.username = data.get('username')
         user.email = data.get('email')
-        user.password = generate_password_hash(data.get('password'))
+        user.password = hash_password(data['password']) if data.get('password') else None
         user.first_name = data.get('first_name')
         user.last_name = data.get('last_name')
         user.confirmed = data.get('confirmed', False)
@@ -66,7 +76,10 @@ class User(db.Model):
             except IntegrityError:
                 db.session.rollback()
 
-    def to_json(self):
+    def to_json(self, transactions_count=None):
+        if transactions_count is None:
+            transactions_count = db.session.query(db.func.count(Transaction.id)) \
+                .filter(Transaction.maker_id == self.id).scalar()
         json = {
             'url': url_for('api.get_user', id=self.id, _external=True),
             'id': self.id,
@@ -79,15 +92,16 @@ class User(db.Model):
             'date_joined': self.date_joined,
             'wallets': [url_for('api.get_wallet', id=wallet.id, _external=True)
                         for wallet in self.wallets],
-            'transactions': [url_for('api.get_transaction', id=transaction.id, _external=True)
-                             for transaction in self.transactions],
+            'transactions': url_for('api.get_user_transactions', id=self.id, _external=True),
+            'transactions_count': transactions_count,
         }
         return json
 
     def update(self, data):
         self.username = data.get('username', self.username)
         self.email = data.get('email', self.email)
-        self.password = generate_password_hash(data.get('password')) or self.password
+        if data.get('password'):
+            self.password = hash_password(data['password'])
         self.first_name = data.get('first_name', self.first_name)
         self.last_name = data.get('last_name', self.last_name)
         return self
@@ -96,6 +110,7 @@ class User(db.Model):
         wallets = Wallet.query.filter_by(owner_id=self.id).all()
         for w in wallets:
             w.delete()
+        RefreshToken.revoke_all(self.id)
         db.session.delete(self)
 
     def __repr__(self):
@@ -104,11 +119,20 @@ class User(db.Model):
 
 class Wallet(db.Model):
     __tablename__ = 'wallets'
+    __table_args__ = {'info': {'sharded': True}}
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64))
     created_at = db.Column(db.DateTime(), default=datetime.utcnow)
     currency = db.Column(db.String(64))
     initial_balance = db.Column(db.Float(precision=10), default=0.00)
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+    seq = db.Column(db.Integer)
+    # Counter caches kept by app/counters.py, see 'manage.py repair_counters'.
+    # period_spent is the total of the month in period, stale for older months.
+    transactions_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    transactions_total = db.Column(db.Float(precision=10), nullable=False, default=0, server_default='0')
+    period = db.Column(db.String(7))
+    period_spent = db.Column(db.Float(precision=10), nullable=False, default=0, server_default='0')
 
     owner_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     parent_categories = db.relationship('ParentCategory', backref='wallet', lazy='dynamic')
@@ -173,12 +197,21 @@ class Wallet(db.Model):
 
 class ParentCategory(db.Model):
     __tablename__ = 'parent_categories'
+    __table_args__ = {'info': {'sharded': True}}
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64))
     budget = db.Column(db.Float(precision=10), default=0.00)
     is_income = db.Column(db.Boolean, default=False)
-
-    wallet_id = db.Column(db.Integer, db.ForeignKey('wallets.id'))
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+    seq = db.Column(db.Integer)
+    # Counter caches kept by app/counters.py, see 'manage.py repair_counters'.
+    # period_spent is the total of the month in period, stale for older months.
+    transactions_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    transactions_total = db.Column(db.Float(precision=10), nullable=False, default=0, server_default='0')
+    period = db.Column(db.String(7))
+    period_spent = db.Column(db.Float(precision=10), nullable=False, default=0, server_default='0')
+
+    wallet_id = db.Column(db.Integer, db.ForeignKey('wallets.id'), index=True)
     categories = db.relationship('Category', backref='parent_category', lazy='dynamic')
 
     @staticmethod
@@ -238,12 +271,21 @@ class ParentCategory(db.Model):
 
 class Category(db.Model):
     __tablename__ = 'categories'
+    __table_args__ = {'info': {'sharded': True}}
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64))
     budget = db.Column(db.Float(precision=10), default=0.00)
     has_bills = db.Column(db.Boolean, default=False)
-
-    parent_category_id = db.Column(db.ForeignKey('parent_categories.id'))
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+    seq = db.Column(db.Integer)
+    # Counter caches kept by app/counters.py, see 'manage.py repair_counters'.
+    # period_spent is the total of the month in period, stale for older months.
+    transactions_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    transactions_total = db.Column(db.Float(precision=10), nullable=False, default=0, server_default='0')
+    period = db.Column(db.String(7))
+    period_spent = db.Column(db.Float(precision=10), nullable=False, default=0, server_default='0')
+
+    parent_category_id = db.Column(db.ForeignKey('parent_categories.id'), index=True)
     transactions = db.relationship('Transaction', backref='category', lazy='dynamic')
 
     @staticmethod
@@ -280,8 +322,8 @@ class Category(db.Model):
             'budget': self.budget,
             'has_bills': self.has_bills,
             'parent_category': url_for('api.get_parent_category', id=self.parent_category_id, _external=True),
-            'transactions': [url_for('api.get_transaction', id=transaction.id, _external=True)
-                             for transaction in self.transactions],
+            'transactions': url_for('api.get_category_transactions', id=self.id, _external=True),
+            'transactions_count': self.transactions_count,
         }
         return json
 
@@ -304,13 +346,16 @@ class Category(db.Model):
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
+    __table_args__ = {'info': {'sharded': True}}
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float(precision=10), default=0.00)
     description = db.Column(db.Text())
     created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime(), default=datetime.utcnow, onupdate=datetime.utcnow)
+    seq = db.Column(db.Integer)
 
-    category_id = db.Column(db.ForeignKey('categories.id'))
-    maker_id = db.Column(db.ForeignKey('users.id'))
+    category_id = db.Column(db.ForeignKey('categories.id'), index=True)
+    maker_id = db.Column(db.ForeignKey('users.id'), index=True)
 
     @staticmethod
     def from_json(data):
@@ -349,7 +394,8 @@ class Transaction(db.Model):
             'amount': self.amount,
             'description': self.description,
             'created_at': self.created_at,
-            'category': url_for('api.get_category', id=self.category_id, _external=True),
+            'category': url_for('api.get_category', id=self.category_id, _external=True)
+            if self.category_id is not None else None,
             'maker': url_for('api.get_user', id=self.maker_id, _external=True),
         }
         return json
@@ -365,3 +411,173 @@ class Transaction(db.Model):
 
     def __repr__(self):
         return '{} {}'.format(self.amount, self.category)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64))
+    args = db.Column(db.Text())
+    status = db.Column(db.String(16), default='queued')
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    result = db.Column(db.Text())
+    error = db.Column(db.Text())
+    created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+    run_at = db.Column(db.DateTime(), default=datetime.utcnow)
+    started_at = db.Column(db.DateTime())
+    finished_at = db.Column(db.DateTime())
+
+    owner_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+
+    def to_json(self):
+        json = {
+            'url': url_for('api.get_job', id=self.id, _external=True),
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'result': loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        return json
+
+    def __repr__(self):
+        return '{} {}'.format(self.name, self.status)
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),)
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255))
+    user_id = db.Column(db.Integer)
+    fingerprint = db.Column(db.String(64))
+    status_code = db.Column(db.Integer)
+    body = db.Column(db.Text())
+    # Set in the commit of the request's writes, see app/idempotency.py
+    applied = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    created_at = db.Column(db.DateTime(), default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return '{} {}'.format(self.user_id, self.key)
+
+
+class IdSequence(db.Model):
+    __tablename__ = 'id_sequences'
+    name = db.Column(db.String(64), primary_key=True)
+    next_value = db.Column(db.Integer, default=1)
+
+    def __repr__(self):
+        return '{} {}'.format(self.name, self.next_value)
+
+
+class RefreshToken(db.Model):
+    __tablename__ = 'refresh_tokens'
+    id = db.Column(db.Integer, primary_key=True)
+    # Only an HMAC of the token is stored, so a leaked table is useless
+    token_hash = db.Column(db.String(64), unique=True, index=True)
+    created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime())
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+
+    @staticmethod
+    def hash(token):
+        return hmac.new(current_app.config['SECRET_KEY'].encode('utf-8'),
+                        token.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    @staticmethod
+    def issue(user_id):
+        # Every login leaves a token behind, so those of the user that expired go
+        RefreshToken.query.filter(RefreshToken.user_id == user_id, RefreshToken.expires_at <= datetime.utcnow()) \
+            .delete(synchronize_session=False)
+        token = secrets.token_urlsafe(32)
+        db.session.add(RefreshToken(
+            token_hash=RefreshToken.hash(token),
+            user_id=user_id,
+            expires_at=datetime.utcnow() + timedelta(days=current_app.config['REFRESH_TOKEN_DAYS'])))
+        return token
+
+    @staticmethod
+    def lookup(token):
+        refresh_token = RefreshToken.query.filter_by(token_hash=RefreshToken.hash(token)).first()
+        if refresh_token is None or refresh_token.expires_at <= datetime.utcnow():
+            return None
+        return refresh_token
+
+    @staticmethod
+    def revoke_all(user_id):
+        RefreshToken.query.filter_by(user_id=user_id).delete()
+
+    @staticmethod
+    def purge_expired():
+        return RefreshToken.query.filter(RefreshToken.expires_at <= datetime.utcnow()) \
+            .delete(synchronize_session=False)
+
+    def __repr__(self):
+        return '{} {}'.format(self.user_id, self.expires_at)
+
+
+class Change(db.Model):
+    # One row per insert, update or delete of a synced row, in commit order.
+    # Deletes leave a tombstone here, the row itself is gone.
+    __tablename__ = 'changes'
+    __table_args__ = (db.Index('ix_changes_user_id_seq', 'user_id', 'seq'),
+                      db.Index('ix_changes_wallet_id_seq', 'wallet_id', 'seq'))
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    kind = db.Column(db.String(64))
+    object_id = db.Column(db.Integer)
+    # create, update or delete
+    op = db.Column(db.String(8))
+    created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer)
+    # The wallet the row is or belongs to, none for users
+    wallet_id = db.Column(db.Integer)
+
+    def __repr__(self):
+        return '{} {} {}'.format(self.seq, self.kind, self.object_id)
+
+
+class Alert(db.Model):
+    # Written in the flush that takes the spending of a category or parent
+    # category over a threshold of its monthly budget, see app/counters.py
+    __tablename__ = 'alerts'
+    __table_args__ = (db.Index('ix_alerts_wallet_id_id', 'wallet_id', 'id'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64))
+    object_id = db.Column(db.Integer)
+    title = db.Column(db.String(64))
+    period = db.Column(db.String(7))
+    # The fraction of the budget that was crossed
+    threshold = db.Column(db.Float(precision=10))
+    budget = db.Column(db.Float(precision=10))
+    spent = db.Column(db.Float(precision=10))
+    created_at = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    wallet_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer)
+
+    def to_json(self):
+        json = {
+            'id': self.id,
+            'type': self.kind,
+            'object_id': self.object_id,
+            'title': self.title,
+            'period': self.period,
+            'threshold': self.threshold,
+            'budget': self.budget,
+            'spent': self.spent,
+            'created_at': self.created_at,
+            'wallet': url_for('api.get_wallet', id=self.wallet_id, _external=True),
+        }
+        return json
+
+    def __repr__(self):
+        return '{} {} {}'.format(self.kind, self.object_id, self.threshold)
@@ -0,0 +1,67 @@
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+
+from . import db
+from .metrics import count_cache
+from .models import User, Wallet
+from .sharding import on_user_shard
+
+
+def owned_wallet_ids(user):
+    with on_user_shard(user):
+        return sorted(id for id, in db.session.query(Wallet.id).filter_by(owner_id=user.id))
+
+
+def claims(user):
+    """
+    The claims an access token carries about what the user owns: the ids
+    of their wallets and the ownership version those ids were read at.
+    Users with more than TOKEN_MAX_WALLETS wallets get none and are
+    always checked against the database.
+    """
+    wallet_ids = owned_wallet_ids(user)
+    if len(wallet_ids) > current_app.config['TOKEN_MAX_WALLETS']:
+        return {}
+    return {'wallets': wallet_ids, 'ov': user.ownership_version}
+
+
+def load_claims(user, data):
+    # The claims hold only while no wallet of the user has been added or
+    # removed since the token was issued
+    if user is not None and 'wallets' in data and data.get('ov') == user.ownership_version:
+        g.owned_wallets = frozenset(data['wallets'])
+    else:
+        g.owned_wallets = None
+
+
+def owns_wallet(user, wallet_id):
+    owned = g.get('owned_wallets')
+    count_cache('ownership', owned is not None)
+    if owned is None:
+        owned = g.owned_wallets = frozenset(owned_wallet_ids(user))
+    return wallet_id in owned
+
+
+def bump_ownership_versions(session, flush_context, instances):
+    owner_ids = set()
+    for wallet in session.new | session.deleted:
+        if isinstance(wallet, Wallet):
+            owner_ids.add(wallet.owner_id)
+    for wallet in session.dirty:
+        if isinstance(wallet, Wallet):
+            history = get_history(wallet, 'owner_id')
+            owner_ids.update(history.added + history.deleted)
+    owner_ids.discard(None)
+    if not owner_ids:
+        return
+    for owner_id in owner_ids:
+        user = session.query(User).get(owner_id)
+        if user is not None and user not in session.deleted:
+            # Incremented in SQL so that concurrent writers never lose a bump
+            user.ownership_version = User.ownership_version + 1
+    if has_app_context():
+        g.pop('owned_wallets', None)
+
+
+event.listen(db.session, 'before_flush', bump_ownership_versions)
@@ -0,0 +1,71 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .instrumentation import add_timing
+
+
+class PasswordHasher:
+    # Password hashes are slow on purpose. Computing them in a few worker
+    # processes keeps them from holding the GIL of the request workers and
+    # bounds how many run at once.
+
+    def __init__(self, method, workers):
+        self.method = method
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            # A forked server worker must not use the pool of its master
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def run(self, func, *args):
+        started = perf_counter()
+        try:
+            if not self.workers:
+                return func(*args)
+            return self.executor().submit(func, *args).result()
+        finally:
+            add_timing('password', perf_counter() - started)
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # Werkzeug hashes start with the method they were made with
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+
+def init_app(app):
+    app.extensions['passwords'] = PasswordHasher(app.config['PASSWORD_METHOD'], app.config['PASSWORD_WORKERS'])
+
+
+def hash_password(password):
+    return current_app.extensions['passwords'].hash(password)
+
+
+def verify_password(password_hash, password):
+    return current_app.extensions['passwords'].verify(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    return current_app.extensions['passwords'].needs_rehash(password_hash)
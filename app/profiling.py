@@ -0,0 +1,87 @@
+import cProfile
+import glob
+import hmac
+import itertools
+import os
+import pstats
+import random
+import sys
+import time
+
+from werkzeug.exceptions import HTTPException
+
+
+class ProfilerMiddleware:
+    # Runs a request under cProfile when it carries PROFILE_HEADER with the
+    # PROFILE_TOKEN, or when it falls into PROFILE_SAMPLE_RATE. Every profile
+    # is dumped into PROFILE_DIR, which keeps the newest PROFILE_KEEP files.
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self._sequence = itertools.count()
+
+    def requested(self, environ):
+        token = self.app.config.get('PROFILE_TOKEN')
+        header = environ.get('HTTP_' + self.app.config['PROFILE_HEADER'].upper().replace('-', '_'))
+        # WSGI headers are latin-1 strings, compare_digest only takes ASCII ones
+        return bool(token and header and hmac.compare_digest(header.encode('latin-1'), token.encode('utf-8')))
+
+    def sampled(self):
+        rate = self.app.config['PROFILE_SAMPLE_RATE']
+        return rate > 0 and random.random() < rate
+
+    def endpoint(self, environ):
+        try:
+            endpoint, values = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return 'unmatched'
+        return endpoint
+
+    def __call__(self, environ, start_response):
+        if not (self.requested(environ) or self.sampled()):
+            return self.wsgi_app(environ, start_response)
+
+        name = '{:.0f}-{}-{}-{}.prof'.format(time.time() * 1000, os.getpid(), next(self._sequence),
+                                             self.endpoint(environ))
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append(('X-Profile-Id', name))
+            return start_response(status, headers, exc_info)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(self.wsgi_app, environ, profiled_start_response)
+        finally:
+            self.save(profile, name)
+
+    def save(self, profile, name):
+        directory = self.app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        profile.dump_stats(os.path.join(directory, name))
+        paths = profiles(directory)
+        for path in paths[:max(len(paths) - self.app.config['PROFILE_KEEP'], 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def profiles(directory, endpoint=None):
+    # Named <milliseconds>-<pid>-<sequence>-<endpoint>.prof, oldest first
+    pattern = '*-{}.prof'.format(endpoint) if endpoint else '*.prof'
+    return sorted(glob.glob(os.path.join(directory, pattern)),
+                  key=lambda path: [int(part) for part in os.path.basename(path).split('-', 3)[:3]])
+
+
+def summarize(directory, endpoint=None, sort='cumulative', limit=20, stream=None):
+    paths = profiles(directory, endpoint)
+    if not paths:
+        return 0
+    stats = pstats.Stats(*paths, stream=stream or sys.stdout)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return len(paths)
+
+
+def init_app(app):
+    app.wsgi_app = ProfilerMiddleware(app, app.wsgi_app)
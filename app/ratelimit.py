@@ -0,0 +1,173 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, jsonify, request
+from werkzeug.wrappers import Response
+
+
+MAX_BUCKETS = 10000
+PRUNE_EVERY = 1000
+
+
+def _take(tokens, updated, now, rate, burst, cost):
+    """
+    Refill a bucket up to now and take cost tokens from it. Return the new
+    number of tokens and 0, or the seconds until cost tokens are there.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    # A request dearer than the whole bucket could never pass otherwise
+    cost = min(cost, burst)
+    if tokens >= cost:
+        return tokens - cost, 0
+    return tokens, (cost - tokens) / rate
+
+
+class MemoryBuckets:
+    # The token buckets of this process. Each prefork worker keeps its own,
+    # so a user can get up to SERVER_WORKERS times the rate.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, cost):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens, wait = _take(tokens, updated, now, self.rate, self.burst, cost)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_BUCKETS:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # Buckets that have refilled are the same as no bucket
+        full = now - self.burst / self.rate
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if updated < full:
+                del self._buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SqliteBuckets:
+    # Token buckets shared by every worker on the host, in a SQLite file of
+    # their own so that limiting never waits on the lock of the main database.
+
+    def __init__(self, path, rate, burst):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self._local = threading.local()
+        self._takes = 0
+
+    def connection(self):
+        # One connection per thread, and none inherited over a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def take(self, key, cost):
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row or (self.burst, now)
+            tokens, wait = _take(tokens, updated, now, self.rate, self.burst, cost)
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                connection.execute('DELETE FROM buckets WHERE updated < ?', (now - self.burst / self.rate,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def reset(self):
+        self.connection().execute('DELETE FROM buckets')
+
+
+def rate_limit(user):
+    """
+    Charge the user for the current request. Return None when the request
+    may go on, otherwise a 429 response telling when to retry.
+    """
+    buckets = current_app.extensions['rate_limit']
+    if buckets is None or user is None:
+        return None
+    cost = current_app.config['RATE_LIMIT_COSTS'].get(request.endpoint, 1)
+    wait = buckets.take(str(user.id), cost)
+    if not wait:
+        return None
+    current_app.extensions['metrics'].inc('wallets_rate_limited_total', {'endpoint': request.endpoint})
+    response = jsonify({'message': 'Too many requests, slow down!',
+                        'code': 429})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def overloaded(app):
+    app.extensions['metrics'].inc('wallets_requests_shed_total', {})
+    response = Response(json.dumps({'message': 'The server is overloaded, try again later!',
+                                    'code': 503}),
+                        status=503,
+                        mimetype='application/json')
+    response.headers['Retry-After'] = str(app.config['SHED_RETRY_AFTER'])
+    return response
+
+
+class AdmissionMiddleware:
+    # Answers 503 at once while SHED_MAX_IN_FLIGHT requests are being served
+    # by this process. Past that point more work only makes every request
+    # slower, so the excess is turned away while it is still cheap to.
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        limit = self.app.config['SHED_MAX_IN_FLIGHT']
+        with self._lock:
+            admitted = not limit or self.in_flight < limit
+            if admitted:
+                self.in_flight += 1
+        if not admitted:
+            return overloaded(self.app)(environ, start_response)
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def init_app(app):
+    rate = app.config['RATE_LIMIT_RATE']
+    storage = app.config['RATE_LIMIT_STORAGE']
+    if not rate:
+        buckets = None
+    elif storage:
+        buckets = SqliteBuckets(storage, rate, app.config['RATE_LIMIT_BURST'])
+    else:
+        buckets = MemoryBuckets(rate, app.config['RATE_LIMIT_BURST'])
+    app.extensions['rate_limit'] = buckets
+    app.wsgi_app = AdmissionMiddleware(app, app.wsgi_app)
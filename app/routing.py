@@ -0,0 +1,83 @@
+import random
+import threading
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class WriteLog:
+    # Remembers when each user last wrote, for read-your-writes stickiness.
+    # It is per process, so a write is only sticky in the worker that served it.
+
+    def __init__(self):
+        self._writes = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id):
+        with self._lock:
+            self._writes[user_id] = time.monotonic()
+
+    def wrote_recently(self, user_id, window):
+        with self._lock:
+            written_at = self._writes.get(user_id)
+        return written_at is not None and time.monotonic() - written_at < window
+
+
+class RoutingSession(SignallingSession):
+    # Sends the reads of safe requests to a read replica. Everything else,
+    # flushes included, goes to the primary.
+
+    def _replica_bind(self):
+        replicas = self.app.config.get('SQLALCHEMY_REPLICA_BINDS')
+        if not replicas or self._flushing or not has_request_context():
+            return None
+        if request.method not in READ_METHODS:
+            return None
+        user_id = g.get('user_id')
+        write_log = self.app.extensions['replica_write_log']
+        if user_id is not None and write_log.wrote_recently(user_id, self.app.config['REPLICA_STICKY_SECONDS']):
+            return None
+        # Every query of a request reads from the same replica
+        if g.get('replica_bind') is None:
+            g.replica_bind = random.choice(replicas)
+        return g.replica_bind
+
+    def _shard_bind(self, mapper):
+        bind = g.get('shard_bind') if has_app_context() else None
+        if bind is None:
+            raise RuntimeError('No shard is selected for {}'.format(mapper.class_.__name__))
+        return bind
+
+    def get_bind(self, mapper=None, clause=None):
+        if mapper is not None and mapper.persist_selectable.info.get('bind_key') is not None:
+            return SignallingSession.get_bind(self, mapper, clause)
+        # Rows owned by a user live on that user's shard, see app/sharding.py
+        if mapper is not None and mapper.persist_selectable.info.get('sharded') \
+                and self.app.config.get('SHARD_BINDS'):
+            return get_state(self.app).db.get_engine(self.app, bind=self._shard_bind(mapper))
+        bind = self._replica_bind()
+        if bind is not None:
+            return get_state(self.app).db.get_engine(self.app, bind=bind)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def init_app(app):
+    app.extensions['replica_write_log'] = WriteLog()
+
+    @app.after_request
+    def remember_writes(response):
+        user_id = g.get('user_id')
+        if user_id is not None and request.method not in READ_METHODS and response.status_code < 400:
+            current_app.extensions['replica_write_log'].record(user_id)
+        g.pop('replica_bind', None)
+        return response
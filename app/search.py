@@ -0,0 +1,95 @@
+import re
+
+from sqlalchemy import DDL, event, func, literal_column
+from sqlalchemy.sql import column, table
+
+from .models import Wallet, ParentCategory, Category, Transaction
+
+
+FTS_TABLE = 'transactions_fts'
+MAX_TERMS = 8
+
+# An external content index: SQLite keeps only the index, the text stays in
+# transactions. The maker is indexed too, so a search only walks the entries
+# of the caller instead of every match in the database.
+SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5("
+    "description, maker_id, content='transactions', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN "
+    "INSERT INTO transactions_fts (rowid, description, maker_id) "
+    "VALUES (new.id, new.description, new.maker_id); END",
+    "CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN "
+    "INSERT INTO transactions_fts (transactions_fts, rowid, description, maker_id) "
+    "VALUES ('delete', old.id, old.description, old.maker_id); END",
+    # Other columns change on every write and don't touch the index
+    "CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF description, maker_id "
+    "ON transactions BEGIN "
+    "INSERT INTO transactions_fts (transactions_fts, rowid, description, maker_id) "
+    "VALUES ('delete', old.id, old.description, old.maker_id); "
+    "INSERT INTO transactions_fts (rowid, description, maker_id) "
+    "VALUES (new.id, new.description, new.maker_id); END",
+]
+
+TRIGGERS = ('transactions_fts_insert', 'transactions_fts_delete', 'transactions_fts_update')
+
+fts = table(FTS_TABLE, column('rowid'))
+
+
+def match_expression(text, maker_id):
+    """
+    The FTS5 query for the words of text in the transactions of the maker,
+    every word matching as a prefix. None when text has no words.
+    """
+    terms = re.findall(r'\w+', text.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    return 'maker_id : "{}" AND description : ({})'.format(
+        maker_id, ' '.join('"{}"*'.format(term) for term in terms))
+
+
+def matching_transactions(user, text, limit, offset=0):
+    """
+    The transactions in the wallets of the user whose description matches
+    text, best matches first. None when text has no words.
+    """
+    expression = match_expression(text, user.id)
+    if expression is None:
+        return None
+    # The maker column doesn't count towards the rank
+    rank = func.bm25(literal_column(FTS_TABLE), 1.0, 0.0)
+    return Transaction.query \
+        .join(fts, fts.c.rowid == Transaction.id) \
+        .join(Category, Category.id == Transaction.category_id) \
+        .join(ParentCategory, ParentCategory.id == Category.parent_category_id) \
+        .join(Wallet, Wallet.id == ParentCategory.wallet_id) \
+        .filter(literal_column(FTS_TABLE).op('MATCH')(expression), Wallet.owner_id == user.id) \
+        .order_by(rank, Transaction.id) \
+        .limit(limit).offset(offset).all()
+
+
+def drop_triggers(engine):
+    """
+    Stop keeping the index up to date, for bulk loads that rebuild it
+    afterwards with create_index.
+    """
+    with engine.begin() as connection:
+        for trigger in TRIGGERS:
+            connection.execute('DROP TRIGGER IF EXISTS {}'.format(trigger))
+
+
+def create_index(engine):
+    """
+    Create the index of an existing database and fill it with the
+    transactions already there.
+    """
+    with engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+
+for statement in SCHEMA:
+    event.listen(Transaction.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Transaction.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS transactions_fts').execute_if(dialect='sqlite'))
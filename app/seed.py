@@ -0,0 +1,273 @@
+import itertools
+import math
+import random
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from .counters import period_of
+from .models import User, Wallet, ParentCategory, Category, Transaction, Change
+from .passwords import hash_password
+from .search import create_index, drop_triggers
+
+
+BATCH_SIZE = 10000
+
+WORDS = ('rent', 'food', 'coffee', 'salary', 'taxi', 'books', 'gift', 'fuel', 'cinema', 'phone',
+         'internet', 'gym', 'doctor', 'insurance', 'travel', 'hotel', 'shoes', 'bonus', 'lunch', 'bills')
+FIRST_NAMES = ('Anna', 'Boris', 'Chen', 'Dana', 'Emil', 'Fatima', 'Georg', 'Hana', 'Ivan', 'Julia')
+LAST_NAMES = ('Novak', 'Smith', 'Garcia', 'Kim', 'Ivanov', 'Muller', 'Rossi', 'Silva', 'Tanaka', 'Olsen')
+CURRENCIES = ('usd', 'eur', 'gbp', 'uah', 'pln', 'jpy')
+TIMESTAMP = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def distribution(spec):
+    """
+    Parse how many children each parent gets: N or fixed:N, uniform:A-B,
+    poisson:MEAN or pareto:MEAN[:ALPHA] for a few parents with most rows.
+    """
+    kind, _, args = str(spec).partition(':')
+    if not args:
+        kind, args = 'fixed', kind
+    if kind == 'fixed':
+        count = int(args)
+        return lambda rng: count
+    if kind == 'uniform':
+        low, high = (int(value) for value in args.split('-'))
+        return lambda rng: rng.randint(low, high)
+    if kind == 'poisson':
+        mean = float(args)
+        return lambda rng: _poisson(rng, mean)
+    if kind == 'pareto':
+        mean, _, alpha = args.partition(':')
+        alpha = float(alpha or 1.5)
+        scale = float(mean) * (alpha - 1) / alpha
+        return lambda rng: int(scale * rng.paretovariate(alpha))
+    raise ValueError('Unknown distribution {!r}'.format(spec))
+
+
+def _poisson(rng, mean):
+    if mean > 30:
+        return max(0, int(round(rng.gauss(mean, math.sqrt(mean)))))
+    # Knuth, fine for small means
+    limit, count, product = math.exp(-mean), 0, rng.random()
+    while product > limit:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+class _Inserter:
+    # Plain DBAPI executemany in batches; the ORM and even SQLAlchemy core
+    # spend more time per row than SQLite does.
+
+    def __init__(self, cursor, table, columns, batch_size, seqs, updated_at):
+        # Every row gets the next sequence number of the change log
+        columns += ('seq', 'updated_at')
+        self.cursor = cursor
+        self.sql = 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns),
+                                                            ', '.join('?' * len(columns)))
+        self.batch_size = batch_size
+        self.seqs = seqs
+        self.updated_at = updated_at
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row + (next(self.seqs), self.updated_at))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.cursor.executemany(self.sql, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+
+# The owner and the wallet of a seeded row, for its entry in the change log
+CHANGE_OWNERS = {
+    User: ('t.id', 'NULL', ''),
+    Wallet: ('t.owner_id', 't.id', ''),
+    ParentCategory: ('w.owner_id', 'w.id', 'JOIN wallets w ON w.id = t.wallet_id'),
+    Category: ('w.owner_id', 'w.id', 'JOIN parent_categories p ON p.id = t.parent_category_id '
+                                     'JOIN wallets w ON w.id = p.wallet_id'),
+    Transaction: ('t.maker_id', 'p.wallet_id', 'JOIN categories c ON c.id = t.category_id '
+                                              'JOIN parent_categories p ON p.id = c.parent_category_id'),
+}
+
+
+def _reserve_seqs(cursor):
+    # Taking the write lock first keeps every other writer from reserving
+    # sequence numbers until the seed commits, see _release_seqs
+    cursor.execute('UPDATE id_sequences SET next_value = next_value WHERE name = ?', (Change.__tablename__,))
+    if not cursor.rowcount:
+        cursor.execute('INSERT INTO id_sequences (name, next_value) VALUES (?, 1)', (Change.__tablename__,))
+    cursor.execute('SELECT next_value FROM id_sequences WHERE name = ?', (Change.__tablename__,))
+    return cursor.fetchone()[0]
+
+
+def _release_seqs(cursor, next_value):
+    cursor.execute('UPDATE id_sequences SET next_value = ? WHERE name = ?', (next_value, Change.__tablename__))
+
+
+def log_changes(cursor, first_ids, created_at):
+    """
+    Log a create for the seeded rows, ids first_ids[model] and up, with
+    the sequence numbers they were inserted with, as the session would have.
+    """
+    for model, (user_id, wallet_id, joins) in CHANGE_OWNERS.items():
+        cursor.execute("INSERT INTO changes (seq, kind, object_id, op, created_at, user_id, wallet_id) "
+                       "SELECT t.seq, '{table}', t.id, 'create', ?, {user_id}, {wallet_id} "
+                       "FROM {table} t {joins} WHERE t.id >= ?"
+                       .format(table=model.__tablename__, user_id=user_id, wallet_id=wallet_id, joins=joins),
+                       (created_at, first_ids[model]))
+
+
+def _fill_counters(cursor, counters, parents, period):
+    # The counters of the categories, added up level by level, instead of
+    # 'manage.py repair_counters' reading every transaction back
+    for model, parent_model in ((Category, ParentCategory), (ParentCategory, Wallet), (Wallet, None)):
+        cursor.executemany('UPDATE {} SET transactions_count = ?, transactions_total = ?, period_spent = ?, '
+                           'period = ? WHERE id = ?'.format(model.__tablename__),
+                           [(count, total, spent, period, id) for id, (count, total, spent) in counters.items()])
+        if parent_model is None:
+            break
+        totals = {}
+        for id, values in counters.items():
+            parent_totals = totals.setdefault(parents[model][id], [0, 0, 0])
+            for i, value in enumerate(values):
+                parent_totals[i] += value
+        counters = totals
+
+
+# Tables the seed writes to
+SEEDED = (User, Wallet, ParentCategory, Category, Transaction, Change)
+
+
+def _drop_indexes(engine):
+    # Unique indexes stay, they check the usernames against the existing users
+    indexes = [index for model in SEEDED for index in model.__table__.indexes if not index.unique]
+    for index in indexes:
+        index.drop(engine)
+    return indexes
+
+
+def _next_id(cursor, table):
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM {}'.format(table))
+    return cursor.fetchone()[0] + 1
+
+
+def seed(engine, users, wallets=2, parent_categories=3, categories=4, transactions=10,
+         seed=0, password='password', days=365, batch_size=BATCH_SIZE):
+    """
+    Bulk insert users and, per parent, wallets, parent categories,
+    categories and transactions drawn from the given distributions.
+    The same seed always produces the same rows. Every user is named
+    user<id> and gets the same password.
+
+    Rows go to the default database with ids above the existing ones;
+    run manage.py init_shards afterwards when shards are configured.
+    The search index and the other non-unique indexes of these tables
+    are dropped while the rows are inserted and built again afterwards,
+    so seed while the API is stopped.
+    """
+    rng = random.Random(seed)
+    wallets, parent_categories, categories, transactions = (
+        distribution(spec) for spec in (wallets, parent_categories, categories, transactions))
+    password_hash = hash_password(password)
+    # Texts and timestamps come from pools, formatting them per row would
+    # cost more than inserting the row.
+    now = datetime.utcnow().replace(microsecond=0)
+    timestamps = [(now - timedelta(seconds=rng.randrange(days * 86400))).strftime(TIMESTAMP)
+                  for i in range(4096)]
+    descriptions = [' '.join(rng.choice(WORDS) for j in range(rng.randint(1, 4))) for i in range(1024)]
+    titles = [word.capitalize() for word in WORDS]
+
+    started = perf_counter()
+    # Indexing row by row costs more than the insert, building the indexes
+    # once at the end is several times cheaper
+    drop_triggers(engine)
+    indexes = _drop_indexes(engine)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        seqs = itertools.count(_reserve_seqs(cursor))
+        stamp = datetime.utcnow().strftime(TIMESTAMP)
+        inserters = {model: _Inserter(cursor, model.__tablename__, columns, batch_size, seqs, stamp)
+                     for model, columns in (
+                         (User, ('id', 'username', 'email', 'password', 'confirmed',
+                                 'first_name', 'last_name', 'date_joined')),
+                         (Wallet, ('id', 'title', 'created_at', 'currency', 'initial_balance', 'owner_id')),
+                         (ParentCategory, ('id', 'title', 'budget', 'is_income', 'wallet_id')),
+                         (Category, ('id', 'title', 'budget', 'has_bills', 'parent_category_id')),
+                         (Transaction, ('id', 'amount', 'description', 'created_at',
+                                        'category_id', 'maker_id')))}
+        next_ids = {model: _next_id(cursor, model.__tablename__) for model in inserters}
+
+        # Only (id, owner) pairs of the parent level are kept in memory, and
+        # the parents of categories and parent categories for their counters
+        owners = []
+        parents = {ParentCategory: {}, Category: {}}
+        for user_id in range(next_ids[User], next_ids[User] + users):
+            inserters[User].add((user_id, 'user{}'.format(user_id), 'user{}@example.com'.format(user_id),
+                                 password_hash, 1, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                                 rng.choice(timestamps)))
+            owners.append((user_id, user_id))
+
+        for model, count, make in (
+                (Wallet, wallets,
+                 lambda id, parent, owner: (id, rng.choice(titles), rng.choice(timestamps),
+                                            rng.choice(CURRENCIES), rng.randint(0, 1000), parent)),
+                (ParentCategory, parent_categories,
+                 lambda id, parent, owner: (id, rng.choice(titles), rng.randint(0, 1000),
+                                            rng.random() < 0.2, parent)),
+                (Category, categories,
+                 lambda id, parent, owner: (id, rng.choice(titles), rng.randint(0, 1000),
+                                            rng.random() < 0.3, parent))):
+            inserter, next_id, children = inserters[model], next_ids[model], []
+            parents_of = parents.get(model)
+            for parent, owner in owners:
+                for i in range(count(rng)):
+                    inserter.add(make(next_id, parent, owner))
+                    children.append((next_id, owner))
+                    if parents_of is not None:
+                        parents_of[next_id] = parent
+                    next_id += 1
+            owners = children
+
+        inserter, next_id = inserters[Transaction], next_ids[Transaction]
+        # Drawing the values of a whole category at once skips most of the
+        # per-call overhead of Random
+        choices, amounts = rng.choices, range(1, 10001)
+        month_start = now.replace(day=1, hour=0, minute=0, second=0).strftime(TIMESTAMP)
+        counters = {}
+        for category_id, owner in owners:
+            count = transactions(rng)
+            if not count:
+                continue
+            total = spent = 0
+            for amount, description, created_at in zip(choices(amounts, k=count), choices(descriptions, k=count),
+                                                       choices(timestamps, k=count)):
+                inserter.add((next_id, amount, description, created_at, category_id, owner))
+                next_id += 1
+                total += amount
+                if created_at >= month_start:
+                    spent += amount
+            counters[category_id] = [count, total, spent]
+
+        for inserter in inserters.values():
+            inserter.flush()
+        _fill_counters(cursor, counters, parents, period_of(now))
+        # The rows went around the session, so clients syncing from the
+        # change log have to be told they were created
+        log_changes(cursor, next_ids, stamp)
+        _release_seqs(cursor, next(seqs))
+        connection.commit()
+    finally:
+        connection.close()
+        for index in indexes:
+            index.create(engine)
+        create_index(engine)
+    seconds = perf_counter() - started
+    counts = {model.__tablename__: inserter.count for model, inserter in inserters.items()}
+    return counts, seconds
@@ -0,0 +1,127 @@
+import os
+import signal
+import socket
+import time
+
+from werkzeug.routing import BuildError
+from werkzeug.serving import make_server
+
+from . import database
+
+
+def warm_up(app):
+    """
+    Do the work the first requests would otherwise pay for, in the master
+    process so that every worker inherits it.
+    """
+    app.try_trigger_before_first_request_functions()
+    # Compiles the matchers and builders of every rule
+    adapter = app.url_map.bind(app.config.get('SERVER_NAME') or 'localhost')
+    for rule in app.url_map.iter_rules():
+        try:
+            adapter.build(rule.endpoint, {argument: 1 for argument in rule.arguments},
+                          method=next(iter(rule.methods - {'HEAD', 'OPTIONS'}), None))
+        except BuildError:
+            pass
+    # Runs the connect listeners once and imports everything a request touches
+    for bind, engine in database.engines(app):
+        engine.connect().close()
+    app.test_client().get('/api/v1.0/')
+
+
+def prepare_for_fork(app):
+    """
+    Make the app safe to share with forked workers: connections opened
+    before the fork are closed, and per-process state is reset in every
+    child.
+    """
+    dispose_engines(app)
+    os.register_at_fork(after_in_child=lambda: after_fork(app))
+
+
+def dispose_engines(app):
+    for bind, engine in database.engines(app):
+        engine.dispose()
+
+
+def after_fork(app):
+    # A SQLite connection must never be used by two processes
+    dispose_engines(app)
+    # Id blocks and metrics of the master belong to the master
+    app.extensions['shard_ids'].reset()
+    app.extensions['metrics'].reset()
+
+
+class PreforkServer:
+    # The master binds the socket, preloads the app and forks the workers,
+    # which all accept on the inherited socket. Dead workers are replaced.
+
+    def __init__(self, app, host='127.0.0.1', port=5000, workers=None, threaded=None):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or app.config['SERVER_WORKERS']
+        self.threaded = app.config['SERVER_THREADED'] if threaded is None else threaded
+        self.socket = None
+        self.pids = {}
+        self.stopping = False
+
+    def listen(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.app.config['SERVER_BACKLOG'])
+        self.socket.set_inheritable(True)
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.pids[pid] = time.monotonic()
+            return
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            server = make_server(self.host, self.port, self.app, threaded=self.threaded,
+                                 fd=self.socket.fileno())
+            server.serve_forever()
+        except Exception:
+            self.app.logger.exception('Worker %d failed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def serve_forever(self):
+        warm_up(self.app)
+        # The warm-up request is not traffic
+        self.app.extensions['metrics'].reset()
+        self.app.extensions['metrics'].clear_directory()
+        prepare_for_fork(self.app)
+        self.listen()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.app.logger.info('Serving on http://%s:%d with %d workers', self.host, self.port, self.workers)
+        for i in range(self.workers):
+            self.spawn()
+        while self.pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.pids.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            self.app.logger.warning('Worker %d exited with status %d, restarting', pid, status)
+            # Don't spin when workers die right away
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            self.spawn()
+        self.socket.close()
@@ -0,0 +1,200 @@
+import threading
+import zlib
+from contextlib import contextmanager
+
+from flask import current_app, g
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import set_committed_value
+
+from . import db
+from .models import User, Wallet, ParentCategory, Category, Transaction, IdSequence
+
+
+# Ordered so that parents are copied before their children
+SHARDED_MODELS = (Wallet, ParentCategory, Category, Transaction)
+CHUNK_SIZE = 500
+
+
+def shards(app=None):
+    return (app or current_app).config.get('SHARD_BINDS') or []
+
+
+def pick_shard(user_id, binds=None):
+    # Rendezvous hashing: adding a shard only moves the users it wins
+    binds = binds or shards()
+    return max(binds, key=lambda bind: zlib.crc32('{}:{}'.format(bind, user_id).encode('utf-8')))
+
+
+def shard_of(user):
+    return user.shard or pick_shard(user.id)
+
+
+def select_shard(user):
+    if shards() and user is not None:
+        g.shard_bind = shard_of(user)
+
+
+@contextmanager
+def on_user_shard(user):
+    if not shards() or user is None:
+        yield
+        return
+    with on_shard(shard_of(user)):
+        yield
+
+
+@contextmanager
+def on_shard(bind):
+    previous = g.get('shard_bind')
+    g.shard_bind = bind
+    try:
+        yield
+    finally:
+        g.shard_bind = previous
+
+
+def for_each_shard():
+    for bind in shards() or [None]:
+        with on_shard(bind):
+            yield bind
+
+
+class IdAllocator:
+    # Sharded rows need ids that are unique across all shards, so they are
+    # handed out in blocks from the id_sequences table of the global database.
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def next_id(self, name):
+        with self._lock:
+            next_value, end = self._blocks.get(name, (0, 0))
+            if next_value >= end:
+                next_value = self._reserve(name)
+                end = next_value + self.block_size
+            self._blocks[name] = (next_value + 1, end)
+            return next_value
+
+    def _reserve(self, name):
+        table = IdSequence.__table__
+        with db.get_engine(current_app).begin() as connection:
+            updated = connection.execute(table.update()
+                                         .where(table.c.name == name)
+                                         .values(next_value=table.c.next_value + self.block_size))
+            if not updated.rowcount:
+                connection.execute(table.insert().values(name=name, next_value=1 + self.block_size))
+                return 1
+            return connection.execute(table.select().where(table.c.name == name)) \
+                .first().next_value - self.block_size
+
+    def reset(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+def assign_ids(session, flush_context, instances):
+    if not shards(session.app):
+        return
+    allocator = session.app.extensions['shard_ids']
+    for obj in session.new:
+        if isinstance(obj, SHARDED_MODELS) and obj.id is None:
+            obj.id = allocator.next_id(obj.__tablename__)
+
+
+def pin_new_user(mapper, connection, target):
+    if shards():
+        shard = pick_shard(target.id)
+        connection.execute(User.__table__.update()
+                           .where(User.__table__.c.id == target.id)
+                           .values(shard=shard))
+        set_committed_value(target, 'shard', shard)
+
+
+def init_app(app):
+    app.extensions['shard_ids'] = IdAllocator(app.config['SHARD_ID_BLOCK_SIZE'])
+
+
+event.listen(db.session, 'before_flush', assign_ids)
+event.listen(User, 'after_insert', pin_new_user)
+
+
+def engine_for(bind):
+    return db.get_engine(current_app, bind)
+
+
+def create_shard_tables():
+    tables = [model.__table__ for model in SHARDED_MODELS]
+    for bind in shards():
+        db.Model.metadata.create_all(engine_for(bind), tables=tables)
+
+
+def init_sequences():
+    for model in SHARDED_MODELS:
+        table = model.__table__
+        last_id = max(engine_for(bind).execute(db.select([db.func.max(table.c.id)])).scalar() or 0
+                      for bind in [None] + shards())
+        sequence = IdSequence.query.get(model.__tablename__)
+        if sequence is None:
+            sequence = IdSequence(name=model.__tablename__)
+            db.session.add(sequence)
+        sequence.next_value = max(sequence.next_value or 1, last_id + 1)
+    db.session.commit()
+    current_app.extensions['shard_ids'].reset()
+
+
+def _chunks(values):
+    values = list(values)
+    for i in range(0, len(values), CHUNK_SIZE):
+        yield values[i:i + CHUNK_SIZE]
+
+
+def _select_owned(connection, user_id):
+    rows = {}
+    parent_ids = [user_id]
+    for model, column in ((Wallet, 'owner_id'),
+                          (ParentCategory, 'wallet_id'),
+                          (Category, 'parent_category_id'),
+                          (Transaction, 'category_id')):
+        table = model.__table__
+        rows[model] = []
+        for chunk in _chunks(parent_ids):
+            rows[model] += [dict(row) for row in
+                            connection.execute(table.select().where(table.c[column].in_(chunk)))]
+        parent_ids = [row['id'] for row in rows[model]]
+    return rows
+
+
+def move_user(user, target):
+    """
+    Copy all rows owned by the user to the target shard, repoint the
+    directory and delete the rows from the old shard. Writes made by the
+    user while the move runs are not carried over.
+    """
+    source = user.shard if shards() and user.shard else None
+    if source == target:
+        return 0
+    with engine_for(source).connect() as connection:
+        rows = _select_owned(connection, user.id)
+    with engine_for(target).begin() as connection:
+        for model in SHARDED_MODELS:
+            for chunk in _chunks(rows[model]):
+                connection.execute(model.__table__.insert(), chunk)
+    user.shard = target
+    db.session.commit()
+    with engine_for(source).begin() as connection:
+        for model in reversed(SHARDED_MODELS):
+            table = model.__table__
+            for chunk in _chunks(row['id'] for row in rows[model]):
+                connection.execute(table.delete().where(table.c.id.in_(chunk)))
+    return sum(len(r) for r in rows.values())
+
+
+def rebalance():
+    moved = []
+    for user in User.query.order_by(User.id).all():
+        source, target = user.shard, pick_shard(user.id)
+        if source != target:
+            moved.append((user, source, target, move_user(user, target)))
+    return moved
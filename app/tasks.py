@@ -0,0 +1,34 @@
+from .jobs import task
+from .models import User, Wallet, ParentCategory, Category
+
+
+@task(concurrency=1)
+def delete_user(id):
+    user = User.query.filter_by(id=id).first()
+    if user is not None:
+        user.delete()
+    return {'deleted': 'user', 'id': id}
+
+
+@task(concurrency=2)
+def delete_wallet(id):
+    wallet = Wallet.query.filter_by(id=id).first()
+    if wallet is not None:
+        wallet.delete()
+    return {'deleted': 'wallet', 'id': id}
+
+
+@task(concurrency=2)
+def delete_parent_category(id):
+    parent_category = ParentCategory.query.filter_by(id=id).first()
+    if parent_category is not None:
+        parent_category.delete()
+    return {'deleted': 'parent_category', 'id': id}
+
+
+@task(concurrency=2)
+def delete_category(id):
+    category = Category.query.filter_by(id=id).first()
+    if category is not None:
+        category.delete()
+    return {'deleted': 'category', 'id': id}
@@ -0,0 +1,7 @@
+import os
+
+from app import create_app
+from app.asgi import AsgiApp
+
+# For ASGI servers, e.g. uvicorn asgi:app
+app = AsgiApp(create_app(os.environ.get('WALLETS_CONFIG') or 'production'))
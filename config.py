@@ -4,12 +4,135 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def uri_binds(prefix, variable):
+    uris = filter(None, os.environ.get(variable, '').split(','))
+    return {'{}_{}'.format(prefix, i): uri for i, uri in enumerate(uris)}
+
+
 class Config:
     SECRET_KEY = os.environ.get('WALLETS_SECRET_KEY')
+    ACCESS_TOKEN_MINUTES = 15
+    REFRESH_TOKEN_DAYS = 30
+    TOKEN_MAX_WALLETS = 256
+    # Werkzeug method and work factor of new password hashes. Older hashes
+    # are replaced on the next login. 0 workers hashes in the request thread.
+    PASSWORD_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_WORKERS = 2
     # SQLALCHEMY_COMMIT_ON_TEARDOWN = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_RECORD_QUERIES = True
 
+    # Per-request query instrumentation, in seconds
+    SLOW_QUERY_THRESHOLD = 0.1
+    SLOW_REQUEST_THRESHOLD = 0.5
+    SLOW_REQUEST_LOG_SIZE = 50
+    QUERY_LOG_SLOWEST = 3
+    SLOW_REQUEST_ENDPOINT = False
+
+    # Prometheus metrics at /metrics. Prefork workers write theirs to
+    # METRICS_DIR, which manage.py serve empties when it starts.
+    METRICS_ENDPOINT = True
+    METRICS_DIR = os.environ.get('WALLETS_METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 1.0
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    # Requests are profiled when they send PROFILE_HEADER with PROFILE_TOKEN,
+    # or at random with PROFILE_SAMPLE_RATE. See manage.py profile_summary.
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_TOKEN = os.environ.get('WALLETS_PROFILE_TOKEN')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('WALLETS_PROFILE_SAMPLE_RATE', 0))
+    PROFILE_DIR = os.environ.get('WALLETS_PROFILE_DIR') or os.path.join(basedir, 'tmp/profiles')
+    PROFILE_KEEP = 200
+
+    # Applied to every new SQLite connection
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,
+        'mmap_size': 268435456,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    }
+    SQLITE_LOCK_RETRIES = 5
+    SQLITE_LOCK_BACKOFF = 0.05
+
+    # Read replicas are bind keys of SQLALCHEMY_BINDS. GET requests read from
+    # one of them unless the user has written within REPLICA_STICKY_SECONDS.
+    SQLALCHEMY_BINDS = dict(uri_binds('replica', 'WALLETS_REPLICA_URIS'),
+                            **uri_binds('shard', 'WALLETS_SHARD_URIS'))
+    SQLALCHEMY_REPLICA_BINDS = sorted(uri_binds('replica', 'WALLETS_REPLICA_URIS'))
+    REPLICA_STICKY_SECONDS = 5
+
+    # Wallets and everything below them live on the shard of their owner.
+    # Shards are bind keys of SQLALCHEMY_BINDS; users stay in the main database.
+    SHARD_BINDS = sorted(uri_binds('shard', 'WALLETS_SHARD_URIS'))
+    SHARD_ID_BLOCK_SIZE = 100
+
+    # Background jobs
+    JOBS_WORKERS = 2
+    JOBS_POLL_INTERVAL = 1.0
+    JOBS_RETRY_BACKOFF = 5
+    JOBS_VISIBILITY_TIMEOUT = 600
+    # Deletes cascading over more transactions than this run as jobs
+    JOBS_ASYNC_THRESHOLD = 1000
+
+    # Idempotency-Key support for POST endpoints
+    IDEMPOTENCY_TTL = 24 * 60 * 60
+    IDEMPOTENCY_LOCK_TIMEOUT = 60
+    IDEMPOTENCY_CACHE_SIZE = 1024
+    IDEMPOTENCY_PURGE_EVERY = 100
+
+    BATCH_MAX_REQUESTS = 20
+
+    # Every user has a token bucket refilled with RATE_LIMIT_RATE tokens a
+    # second up to RATE_LIMIT_BURST, and each request takes the cost of its
+    # endpoint (1 unless listed). Buckets are per process unless
+    # RATE_LIMIT_STORAGE names a SQLite file for the workers to share.
+    RATE_LIMIT_RATE = 20
+    RATE_LIMIT_BURST = 100
+    RATE_LIMIT_STORAGE = os.environ.get('WALLETS_RATE_LIMIT_STORAGE')
+    RATE_LIMIT_COSTS = {
+        'api.get_all_users': 5,
+        'api.get_all_wallets': 5,
+        'api.get_all_parent_categories': 5,
+        'api.get_all_categories': 5,
+        'api.get_all_transactions': 20,
+        'api.get_wallet_tree': 5,
+        'api.get_user_transactions': 2,
+        'api.get_category_transactions': 2,
+    }
+    # A process with this many requests in flight answers 503 right away
+    SHED_MAX_IN_FLIGHT = 64
+    SHED_RETRY_AFTER = 1
+
+    # manage.py serve and wsgi.py, see app/server.py
+    SERVER_WORKERS = int(os.environ.get('WALLETS_WORKERS', os.cpu_count() or 2))
+    SERVER_THREADED = True
+    SERVER_BACKLOG = 128
+    # asgi.py: threads for the views of safe and of writing requests
+    ASGI_READ_THREADS = 32
+    ASGI_WRITE_THREADS = 4
+
+    TRANSACTIONS_PER_PAGE = 50
+    TRANSACTIONS_MAX_PER_PAGE = 500
+    CHANGES_PER_PAGE = 100
+    CHANGES_MAX_PER_PAGE = 1000
+    SEARCH_PER_PAGE = 20
+    SEARCH_MAX_PER_PAGE = 100
+    # Seconds a worker serves a dashboard from memory
+    DASHBOARD_TTL = 10
+    DASHBOARD_CACHE_SIZE = 4096
+    # Fractions of a monthly budget that raise an alert when spending passes them
+    BUDGET_ALERT_THRESHOLDS = (0.8, 1.0)
+    ALERTS_PER_PAGE = 50
+
+    # Server-sent events of /wallets/<id>/events, in seconds
+    EVENTS_POLL_INTERVAL = 0.5
+    EVENTS_HEARTBEAT = 15
+    EVENTS_STREAM_SECONDS = 300
+    EVENTS_QUEUE_SIZE = 100
+    EVENTS_REPLAY_LIMIT = 500
+
     @staticmethod
     def init_app(app):
         pass
@@ -17,22 +140,59 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG =True
+    SLOW_REQUEST_ENDPOINT = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
 
 
 class TestingConfig(Config):
     TESTING = True
+    SLOW_REQUEST_ENDPOINT = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'MEMORY',
+        'synchronous': 'OFF',
+        'busy_timeout': 5000,
+    }
+    SQLALCHEMY_BINDS = {}
+    SQLALCHEMY_REPLICA_BINDS = []
+    SHARD_BINDS = []
+    METRICS_DIR = None
+    PASSWORD_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_WORKERS = 0
+    RATE_LIMIT_RATE = None
+    SHED_MAX_IN_FLIGHT = None
+    EVENTS_HEARTBEAT = 0.05
+    EVENTS_STREAM_SECONDS = 0.2
 
 
 class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'data.sqlite')
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'mmap_size': 1073741824,
+        'busy_timeout': 10000,
+        'temp_store': 'MEMORY',
+    }
+
+
+class BenchConfig(ProductionConfig):
+    # Production settings on a single database of its own, see manage.py bench
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'data-bench.sqlite')
+    SQLALCHEMY_BINDS = {}
+    SQLALCHEMY_REPLICA_BINDS = []
+    SHARD_BINDS = []
+    METRICS_DIR = None
+    PROFILE_SAMPLE_RATE = 0
+    RATE_LIMIT_RATE = None
 
 
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
     'production': ProductionConfig,
+    'bench': BenchConfig,
 
     'default': DevelopmentConfig,
 }
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 import os
+import sys
+from datetime import datetime
 
 from flask_migrate import Migrate, MigrateCommand
 from flask_script import Manager, Shell
 
-from app import create_app, db
+from app import bench as benchmark, counters, create_app, db, database, profiling, search, server, sharding
+from app.jobs import WorkerPool
+from app.seed import seed as bulk_seed
+from app.models import User, RefreshToken
 
 app = create_app('default')
 manager = Manager(app)
@@ -41,6 +46,203 @@ def test(coverage=False):
         COV.erase()
 
 
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+                help='Number of worker threads (defaults to JOBS_WORKERS).')
+def worker(workers=None):
+    """Run the background job worker pool."""
+    WorkerPool(app, size=workers).run()
+
+
+@manager.option('-m', '--mode', dest='mode', default='TRUNCATE',
+                help='PASSIVE, FULL, RESTART or TRUNCATE.')
+def checkpoint(mode='TRUNCATE'):
+    """Checkpoint the SQLite write-ahead log."""
+    for bind, engine in database.engines(app):
+        print('{}: {}'.format(bind or 'default', database.checkpoint(engine, mode.upper())))
+
+
+@manager.command
+def analyze():
+    """Refresh the SQLite query planner statistics."""
+    for bind, engine in database.engines(app):
+        database.analyze(engine)
+        print('{}: analyzed'.format(bind or 'default'))
+
+
+@manager.command
+def vacuum():
+    """Rebuild the SQLite database files to reclaim free pages."""
+    for bind, engine in database.engines(app):
+        database.vacuum(engine)
+        print('{}: vacuumed'.format(bind or 'default'))
+
+
+@manager.command
+def sync_replicas():
+    """Copy the primary database over every read replica."""
+    primary = db.get_engine(app)
+    for bind, engine in database.replicas(app):
+        database.copy_database(primary, engine)
+        print('{}: synced'.format(bind))
+
+
+@manager.command
+def init_shards():
+    """Create the shard tables and move existing users onto their shards."""
+    sharding.create_shard_tables()
+    sharding.init_sequences()
+    rebalance_shards()
+
+
+@manager.command
+def rebalance_shards():
+    """Move every user whose data is not on its hashed shard.
+
+    Run it after adding shards, while the API is stopped.
+    """
+    for user, source, target, rows in sharding.rebalance():
+        print('{}: {} -> {} ({} rows)'.format(user, source or 'default', target, rows))
+
+
+@manager.option('shard')
+@manager.option('user_id', type=int)
+def move_user_shard(user_id, shard):
+    """Move one user's data to the given shard."""
+    user = User.query.get(user_id)
+    rows = sharding.move_user(user, shard)
+    print('{}: -> {} ({} rows)'.format(user, shard, rows))
+
+
+@manager.command
+def repair_counters():
+    """Recompute the transaction counters of categories, parent categories and wallets."""
+    for bind in [None] + sharding.shards():
+        with db.get_engine(app, bind).begin() as connection:
+            repaired = counters.repair_counters(connection)
+        print('{}: {}'.format(bind or 'default', ', '.join('{} {}'.format(count, name)
+                                                         for name, count in repaired.items())))
+
+
+@manager.command
+def purge_refresh_tokens():
+    """Delete the expired refresh tokens."""
+    count = RefreshToken.purge_expired()
+    db.session.commit()
+    print('{} refresh tokens purged'.format(count))
+
+
+@manager.command
+def index_transactions():
+    """Create the full-text index of transactions and fill it from scratch."""
+    for bind in [None] + sharding.shards():
+        search.create_index(db.get_engine(app, bind))
+        print('{}: indexed'.format(bind or 'default'))
+
+
+@manager.option('-s', '--sort', dest='sort', default='cumulative',
+                help='pstats sort key, e.g. cumulative, tottime or calls.')
+@manager.option('-n', '--limit', dest='limit', type=int, default=20,
+                help='Number of functions to show.')
+@manager.option('-e', '--endpoint', dest='endpoint', default=None,
+                help='Only profiles of this endpoint, e.g. api.get_all_transactions.')
+def profile_summary(endpoint=None, limit=20, sort='cumulative'):
+    """Show the hottest functions across the saved request profiles."""
+    count = profiling.summarize(app.config['PROFILE_DIR'], endpoint, sort, limit)
+    if not count:
+        print('No profiles in {}'.format(app.config['PROFILE_DIR']))
+
+
+@manager.option('-b', '--baseline', dest='baseline', default=None,
+                help='Earlier results to compare with; regressions fail the command.')
+@manager.option('-o', '--output', dest='output', default=None,
+                help='Where to save the results (defaults to tmp/bench/<time>.json).')
+@manager.option('-e', '--endpoint', dest='endpoints', action='append', default=None,
+                help='Only benchmark this endpoint, may be repeated.')
+@manager.option('-r', '--reuse', dest='reuse', action='store_true', default=False,
+                help='Keep the database seeded by an earlier run.')
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=4,
+                help='Number of concurrent client threads.')
+@manager.option('-n', '--requests', dest='requests', type=int, default=100,
+                help='Requests per endpoint.')
+@manager.option('--seed', dest='random_seed', type=int, default=0,
+                help='Random seed of the generated data.')
+@manager.option('--transactions', dest='transactions', default='5',
+                help='Transactions per category, a number or a distribution.')
+@manager.option('--categories', dest='categories', default='4',
+                help='Categories per parent category, a number or a distribution.')
+@manager.option('--parent-categories', dest='parent_categories', default='3',
+                help='Parent categories per wallet, a number or a distribution.')
+@manager.option('--wallets', dest='wallets', default='2',
+                help='Wallets per user, a number or a distribution.')
+@manager.option('--users', dest='users', type=int, default=20,
+                help='Number of users.')
+def bench(users=20, wallets='2', parent_categories='3', categories='4', transactions='5', random_seed=0,
+          requests=100, concurrency=4, reuse=False, endpoints=None, output=None, baseline=None):
+    """Seed a benchmark database and measure the latency of every API endpoint."""
+    bench_app = create_app('bench')
+    with bench_app.test_request_context():
+        user = User.query.filter_by(username=benchmark.BENCH_USERNAME).first() if reuse else None
+        if user is None:
+            db.drop_all()
+            db.create_all()
+            user = benchmark.seed(users, wallets, parent_categories, categories, transactions, random_seed)
+        results = benchmark.run(bench_app, user, requests, concurrency, endpoints)
+    benchmark.report(results, sys.stdout)
+
+    if output is None:
+        directory = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'tmp/bench')
+        os.makedirs(directory, exist_ok=True)
+        output = os.path.join(directory, '{:%Y%m%d-%H%M%S}.json'.format(datetime.utcnow()))
+    benchmark.save(output, results, users=users, wallets=wallets, parent_categories=parent_categories,
+                   categories=categories, transactions=transactions, seed=random_seed, requests=requests,
+                   concurrency=concurrency)
+    print('Results saved to {}'.format(output))
+
+    if baseline:
+        regressions = benchmark.compare(results, benchmark.load(baseline))
+        for endpoint, metric, before, after in regressions:
+            print('REGRESSION {} {}: {:.2f} -> {:.2f}'.format(endpoint, metric, before, after))
+        if regressions:
+            return 1
+
+
+@manager.option('--seed', dest='random_seed', type=int, default=0,
+                help='Random seed, the same seed generates the same rows.')
+@manager.option('--password', dest='password', default='password',
+                help='Password of every generated user.')
+@manager.option('--transactions', dest='transactions', default='10',
+                help='Transactions per category: N, uniform:A-B, poisson:MEAN or pareto:MEAN[:ALPHA].')
+@manager.option('--categories', dest='categories', default='4',
+                help='Categories per parent category, a number or a distribution.')
+@manager.option('--parent-categories', dest='parent_categories', default='3',
+                help='Parent categories per wallet, a number or a distribution.')
+@manager.option('--wallets', dest='wallets', default='2',
+                help='Wallets per user, a number or a distribution.')
+@manager.option('users', type=int)
+def seed(users, wallets='2', parent_categories='3', categories='4', transactions='10',
+         password='password', random_seed=0):
+    """Bulk insert generated users and their wallets, categories and transactions."""
+    db.create_all()
+    counts, seconds = bulk_seed(db.get_engine(app), users, wallets, parent_categories, categories,
+                                transactions, seed=random_seed, password=password)
+    for table, count in counts.items():
+        print('{}: {} rows'.format(table, count))
+    print('{} rows in {:.1f} s ({:.0f} rows/s)'.format(sum(counts.values()), seconds,
+                                                       sum(counts.values()) / seconds))
+
+
+@manager.option('-c', '--config', dest='config_name', default=None,
+                help='Configuration to serve (defaults to WALLETS_CONFIG or production).')
+@manager.option('-w', '--workers', dest='workers', type=int, default=None,
+                help='Number of worker processes (defaults to SERVER_WORKERS).')
+@manager.option('-p', '--port', dest='port', type=int, default=5000)
+@manager.option('-H', '--host', dest='host', default='127.0.0.1')
+def serve(host='127.0.0.1', port=5000, workers=None, config_name=None):
+    """Serve the API from preforked worker processes."""
+    serve_app = create_app(config_name or os.environ.get('WALLETS_CONFIG') or 'production')
+    server.PreforkServer(serve_app, host, port, workers).serve_forever()
+
+
 manager.add_command('shell', Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
 
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import database
+
+
+# The most SQL statements each endpoint may issue against the fixture in
+# tests/test_query_budgets.py. Lower a budget when an endpoint gets cheaper;
+# raising one needs a reason. Endpoints that still load children lazily
+# (the wallet and parent category lists, the cascading deletes) are
+# budgeted for this fixture, so growing it means raising theirs too.
+#
+# Writes pay for the change log (app/changes.py) on every flush: the
+# sequence update, its read back and the insert into changes, plus a wallet
+# lookup for transactions whose category isn't loaded. Transaction writes
+# also update the counters of their category, parent category and wallet
+# (app/counters.py). So the 11 of create_transaction are the user, the
+# category and parent category checked for ownership, the insert and the
+# reload of the transaction, 3 for the change log and 3 for the counters.
+# update_transaction loads the transaction instead of the categories and
+# adds the wallet lookup, delete_transaction drops the reload. delete_user
+# cascades over 9 flushes, 27 of its 87 statements are the change log, and it
+# also revokes the refresh tokens and counts the transactions to decide
+# whether to run as a job.
+QUERY_BUDGETS = {
+    'api.login': 5,
+    'api.index': 1,
+    'api.get_changes': 7,
+    'api.refresh_token': 3,
+    'api.revoke_refresh_token': 2,
+    'api.get_all_users': 5,
+    'api.get_user': 4,
+    'api.get_user_transactions': 2,
+    'api.get_user_dashboard': 3,
+    'api.create_user': 8,
+    'api.update_user': 9,
+    'api.delete_user': 87,
+    'api.get_all_wallets': 6,
+    'api.get_wallet': 3,
+    'api.get_wallet_tree': 3,
+    'api.get_wallet_alerts': 2,
+    'api.get_wallet_events': 4,
+    'api.create_wallet': 8,
+    'api.update_wallet': 8,
+    'api.delete_wallet': 41,
+    'api.get_all_parent_categories': 10,
+    'api.get_parent_category': 3,
+    'api.create_parent_category': 7,
+    'api.update_parent_category': 8,
+    'api.delete_parent_category': 21,
+    'api.get_all_categories': 2,
+    'api.get_category': 2,
+    'api.get_category_transactions': 2,
+    'api.create_category': 7,
+    'api.update_category': 8,
+    'api.delete_category': 13,
+    'api.get_all_transactions': 2,
+    'api.get_transaction': 2,
+    'api.search_transactions': 2,
+    'api.create_transaction': 11,
+    'api.update_transaction': 11,
+    'api.delete_transaction': 10,
+    'api.batch': 3,
+    'api.get_job_stats': 3,
+    'api.get_job': 2,
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(app):
+    counter = QueryCounter()
+    engines = [engine for bind, engine in database.engines(app)]
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', counter)
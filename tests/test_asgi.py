@@ -0,0 +1,118 @@
+import asyncio
+import json
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.asgi import AsgiApp
+from app.models import User
+
+
+class AsgiTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+        self.asgi = AsgiApp(self.app)
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+        db.session.remove()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    async def request(self, method, url, headers, body=None):
+        # Delivers the body in two parts, like a slow client would
+        content = json.dumps(body).encode('utf-8') if body is not None else b''
+        messages = [{'type': 'http.request', 'body': content[:5], 'more_body': True},
+                    {'type': 'http.request', 'body': content[5:], 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        path, _, query = url.replace('http://localhost', '').partition('?')
+        await self.asgi({'type': 'http', 'method': method, 'path': path, 'root_path': '',
+                         'query_string': query.encode('latin-1'), 'http_version': '1.1',
+                         'scheme': 'http', 'server': ('localhost', 80), 'client': ('127.0.0.1', 1234),
+                         'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                     for name, value in headers.items()]},
+                        receive, send)
+        return sent[0]['status'], json.loads(sent[1]['body'].decode('utf-8'))
+
+    def test_asgi_requests(self):
+        """
+        The test case for serving the API through ASGI.
+        """
+        headers = self.get_token_headers(self.token)
+
+        async def scenario():
+            status, body = await self.request('POST', url_for('api.create_wallet'), headers,
+                                              {'title': 'wallet', 'currency': 'usd', 'initial_balance': 0})
+            self.assertTrue(status == 201)
+            # Many concurrent readers share the read pool
+            responses = await asyncio.gather(*[self.request('GET', url_for('api.get_all_wallets'), headers)
+                                               for i in range(20)])
+            for status, body in responses:
+                self.assertTrue(status == 200)
+                self.assertTrue(len(body['wallets']) == 1)
+
+        asyncio.run(scenario())
+
+    def test_asgi_lifespan(self):
+        """
+        The test case for the ASGI lifespan protocol.
+        """
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        asyncio.run(self.asgi({'type': 'lifespan'}, receive, send))
+        self.assertTrue(sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
@@ -0,0 +1,213 @@
+import json
+import unittest
+from base64 import b64encode
+from random import randint
+
+from flask import url_for
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import User, Wallet, ParentCategory, IdempotencyKey
+
+
+class BatchTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_batch(self):
+        """
+        The test case for batch view.
+        """
+        data = {'requests': [
+            {'method': 'POST', 'path': '/wallets/',
+             'body': {'title': 'test_wallet', 'currency': 'usd',
+                      'initial_balance': randint(0, 100)}},
+            {'method': 'POST', 'path': '/parent-categories/',
+             'body': {'title': 'test_parent_category', 'budget': randint(0, 1000),
+                      'is_income': False, 'wallet_id': '${0.id}'}},
+            {'method': 'GET', 'path': '/wallets/${0.id}'},
+        ]}
+        response = self.client.post(
+            url_for('api.batch'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps(data)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        statuses = [r['status'] for r in response.json['responses']]
+        self.assertTrue(statuses == [201, 201, 200])
+        wallet = Wallet.query.first()
+        parent_category = ParentCategory.query.first()
+        self.assertTrue(parent_category.wallet_id == wallet.id)
+        self.assertTrue(response.json['responses'][2]['body']['parent_categories'] ==
+                        [url_for('api.get_parent_category', id=parent_category.id, _external=True)])
+
+    def test_batch_failed_reference(self):
+        """
+        The test case for batch view referencing a failed request.
+        """
+        data = {'requests': [
+            {'method': 'GET', 'path': '/no-such-route'},
+            {'method': 'GET', 'path': '/wallets/${0.id}'},
+        ]}
+        response = self.client.post(
+            url_for('api.batch'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps(data)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.json['responses'][0]['status'] == 404)
+        self.assertTrue(response.json['responses'][1]['status'] == 424)
+
+    def test_batch_failed_reference_with_code(self):
+        """
+        The test case for batch view referencing a request failed with a code in its body.
+        """
+        other_user = User.from_json({'username': 'other_user', 'email': 'other_user@example.com',
+                                     'password': 'new_password', 'confirmed': True})
+        db.session.add(other_user)
+        db.session.commit()
+        other_wallet = Wallet.from_json({'title': 'other_wallet', 'currency': 'usd', 'owner_id': other_user.id})
+        db.session.add(other_wallet)
+        db.session.commit()
+        data = {'requests': [
+            {'method': 'GET', 'path': '/wallets/{}/alerts'.format(other_wallet.id)},
+            {'method': 'GET', 'path': '/wallets/${0.code}'},
+        ]}
+        response = self.client.post(
+            url_for('api.batch'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps(data)
+        )
+
+        self.assertTrue(response.json['responses'][0]['status'] == 200)
+        self.assertTrue(response.json['responses'][0]['body']['code'] == 403)
+        self.assertTrue(response.json['responses'][1]['status'] == 424)
+
+    def test_batch_malformed_request(self):
+        """
+        The test case for batch view with malformed requests.
+        """
+        data = {'requests': [
+            {'method': 'GET', 'path': 5},
+            {'method': ['GET'], 'path': '/wallets/'},
+            'GET /wallets/',
+            {'method': 'GET', 'path': '/wallets/'},
+        ]}
+        response = self.client.post(
+            url_for('api.batch'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps(data)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        statuses = [r['status'] for r in response.json['responses']]
+        self.assertTrue(statuses == [400, 400, 400, 200])
+        self.assertTrue(response.json['responses'][0]['body']['code'] == 400)
+
+    def test_batch_malformed_body(self):
+        """
+        The test case for batch view with a body that isn't an object with a list of requests.
+        """
+        for data in ([{'method': 'GET', 'path': '/wallets/'}], {'requests': 5},
+                     {'requests': 'GET /wallets/'}, {'requests': {'method': 'GET', 'path': '/wallets/'}}):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    url_for('api.batch'),
+                    headers=self.get_token_headers(self.token),
+                    data=json.dumps(data)
+                )
+
+                self.assertTrue(response.json['code'] == 400)
+                self.assertTrue('responses' not in response.json)
+
+    def test_batch_idempotent_with_keyed_request(self):
+        """
+        The test case for retrying batch view whose requests carry idempotency keys of their own.
+        """
+        data = {'requests': [
+            {'method': 'POST', 'path': '/wallets/', 'headers': {'Idempotency-Key': 'wallet-key'},
+             'body': {'title': 'test_wallet', 'currency': 'usd', 'initial_balance': 0}},
+            {'method': 'POST', 'path': '/wallets/',
+             'body': {'title': 'other_wallet', 'currency': 'usd', 'initial_balance': 0}},
+        ]}
+        headers = self.get_token_headers(self.token)
+        headers['Idempotency-Key'] = 'batch-key'
+        keys = []
+
+        def before_commit(session):
+            keys.append(session.info.get('idempotency_key'))
+
+        event.listen(db.session, 'before_commit', before_commit)
+        try:
+            responses = [self.client.post(url_for('api.batch'), headers=headers, data=json.dumps(data))
+                         for i in range(2)]
+        finally:
+            event.remove(db.session, 'before_commit', before_commit)
+
+        self.assertTrue([r['status'] for r in responses[0].json['responses']] == [201, 201])
+        # The request after the keyed one commits under the key of the batch again
+        self.assertTrue((self.user.id, 'wallet-key') in keys)
+        self.assertTrue(keys[-2] == (self.user.id, 'batch-key'))
+        self.assertTrue(responses[1].headers['Idempotent-Replayed'] == 'true')
+        self.assertTrue(Wallet.query.count() == 2)
+        key = IdempotencyKey.query.filter_by(key='batch-key').one()
+        self.assertTrue(key.applied and key.status_code == 200)
+
+    def test_batch_requires_token(self):
+        """
+        The test case for batch view without a token.
+        """
+        data = {'requests': [{'method': 'GET', 'path': '/wallets/'}]}
+        response = self.client.post(
+            url_for('api.batch'),
+            headers=self.get_api_headers('test_user', 'new_password'),
+            data=json.dumps(data)
+        )
+
+        self.assertTrue(response.json['code'] == 401)
+        self.assertTrue('responses' not in response.json)
@@ -0,0 +1,45 @@
+import unittest
+
+from app import bench, create_app, db
+
+
+class BenchTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.request_context = self.app.test_request_context()
+        self.request_context.push()
+        db.create_all()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.request_context.pop()
+
+    def test_bench(self):
+        """
+        The test case for benchmarking every API endpoint.
+        """
+        user = bench.seed(users=2, wallets=1, parent_categories=1, categories=1, transactions=2)
+        results = bench.run(self.app, user, requests=2, concurrency=2)
+
+        endpoints = {rule.endpoint for rule in self.app.url_map.iter_rules()
+                     if rule.endpoint.startswith('api.')}
+        self.assertTrue(set(results) == endpoints)
+        for endpoint, result in results.items():
+            self.assertTrue(result['requests'] == 2, endpoint)
+            self.assertTrue(result['errors'] == 0, endpoint)
+            self.assertTrue(result['p50'] <= result['p95'] <= result['p99'])
+
+    def test_compare(self):
+        """
+        The test case for flagging benchmark regressions.
+        """
+        baseline = {'api.index': {'p50': 1.0, 'p95': 2.0, 'throughput': 100.0},
+                    'api.login': {'p50': 1.0, 'p95': 2.0, 'throughput': 100.0}}
+        results = {'api.index': {'p50': 1.1, 'p95': 2.1, 'throughput': 95.0},
+                   'api.login': {'p50': 1.0, 'p95': 3.0, 'throughput': 50.0},
+                   'api.batch': {'p50': 9.0, 'p95': 9.0, 'throughput': 1.0}}
+
+        self.assertTrue(bench.compare(results, baseline) == [('api.login', 'p95', 2.0, 3.0),
+                                                              ('api.login', 'throughput', 100.0, 50.0)])
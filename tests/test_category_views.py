@@ -123,6 +123,10 @@ class CategoryTestCase(unittest.TestCase):
         self.assertTrue(response.json['parent_category'] == url_for('api.get_parent_category',
                                                                     id=self.category.parent_category_id,
                                                                     _external=True))
+        self.assertTrue(response.json['transactions'] == url_for('api.get_category_transactions',
+                                                                 id=self.category.id,
+                                                                 _external=True))
+        self.assertTrue(response.json['transactions_count'] == 0)
 
     def test_create_category(self):
         """
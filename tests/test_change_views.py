@@ -0,0 +1,147 @@
+import json
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.models import User, Wallet, Change
+
+
+class ChangeTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create users
+        for username in ('test_user', 'other_user'):
+            db.session.add(User.from_json({'username': username,
+                                           'email': '{}@example.com'.format(username),
+                                           'password': 'new_password',
+                                           'confirmed': True}))
+        db.session.commit()
+        self.user = User.query.filter_by(username='test_user').first()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+        # Create wallet of other user
+        other_user = User.query.filter_by(username='other_user').first()
+        db.session.add(Wallet.from_json({'title': 'other_wallet', 'currency': 'usd', 'owner_id': other_user.id}))
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, endpoint, data):
+        return self.client.post(url_for(endpoint),
+                                headers=self.get_token_headers(self.token),
+                                data=json.dumps(data)).json
+
+    def get_changes(self, since, limit=100):
+        return self.client.get(url_for('api.get_changes', since=since, limit=limit),
+                               headers=self.get_token_headers(self.token)).json
+
+    def test_get_changes(self):
+        """
+        The test case for get_changes view.
+        """
+        response = self.get_changes(0)
+        self.assertTrue([(c['type'], c['id']) for c in response['changes']] == [('users', self.user.id)])
+        self.assertTrue('password' not in response['changes'][0]['data'])
+        since = response['last_seq']
+
+        wallet = self.post('api.create_wallet', {'title': 'wallet', 'currency': 'usd', 'initial_balance': 0})
+        parent_category = self.post('api.create_parent_category',
+                                    {'title': 'parent_category', 'wallet_id': wallet['id']})
+        category = self.post('api.create_category',
+                             {'title': 'category', 'parent_category_id': parent_category['id']})
+        self.client.put(url_for('api.update_wallet', id=wallet['id']),
+                        headers=self.get_token_headers(self.token),
+                        data=json.dumps({'title': 'new_title'}))
+
+        response = self.get_changes(since)
+        changes = response['changes']
+        # The wallet only shows up with its last change
+        self.assertTrue([(c['type'], c['id']) for c in changes] ==
+                        [('parent_categories', parent_category['id']),
+                         ('categories', category['id']),
+                         ('wallets', wallet['id'])])
+        self.assertTrue(changes[2]['data']['title'] == 'new_title')
+        self.assertTrue(changes[2]['seq'] == Wallet.query.get(wallet['id']).seq)
+        self.assertTrue(response['next'] is None)
+
+        # Deletes cascade into tombstones
+        since = response['last_seq']
+        self.client.delete(url_for('api.delete_wallet', id=wallet['id']),
+                           headers=self.get_token_headers(self.token))
+        response = self.get_changes(since)
+        self.assertTrue(sorted((c['type'], c['id'], c['deleted'], c['data']) for c in response['changes']) ==
+                        [('categories', category['id'], True, None),
+                         ('parent_categories', parent_category['id'], True, None),
+                         ('wallets', wallet['id'], True, None)])
+        self.assertTrue(self.get_changes(response['last_seq'])['changes'] == [])
+
+    def test_get_changes_pages(self):
+        """
+        The test case for get_changes view with several pages.
+        """
+        for i in range(3):
+            self.post('api.create_wallet', {'title': 'wallet{}'.format(i), 'currency': 'usd'})
+
+        response = self.get_changes(0, limit=2)
+        self.assertTrue(len(response['changes']) == 2)
+        self.assertTrue(response['next'] is not None)
+        response = self.client.get(response['next'], headers=self.get_token_headers(self.token)).json
+        self.assertTrue([c['data']['title'] for c in response['changes']] == ['wallet1', 'wallet2'])
+        self.assertTrue(response['next'] is None)
+        # Pages hold at least one change
+        response = self.get_changes(0, limit=0)
+        self.assertTrue(len(response['changes']) == 1 and 'limit=1' in response['next'])
+        # The wallet of the other user is logged but never returned
+        self.assertTrue(Change.query.filter_by(kind='wallets').count() == 4)
+
+    def test_get_changes_of_uncategorized_transaction(self):
+        """
+        The test case for get_changes view with a transaction taken out of its category.
+        """
+        wallet = self.post('api.create_wallet', {'title': 'wallet', 'currency': 'usd'})
+        parent_category = self.post('api.create_parent_category',
+                                    {'title': 'parent_category', 'wallet_id': wallet['id']})
+        category = self.post('api.create_category',
+                             {'title': 'category', 'parent_category_id': parent_category['id']})
+        transaction = self.post('api.create_transaction', {'amount': 10, 'category_id': category['id']})
+        since = self.get_changes(0)['last_seq']
+
+        response = self.client.put(url_for('api.update_transaction', id=transaction['id']),
+                                   headers=self.get_token_headers(self.token),
+                                   data=json.dumps({'category_id': None}))
+        self.assertTrue(response.status_code == 200 and response.json['category'] is None)
+        change = Change.query.filter(Change.seq > since).one()
+        self.assertTrue((change.kind, change.object_id) == ('transactions', transaction['id']))
+        self.assertTrue(change.user_id == self.user.id and change.wallet_id is None)
@@ -0,0 +1,193 @@
+import json
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.counters import period_of, repair_counters
+from app.models import User, Wallet, ParentCategory, Category, Transaction, Alert
+
+
+class CounterTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json({'username': 'test_user',
+                                    'email': 'test_user@example.com',
+                                    'password': 'new_password',
+                                    'confirmed': True})
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Create wallet with two parent categories
+        self.wallet = Wallet.from_json({'title': 'wallet', 'currency': 'usd', 'owner_id': self.user.id})
+        db.session.add(self.wallet)
+        db.session.commit()
+        self.parent_category = ParentCategory.from_json({'title': 'expense', 'budget': 1000,
+                                                         'is_income': False, 'wallet_id': self.wallet.id})
+        self.other_parent_category = ParentCategory.from_json({'title': 'other', 'budget': 0,
+                                                               'is_income': False, 'wallet_id': self.wallet.id})
+        db.session.add_all([self.parent_category, self.other_parent_category])
+        db.session.commit()
+        self.category = Category.from_json({'title': 'food', 'budget': 100,
+                                            'parent_category_id': self.parent_category.id})
+        self.other_category = Category.from_json({'title': 'rent', 'budget': 0,
+                                                  'parent_category_id': self.other_parent_category.id})
+        db.session.add_all([self.category, self.other_category])
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_transaction(self, amount, category):
+        return self.client.post(url_for('api.create_transaction'),
+                                headers=self.get_token_headers(self.token),
+                                data=json.dumps({'amount': amount, 'category_id': category.id})).json
+
+    def counters(self, model, id):
+        db.session.expire_all()
+        obj = model.query.get(id)
+        return obj.transactions_count, obj.transactions_total, obj.period_spent
+
+    def test_counters(self):
+        """
+        The test case for keeping the counters of transaction writes.
+        """
+        first = self.create_transaction(30, self.category)
+        second = self.create_transaction(50, self.category)
+        self.assertTrue(self.counters(Category, self.category.id) == (2, 80, 80))
+        self.assertTrue(self.counters(ParentCategory, self.parent_category.id) == (2, 80, 80))
+        self.assertTrue(self.counters(Wallet, self.wallet.id) == (2, 80, 80))
+        self.assertTrue(Category.query.get(self.category.id).period == period_of())
+
+        self.client.put(url_for('api.update_transaction', id=first['id']),
+                        headers=self.get_token_headers(self.token),
+                        data=json.dumps({'amount': 40}))
+        self.assertTrue(self.counters(Category, self.category.id) == (2, 90, 90))
+
+        # Moving a transaction moves its amount along
+        self.client.put(url_for('api.update_transaction', id=second['id']),
+                        headers=self.get_token_headers(self.token),
+                        data=json.dumps({'category_id': self.other_category.id}))
+        self.assertTrue(self.counters(Category, self.category.id) == (1, 40, 40))
+        self.assertTrue(self.counters(ParentCategory, self.other_parent_category.id) == (1, 50, 50))
+        self.assertTrue(self.counters(Wallet, self.wallet.id) == (2, 90, 90))
+
+        # And so does moving a category
+        self.client.put(url_for('api.update_category', id=self.other_category.id),
+                        headers=self.get_token_headers(self.token),
+                        data=json.dumps({'parent_category_id': self.parent_category.id}))
+        self.assertTrue(self.counters(ParentCategory, self.parent_category.id) == (2, 90, 90))
+        self.assertTrue(self.counters(ParentCategory, self.other_parent_category.id) == (0, 0, 0))
+
+        self.client.delete(url_for('api.delete_transaction', id=first['id']),
+                           headers=self.get_token_headers(self.token))
+        self.assertTrue(self.counters(Category, self.category.id) == (0, 0, 0))
+        self.assertTrue(self.counters(Wallet, self.wallet.id) == (1, 50, 50))
+        with db.engine.begin() as connection:
+            self.assertTrue(repair_counters(connection) ==
+                            {'categories': 0, 'parent_categories': 0, 'wallets': 0})
+
+    def test_counters_of_deleted_rows(self):
+        """
+        The test case for taking the counters of deleted rows off their parents.
+        """
+        self.create_transaction(10, self.category)
+        self.create_transaction(20, self.other_category)
+        self.client.delete(url_for('api.delete_category', id=self.category.id),
+                           headers=self.get_token_headers(self.token))
+        self.assertTrue(self.counters(ParentCategory, self.parent_category.id) == (0, 0, 0))
+        self.assertTrue(self.counters(Wallet, self.wallet.id) == (1, 20, 20))
+
+        # The transactions of a deleted parent category leave the wallet too
+        self.client.delete(url_for('api.delete_parent_category', id=self.other_parent_category.id),
+                           headers=self.get_token_headers(self.token))
+        self.assertTrue(ParentCategory.query.get(self.other_parent_category.id) is None)
+        self.assertTrue(self.counters(Wallet, self.wallet.id) == (0, 0, 0))
+
+    def test_repair_counters(self):
+        """
+        The test case for recomputing the counters from scratch.
+        """
+        self.create_transaction(30, self.category)
+        old = Transaction.from_json({'amount': 20, 'category_id': self.category.id, 'maker_id': self.user.id})
+        db.session.add(old)
+        db.session.commit()
+        # Transactions of earlier months don't count towards this one
+        db.session.execute(Transaction.__table__.update()
+                           .where(Transaction.id == old.id)
+                           .values(created_at=old.created_at.replace(year=2000)))
+        db.session.execute(Category.__table__.update().values(transactions_count=7, period='2000-01'))
+        db.session.commit()
+
+        with db.engine.begin() as connection:
+            repaired = repair_counters(connection)
+        # Rows that were never counted in this month are brought up to it too
+        self.assertTrue(repaired == {'categories': 2, 'parent_categories': 2, 'wallets': 1})
+        self.assertTrue(self.counters(Category, self.category.id) == (2, 50, 30))
+        self.assertTrue(self.counters(Category, self.other_category.id) == (0, 0, 0))
+        self.assertTrue(self.counters(Wallet, self.wallet.id) == (2, 50, 30))
+
+    def test_budget_alerts(self):
+        """
+        The test case for get_wallet_alerts view.
+        """
+        self.create_transaction(50, self.category)
+        self.assertTrue(Alert.query.count() == 0)
+        self.create_transaction(40, self.category)
+        self.create_transaction(5, self.category)
+        self.create_transaction(20, self.category)
+
+        response = self.client.get(url_for('api.get_wallet_alerts', id=self.wallet.id),
+                                   headers=self.get_token_headers(self.token))
+        alerts = response.json['alerts']
+        self.assertTrue([(a['type'], a['threshold'], a['spent']) for a in alerts] ==
+                        [('categories', 1.0, 115), ('categories', 0.8, 90)])
+        self.assertTrue(alerts[0]['object_id'] == self.category.id)
+        self.assertTrue(Alert.query.first().user_id == self.user.id)
+
+        # Budgets of parent categories are watched too
+        self.create_transaction(900, self.category)
+        self.assertTrue(Alert.query.filter_by(kind='parent_categories').one().threshold == 1.0)
+
+        other_user = User.from_json({'username': 'other_user', 'email': 'other_user@example.com',
+                                     'password': 'new_password', 'confirmed': True})
+        db.session.add(other_user)
+        db.session.commit()
+        other_wallet = Wallet.from_json({'title': 'other', 'currency': 'usd', 'owner_id': other_user.id})
+        db.session.add(other_wallet)
+        db.session.commit()
+        response = self.client.get(url_for('api.get_wallet_alerts', id=other_wallet.id),
+                                   headers=self.get_token_headers(self.token))
+        self.assertTrue(response.json['code'] == 403)
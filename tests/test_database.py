@@ -0,0 +1,58 @@
+import sqlite3
+import unittest
+
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, db
+from app.database import retry_on_lock
+
+
+class DatabaseTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app.config['SQLITE_LOCK_BACKOFF'] = 0
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_pragmas(self):
+        """
+        The test case for the connection pragmas.
+        """
+        pragmas = self.app.config['SQLITE_PRAGMAS']
+        journal_mode = db.session.execute('PRAGMA journal_mode').scalar()
+        busy_timeout = db.session.execute('PRAGMA busy_timeout').scalar()
+
+        self.assertTrue(journal_mode == pragmas['journal_mode'].lower())
+        self.assertTrue(busy_timeout == pragmas['busy_timeout'])
+
+    def test_retry_on_lock(self):
+        """
+        The test case for retrying a view on lock contention.
+        """
+        calls = []
+
+        @retry_on_lock
+        def view():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('INSERT', {}, sqlite3.OperationalError('database is locked'))
+            return 'ok'
+
+        self.assertTrue(view() == 'ok')
+        self.assertTrue(len(calls) == 3)
+
+        @retry_on_lock
+        def broken_view():
+            calls.append(1)
+            raise OperationalError('INSERT', {}, sqlite3.OperationalError('no such table: wallets'))
+
+        calls.clear()
+        self.assertRaises(OperationalError, broken_view)
+        self.assertTrue(len(calls) == 1)
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.asgi import AsgiApp
+from app.models import User, Wallet
+
+
+class EventTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create users
+        for username in ('test_user', 'other_user'):
+            db.session.add(User.from_json({'username': username,
+                                           'email': '{}@example.com'.format(username),
+                                           'password': 'new_password',
+                                           'confirmed': True}))
+        db.session.commit()
+        self.user = User.query.filter_by(username='test_user').first()
+
+        # Create wallets
+        other_user = User.query.filter_by(username='other_user').first()
+        self.wallet = Wallet.from_json({'title': 'wallet', 'currency': 'usd', 'owner_id': self.user.id})
+        self.other_wallet = Wallet.from_json({'title': 'other_wallet', 'currency': 'usd',
+                                              'owner_id': other_user.id})
+        db.session.add_all([self.wallet, self.other_wallet])
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def create_parent_category(self, title):
+        return self.client.post(url_for('api.create_parent_category'),
+                                headers=self.get_token_headers(self.token),
+                                data=json.dumps({'title': title, 'wallet_id': self.wallet.id})).json
+
+    def open_events(self, wallet_id, last_event_id=None):
+        headers = self.get_token_headers(self.token)
+        if last_event_id is not None:
+            headers['Last-Event-ID'] = str(last_event_id)
+        return self.client.get(url_for('api.get_wallet_events', id=wallet_id), headers=headers, buffered=False)
+
+    @staticmethod
+    def events(chunks):
+        return [chunk for chunk in chunks if chunk and not chunk.startswith(b':')]
+
+    def test_get_wallet_events(self):
+        """
+        The test case for get_wallet_events view.
+        """
+        response = self.open_events(self.wallet.id)
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.mimetype == 'text/event-stream')
+        chunks = iter(response.response)
+        # The stream opens at once, without waiting for a change or a heartbeat
+        self.assertTrue(next(chunks) == b': open\n\n')
+        parent_category = self.create_parent_category('parent_category')
+        event = next(chunk for chunk in chunks if not chunk.startswith(b':'))
+        lines = event.decode('utf-8').split('\n')
+        self.assertTrue(lines[1] == 'event: create')
+        message = json.loads(lines[2][len('data: '):])
+        self.assertTrue(message['type'] == 'parent_categories' and message['id'] == parent_category['id'])
+        self.assertTrue(lines[0] == 'id: {}'.format(message['seq']))
+        response.close()
+        self.assertTrue(self.app.extensions['events']._subscribers == {})
+
+        # Reconnecting replays what was missed
+        self.create_parent_category('missed')
+        response = self.open_events(self.wallet.id, last_event_id=message['seq'])
+        events = self.events(response.response)
+        self.assertTrue(len(events) == 1 and b'"op": "create"' in events[0])
+
+        # Too far behind, the client is told to reload
+        self.app.config['EVENTS_REPLAY_LIMIT'] = 0
+        response = self.open_events(self.wallet.id, last_event_id=message['seq'])
+        self.assertTrue(self.events(response.response) == [b'event: reset\ndata: {}\n\n'])
+
+    def test_get_wallet_events_of_other_user(self):
+        """
+        The test case for get_wallet_events view with the wallet of another user.
+        """
+        response = self.open_events(self.other_wallet.id)
+        self.assertTrue(response.json['code'] == 403)
+        self.assertTrue(self.app.extensions['events']._subscribers == {})
+
+    def test_get_wallet_events_over_asgi(self):
+        """
+        The test case for get_wallet_events view served from the event loop.
+        """
+        asgi = AsgiApp(self.app)
+        sent = []
+
+        async def receive():
+            if not sent:
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client stays connected
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.start':
+                self.create_parent_category('parent_category')
+
+        headers = self.get_token_headers(self.token)
+        path = '/api/v1.0/wallets/{}/events'.format(self.wallet.id)
+        asyncio.run(asgi({'type': 'http', 'method': 'GET', 'path': path,
+                          'root_path': '', 'query_string': b'', 'http_version': '1.1', 'scheme': 'http',
+                          'server': ('localhost', 80), 'client': ('127.0.0.1', 1234),
+                          'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                      for name, value in headers.items()]},
+                         receive, send))
+        self.assertTrue(sent[0]['status'] == 200)
+        self.assertTrue(sent[1]['body'] == b': open\n\n')
+        events = self.events(message['body'] for message in sent[1:])
+        self.assertTrue(len(events) == 1 and b'event: create' in events[0])
+        self.assertTrue(sent[-1] == {'type': 'http.response.body', 'body': b''})
+        self.assertTrue(self.app.extensions['events']._subscribers == {})
+        asgi.readers.shutdown()
+        asgi.writers.shutdown()
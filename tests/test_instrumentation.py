@@ -0,0 +1,108 @@
+import json
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.models import User
+
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_server_timing(self):
+        """
+        The test case for the Server-Timing header.
+        """
+        response = self.client.get(
+            url_for('api.get_all_users'),
+            headers=self.get_token_headers(self.token)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        timings = dict(metric.strip().split(';dur=')
+                       for metric in response.headers['Server-Timing'].split(','))
+        for name in ('db', 'auth', 'serialize', 'total'):
+            self.assertTrue(float(timings[name]) >= 0)
+
+    def test_slow_requests(self):
+        """
+        The test case for the slow request log.
+        """
+        self.app.config['SLOW_REQUEST_THRESHOLD'] = 0
+        self.client.get(
+            url_for('api.get_all_users'),
+            headers=self.get_token_headers(self.token)
+        )
+        response = self.client.get(url_for('slow_requests'))
+
+        self.assertTrue(response.status_code == 200)
+        entry = response.json['slow_requests'][-1]
+        self.assertTrue(entry['endpoint'] == 'api.get_all_users')
+        # The user lookup, the user list, their wallets and the transaction counts
+        self.assertTrue(len(entry['queries']) == 4)
+        self.assertTrue(entry['queries'][0]['statement'].startswith('SELECT'))
+
+    def test_server_timing_of_batch(self):
+        """
+        The test case for the Server-Timing header of a batch.
+        """
+        data = {'requests': [{'method': 'GET', 'path': '/users/'} for _ in range(3)]}
+        response = self.client.post(
+            url_for('api.batch'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps(data)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        timings = dict(metric.strip().split(';dur=')
+                       for metric in response.headers['Server-Timing'].split(','))
+        # The sub-requests don't overwrite the timings of the batch
+        self.assertTrue('auth' in timings)
+        self.assertTrue(float(timings['total']) >= float(timings['db']) + float(timings['auth']))
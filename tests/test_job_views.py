@@ -0,0 +1,202 @@
+import unittest
+from base64 import b64encode
+from random import randint, choice
+
+from flask import url_for
+
+from app import create_app, db
+from app.jobs import registry, task, enqueue, run_once, stats
+from app.models import User, Wallet, ParentCategory, Category, Transaction, Job
+
+
+def failing_task():
+    raise RuntimeError('boom')
+
+
+class JobTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app.config['JOBS_RETRY_BACKOFF'] = 0
+        task(max_attempts=2)(failing_task)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+        # Create wallet with one category and a transaction
+        self.wallet = Wallet.from_json({'title': 'test_wallet',
+                                        'currency': 'usd',
+                                        'initial_balance': randint(0, 100),
+                                        'owner_id': self.user.id})
+        db.session.add(self.wallet)
+        db.session.commit()
+        self.parent_category = ParentCategory.from_json({'title': 'test_parent_category',
+                                                         'budget': randint(0, 1000),
+                                                         'is_income': choice([True, False]),
+                                                         'wallet_id': self.wallet.id})
+        db.session.add(self.parent_category)
+        db.session.commit()
+        self.category = Category.from_json({'title': 'test_category',
+                                            'budget': randint(0, 1000),
+                                            'has_bills': choice([True, False]),
+                                            'parent_category_id': self.parent_category.id})
+        db.session.add(self.category)
+        db.session.commit()
+        db.session.add(Transaction.from_json({'amount': randint(1, 2000),
+                                              'description': 'some description',
+                                              'category_id': self.category.id,
+                                              'maker_id': self.user.id}))
+        db.session.commit()
+
+    def tearDown(self) -> None:
+        registry.pop('failing_task', None)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_delete_wallet_async(self):
+        """
+        The test case for delete_wallet view running as a job.
+        """
+        headers = self.get_token_headers(self.token)
+        headers['Prefer'] = 'respond-async'
+        response = self.client.delete(
+            url_for('api.delete_wallet', id=self.wallet.id),
+            headers=headers
+        )
+
+        self.assertTrue(response.status_code == 202)
+        self.assertTrue(response.json['status'] == 'queued')
+        self.assertTrue(response.headers['Location'] == response.json['url'])
+        self.assertIsNotNone(Wallet.query.first())
+
+        run_once()
+
+        self.assertIsNone(Wallet.query.first())
+        self.assertIsNone(Transaction.query.first())
+
+    def test_delete_parent_category_both_ways(self):
+        """
+        The test case for delete_parent_category view removing the same rows inline and as a job.
+        """
+        for prefer in (None, 'respond-async'):
+            parent_category = ParentCategory.from_json({'title': 'parent_category', 'budget': 0,
+                                                        'is_income': False, 'wallet_id': self.wallet.id})
+            db.session.add(parent_category)
+            db.session.commit()
+            category = Category.from_json({'title': 'category', 'budget': 0, 'has_bills': False,
+                                           'parent_category_id': parent_category.id})
+            db.session.add(category)
+            db.session.commit()
+            db.session.add(Transaction.from_json({'amount': 10, 'description': 'description',
+                                                  'category_id': category.id, 'maker_id': self.user.id}))
+            db.session.commit()
+            headers = self.get_token_headers(self.token)
+            if prefer:
+                headers['Prefer'] = prefer
+            response = self.client.delete(url_for('api.delete_parent_category', id=parent_category.id),
+                                          headers=headers)
+            self.assertTrue(response.status_code == (202 if prefer else 200))
+            run_once()
+
+            self.assertIsNone(ParentCategory.query.get(parent_category.id))
+            self.assertTrue(Category.query.filter_by(parent_category_id=parent_category.id).count() == 0)
+            self.assertIsNone(Category.query.get(category.id))
+            self.assertTrue(Transaction.query.filter_by(category_id=category.id).count() == 0)
+            # Only the rows of setUp are left
+            self.assertTrue(Category.query.count() == 1 and Transaction.query.count() == 1)
+
+    def test_get_job(self):
+        """
+        The test case for get_job view.
+        """
+        job = enqueue('delete_category', owner_id=self.user.id, id=self.category.id)
+        run_once()
+        response = self.client.get(
+            url_for('api.get_job', id=job.id),
+            headers=self.get_token_headers(self.token)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.json['status'] == 'succeeded')
+        self.assertTrue(response.json['attempts'] == 1)
+        self.assertTrue(response.json['result']['id'] == self.category.id)
+
+    def test_get_job_of_deleted_user(self):
+        """
+        The test case for get_job view after the job deleted the user.
+        """
+        job = enqueue('delete_user', owner_id=self.user.id, id=self.user.id)
+        run_once()
+        self.assertTrue(Job.query.get(job.id).status == 'succeeded')
+        response = self.client.get(
+            url_for('api.get_job', id=job.id),
+            headers=self.get_token_headers(self.token)
+        )
+
+        self.assertTrue(response.json['code'] == 401)
+
+    def test_job_retries(self):
+        """
+        The test case for retrying a failing job.
+        """
+        job = enqueue('failing_task', owner_id=self.user.id)
+        run_once()
+        job = Job.query.get(job.id)
+        self.assertTrue(job.status == 'queued')
+        self.assertTrue(job.attempts == 1)
+
+        run_once()
+        job = Job.query.get(job.id)
+        self.assertTrue(job.status == 'failed')
+        self.assertTrue(job.attempts == 2)
+        self.assertIsNone(run_once())
+
+    def test_get_job_stats(self):
+        """
+        The test case for get_job_stats view.
+        """
+        enqueue('failing_task', owner_id=self.user.id)
+        enqueue('delete_category', owner_id=self.user.id, id=self.category.id)
+        response = self.client.get(
+            url_for('api.get_job_stats'),
+            headers=self.get_token_headers(self.token)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.json['queued'] == 2)
+        self.assertTrue(stats()['succeeded'] == 0)
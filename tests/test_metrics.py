@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.metrics import Metrics
+from app.models import User
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_metrics(self):
+        """
+        The test case for the metrics view.
+        """
+        self.client.get(
+            url_for('api.get_all_users'),
+            headers=self.get_token_headers(self.token)
+        )
+        self.client.get(url_for('api.index') + 'missing')
+        response = self.client.get(url_for('metrics'))
+
+        self.assertTrue(response.status_code == 200)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertTrue('# TYPE wallets_request_duration_seconds histogram' in lines)
+        self.assertTrue('wallets_requests_total{endpoint="api.get_all_users",method="GET",status="200"} 1'
+                        in lines)
+        self.assertTrue('wallets_request_errors_total{endpoint="unmatched",status="404"} 1' in lines)
+        self.assertTrue('wallets_request_duration_seconds_count{endpoint="api.get_all_users"} 1' in lines)
+        self.assertTrue('wallets_request_duration_seconds_bucket{endpoint="api.get_all_users",le="+Inf"} 1'
+                        in lines)
+        self.assertTrue(any(line.startswith('wallets_db_connections_checked_out{bind="default"}')
+                            for line in lines))
+        self.assertTrue(any(line.startswith('wallets_metrics_overhead_seconds_total ') for line in lines))
+
+    def test_metrics_of_error_code(self):
+        """
+        The test case for counting an error answered with 200 and its code in the body.
+        """
+        response = self.client.get(
+            url_for('api.get_job', id=1),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.status_code == 200 and response.json['code'] == 404)
+        response = self.client.get(url_for('metrics'))
+
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertTrue('wallets_requests_total{endpoint="api.get_job",method="GET",status="200"} 1' in lines)
+        self.assertTrue('wallets_request_errors_total{endpoint="api.get_job",status="404"} 1' in lines)
+
+    def test_metrics_of_batch(self):
+        """
+        The test case for the metrics of a batch and its sub-requests.
+        """
+        data = {'requests': [{'method': 'GET', 'path': '/users/'} for _ in range(3)]}
+        self.client.post(
+            url_for('api.batch'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps(data)
+        )
+        response = self.client.get(url_for('metrics'))
+
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertTrue('wallets_requests_total{endpoint="api.get_all_users",method="GET",status="200"} 3'
+                        in lines)
+        # Each sub-request counts its own queries, the batch all of them
+        self.assertTrue('wallets_request_queries_total{endpoint="api.get_all_users"} 9' in lines)
+        self.assertTrue('wallets_request_queries_total{endpoint="api.batch"} 10' in lines)
+
+    def test_metrics_across_workers(self):
+        """
+        The test case for adding up the metrics of several worker processes.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics = Metrics((0.1, 1.0), directory)
+        metrics.inc('wallets_requests_total', {'endpoint': 'api.index'})
+        metrics.observe('wallets_request_duration_seconds', {'endpoint': 'api.index'}, 0.05)
+        metrics.add('wallets_db_connections_checked_out', {'bind': 'default'}, 1)
+
+        # Another worker, still running
+        other = os.getppid()
+        with open(os.path.join(directory, 'metrics-{}.json'.format(other)), 'w') as f:
+            json.dump({'pid': other,
+                       'counters': [['wallets_requests_total', [['endpoint', 'api.index']], 2]],
+                       'histograms': [['wallets_request_duration_seconds', [['endpoint', 'api.index']],
+                                       {'buckets': [0, 2], 'sum': 1.0, 'count': 2}]],
+                       'gauges': [['wallets_db_connections_checked_out', [['bind', 'default']], 3]]}, f)
+
+        lines = metrics.render().splitlines()
+        self.assertTrue('wallets_requests_total{endpoint="api.index"} 3' in lines)
+        self.assertTrue('wallets_request_duration_seconds_bucket{endpoint="api.index",le="0.1"} 1' in lines)
+        self.assertTrue('wallets_request_duration_seconds_bucket{endpoint="api.index",le="1.0"} 3' in lines)
+        self.assertTrue('wallets_request_duration_seconds_count{endpoint="api.index"} 3' in lines)
+        self.assertTrue('wallets_db_connections_checked_out{bind="default",pid="%d"} 3' % other in lines)
+        self.assertTrue('wallets_db_connections_checked_out{bind="default",pid="%d"} 1' % os.getpid() in lines)
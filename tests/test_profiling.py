@@ -0,0 +1,63 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import url_for
+
+from app import create_app, db
+from app.profiling import profiles, summarize
+
+
+class ProfilingTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.directory = tempfile.mkdtemp()
+        self.app.config['PROFILE_DIR'] = self.directory
+        self.app.config['PROFILE_TOKEN'] = 'secret'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def test_profile_on_header(self):
+        """
+        The test case for profiling requests that ask for it.
+        """
+        response = self.client.get(url_for('api.index'), headers={'X-Profile': 'secret'})
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.headers['X-Profile-Id'].endswith('-api.index.prof'))
+        self.assertTrue(os.listdir(self.directory) == [response.headers['X-Profile-Id']])
+
+        for header in ('wrong', 'sécret'):
+            response = self.client.get(url_for('api.index'), headers={'X-Profile': header})
+            self.assertTrue(response.status_code == 200)
+            self.assertTrue('X-Profile-Id' not in response.headers)
+        self.assertTrue(len(os.listdir(self.directory)) == 1)
+
+        stream = io.StringIO()
+        self.assertTrue(summarize(self.directory, 'api.index', stream=stream) == 1)
+        self.assertTrue('function calls' in stream.getvalue())
+
+    def test_profile_rotation(self):
+        """
+        The test case for keeping only the newest profiles.
+        """
+        self.app.config['PROFILE_KEEP'] = 2
+        self.app.config['PROFILE_SAMPLE_RATE'] = 1
+        names = [self.client.get(url_for('api.index')).headers['X-Profile-Id'] for i in range(3)]
+
+        self.assertTrue([os.path.basename(path) for path in profiles(self.directory)] == names[1:])
+
+        self.app.config['PROFILE_KEEP'] = 0
+        self.client.get(url_for('api.index'))
+        self.assertTrue(profiles(self.directory) == [])
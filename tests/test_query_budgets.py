@@ -0,0 +1,221 @@
+import json
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.jobs import enqueue
+from app.models import User, Wallet, ParentCategory, Category, Transaction
+from tests.query_budget import QUERY_BUDGETS, count_queries
+
+
+class QueryBudgetTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Two users, each with 2 wallets x 2 parent categories x 2 categories
+        # x 3 transactions, so per-row queries show up as budget overruns.
+        self.users = []
+        for i in range(2):
+            user = User.from_json({'username': 'test_user{}'.format(i),
+                                   'email': 'test_user{}@example.com'.format(i),
+                                   'password': 'new_password',
+                                   'confirmed': True,
+                                   'first_name': 'test_first_name',
+                                   'last_name': 'test_last_name'})
+            db.session.add(user)
+            db.session.commit()
+            self.users.append(user)
+            for j in range(2):
+                wallet = Wallet.from_json({'title': 'wallet{}'.format(j), 'currency': 'usd',
+                                           'initial_balance': 100, 'owner_id': user.id})
+                db.session.add(wallet)
+                db.session.commit()
+                for k in range(2):
+                    parent_category = ParentCategory.from_json({'title': 'parent_category{}'.format(k),
+                                                                'budget': 500, 'is_income': k == 0,
+                                                                'wallet_id': wallet.id})
+                    db.session.add(parent_category)
+                    db.session.commit()
+                    for m in range(2):
+                        category = Category.from_json({'title': 'category{}'.format(m),
+                                                       'budget': 100, 'has_bills': False,
+                                                       'parent_category_id': parent_category.id})
+                        db.session.add(category)
+                        db.session.commit()
+                        for n in range(3):
+                            db.session.add(Transaction.from_json({'amount': 10 * (n + 1),
+                                                                  'description': 'rent {}'.format(n),
+                                                                  'category_id': category.id,
+                                                                  'maker_id': user.id}))
+                        db.session.commit()
+
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user0', 'new_password')
+        )
+        self.token = response.json['token']
+        self.refresh_token = response.json['refresh_token']
+        self.user = self.users[0]
+        self.wallet = Wallet.query.filter_by(owner_id=self.user.id).first()
+        self.parent_category = ParentCategory.query.filter_by(wallet_id=self.wallet.id).first()
+        self.category = Category.query.filter_by(parent_category_id=self.parent_category.id).first()
+        self.transaction = Transaction.query.filter_by(category_id=self.category.id).first()
+        db.session.expunge_all()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def assertWithinBudget(self, endpoint, method, url, data=None, headers=None):
+        with self.subTest(endpoint=endpoint):
+            # Nothing may be served from the identity map of earlier requests
+            db.session.expunge_all()
+            with count_queries(self.app) as queries:
+                response = self.client.open(url,
+                                            method=method,
+                                            headers=headers or self.get_token_headers(self.token),
+                                            data=json.dumps(data) if data is not None else None)
+            self.assertTrue(response.status_code < 400, response.get_data(as_text=True))
+            # Most errors are answered with 200 and their code in the body
+            self.assertTrue((response.get_json(silent=True) or {}).get('code', 200) < 400,
+                            response.get_data(as_text=True))
+            self.assertLessEqual(len(queries), QUERY_BUDGETS[endpoint],
+                                 '{} issued {} queries:\n{}'.format(endpoint, len(queries),
+                                                                    '\n'.join(queries.statements)))
+        return response
+
+    def test_every_route_has_a_budget(self):
+        """
+        The test case for declaring a budget for every API route.
+        """
+        endpoints = {rule.endpoint for rule in self.app.url_map.iter_rules()
+                     if rule.endpoint.startswith('api.')}
+        self.assertTrue(endpoints - set(QUERY_BUDGETS) == set(), endpoints - set(QUERY_BUDGETS))
+
+    def test_misc_budgets(self):
+        """
+        The test case for the query budgets of login, token, index, changes, batch and job views.
+        """
+        self.assertWithinBudget('api.login', 'POST', url_for('api.login'),
+                                headers=self.get_api_headers('test_user0', 'new_password'))
+        self.assertWithinBudget('api.index', 'GET', url_for('api.index'))
+        self.assertWithinBudget('api.get_changes', 'GET', url_for('api.get_changes', since=0))
+        self.assertWithinBudget('api.refresh_token', 'POST', url_for('api.refresh_token'),
+                                {'refresh_token': self.refresh_token})
+        self.assertWithinBudget('api.revoke_refresh_token', 'DELETE', url_for('api.revoke_refresh_token'),
+                                {'refresh_token': self.refresh_token})
+        self.assertWithinBudget('api.batch', 'POST', url_for('api.batch'),
+                                {'requests': [{'method': 'GET', 'path': '/transactions/{}'.format(
+                                    self.transaction.id)}] * 2})
+        self.assertWithinBudget('api.get_job_stats', 'GET', url_for('api.get_job_stats'))
+        job = enqueue('delete_category', owner_id=self.user.id, id=self.category.id)
+        self.assertWithinBudget('api.get_job', 'GET', url_for('api.get_job', id=job.id))
+
+    def test_user_budgets(self):
+        """
+        The test case for the query budgets of user views.
+        """
+        self.assertWithinBudget('api.get_all_users', 'GET', url_for('api.get_all_users'))
+        self.assertWithinBudget('api.get_user', 'GET', url_for('api.get_user', id=self.user.id))
+        self.assertWithinBudget('api.get_user_transactions', 'GET',
+                                url_for('api.get_user_transactions', id=self.user.id))
+        self.assertWithinBudget('api.get_user_dashboard', 'GET',
+                                url_for('api.get_user_dashboard', id=self.user.id))
+        self.assertWithinBudget('api.create_user', 'POST', url_for('api.create_user'),
+                                {'username': 'test_user2', 'email': 'user2@example.com',
+                                 'password': 'password2'})
+        self.assertWithinBudget('api.update_user', 'PUT', url_for('api.update_user', id=self.user.id),
+                                {'first_name': 'first_name', 'password': 'new_password'})
+        self.assertWithinBudget('api.delete_user', 'DELETE', url_for('api.delete_user', id=self.user.id))
+
+    def test_wallet_budgets(self):
+        """
+        The test case for the query budgets of wallet views.
+        """
+        self.assertWithinBudget('api.get_all_wallets', 'GET', url_for('api.get_all_wallets'))
+        self.assertWithinBudget('api.get_wallet', 'GET', url_for('api.get_wallet', id=self.wallet.id))
+        self.assertWithinBudget('api.get_wallet_tree', 'GET',
+                                url_for('api.get_wallet_tree', id=self.wallet.id, totals=1))
+        self.assertWithinBudget('api.get_wallet_alerts', 'GET', url_for('api.get_wallet_alerts', id=self.wallet.id))
+        self.assertWithinBudget('api.get_wallet_events', 'GET', url_for('api.get_wallet_events', id=self.wallet.id))
+        self.assertWithinBudget('api.create_wallet', 'POST', url_for('api.create_wallet'),
+                                {'title': 'wallet', 'currency': 'usd', 'initial_balance': 0})
+        # The new wallet outdates the ownership claims of the token until it is refreshed
+        self.token = self.client.post(url_for('api.refresh_token'), headers=self.get_token_headers(self.token),
+                                      data=json.dumps({'refresh_token': self.refresh_token})).json['token']
+        self.assertWithinBudget('api.update_wallet', 'PUT', url_for('api.update_wallet', id=self.wallet.id),
+                                {'title': 'new_title'})
+        self.assertWithinBudget('api.delete_wallet', 'DELETE', url_for('api.delete_wallet', id=self.wallet.id))
+
+    def test_parent_category_budgets(self):
+        """
+        The test case for the query budgets of parent category views.
+        """
+        self.assertWithinBudget('api.get_all_parent_categories', 'GET',
+                                url_for('api.get_all_parent_categories'))
+        self.assertWithinBudget('api.get_parent_category', 'GET',
+                                url_for('api.get_parent_category', id=self.parent_category.id))
+        self.assertWithinBudget('api.create_parent_category', 'POST', url_for('api.create_parent_category'),
+                                {'title': 'parent_category', 'budget': 10, 'is_income': False,
+                                 'wallet_id': self.wallet.id})
+        self.assertWithinBudget('api.update_parent_category', 'PUT',
+                                url_for('api.update_parent_category', id=self.parent_category.id),
+                                {'title': 'new_title'})
+        self.assertWithinBudget('api.delete_parent_category', 'DELETE',
+                                url_for('api.delete_parent_category', id=self.parent_category.id))
+
+    def test_category_budgets(self):
+        """
+        The test case for the query budgets of category views.
+        """
+        self.assertWithinBudget('api.get_all_categories', 'GET', url_for('api.get_all_categories'))
+        self.assertWithinBudget('api.get_category', 'GET', url_for('api.get_category', id=self.category.id))
+        self.assertWithinBudget('api.get_category_transactions', 'GET',
+                                url_for('api.get_category_transactions', id=self.category.id))
+        self.assertWithinBudget('api.create_category', 'POST', url_for('api.create_category'),
+                                {'title': 'category', 'budget': 10, 'has_bills': False,
+                                 'parent_category_id': self.parent_category.id})
+        self.assertWithinBudget('api.update_category', 'PUT', url_for('api.update_category', id=self.category.id),
+                                {'title': 'new_title'})
+        self.assertWithinBudget('api.delete_category', 'DELETE',
+                                url_for('api.delete_category', id=self.category.id))
+
+    def test_transaction_budgets(self):
+        """
+        The test case for the query budgets of transaction views.
+        """
+        self.assertWithinBudget('api.get_all_transactions', 'GET', url_for('api.get_all_transactions'))
+        self.assertWithinBudget('api.get_transaction', 'GET',
+                                url_for('api.get_transaction', id=self.transaction.id))
+        self.assertWithinBudget('api.search_transactions', 'GET',
+                                url_for('api.search_transactions', q='ren'))
+        self.assertWithinBudget('api.create_transaction', 'POST', url_for('api.create_transaction'),
+                                {'amount': 10, 'description': 'rent', 'category_id': self.category.id})
+        self.assertWithinBudget('api.update_transaction', 'PUT',
+                                url_for('api.update_transaction', id=self.transaction.id),
+                                {'amount': 20})
+        self.assertWithinBudget('api.delete_transaction', 'DELETE',
+                                url_for('api.delete_transaction', id=self.transaction.id))
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db
+from app.models import User
+from app.ratelimit import MemoryBuckets, SqliteBuckets
+
+
+class RateLimitTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_token_buckets(self):
+        """
+        The test case for the in-process and the shared token buckets.
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'buckets.sqlite')
+        for buckets, other in ((MemoryBuckets(0.1, 2), None),
+                               (SqliteBuckets(path, 0.1, 2), SqliteBuckets(path, 0.1, 2))):
+            with self.subTest(buckets=type(buckets).__name__):
+                self.assertTrue(buckets.take('1', 1) == 0)
+                # Workers sharing the file share the bucket
+                self.assertTrue((other or buckets).take('1', 1) == 0)
+                self.assertTrue(buckets.take('1', 1) > 9)
+                self.assertTrue(buckets.take('2', 5) == 0)
+        os.remove(path)
+
+    def test_rate_limit(self):
+        """
+        The test case for refusing requests over the rate limit.
+        """
+        self.app.extensions['rate_limit'] = MemoryBuckets(1, 20)
+        response = self.client.get(
+            url_for('api.get_all_transactions'),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.status_code == 200)
+
+        response = self.client.get(
+            url_for('api.get_all_transactions'),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.status_code == 429)
+        self.assertTrue(response.json['code'] == 429)
+        self.assertTrue(int(response.headers['Retry-After']) >= 19)
+
+        # Cheaper endpoints wait for fewer tokens
+        response = self.client.get(
+            url_for('api.get_user', id=self.user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.headers['Retry-After'] == '1')
+
+    def test_load_shedding(self):
+        """
+        The test case for answering 503 while too many requests are in flight.
+        """
+        self.app.config['SHED_MAX_IN_FLIGHT'] = 2
+        self.app.wsgi_app.in_flight = 2
+        response = self.client.get(
+            url_for('api.get_user', id=self.user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.status_code == 503)
+        self.assertTrue(response.headers['Retry-After'] == '1')
+
+        self.app.wsgi_app.in_flight = 1
+        response = self.client.get(
+            url_for('api.get_user', id=self.user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(self.app.wsgi_app.in_flight == 1)
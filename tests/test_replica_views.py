@@ -0,0 +1,102 @@
+import json
+import os
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db, database
+from app.models import User, Wallet
+from config import basedir
+
+
+class ReplicaTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.replica_path = os.path.join(basedir, 'data-test-replica.sqlite')
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite:///' + self.replica_path}
+        self.app.config['SQLALCHEMY_REPLICA_BINDS'] = ['replica']
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all(bind=None)
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+        database.copy_database(db.get_engine(self.app), db.get_engine(self.app, 'replica'))
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all(bind=None)
+        db.get_engine(self.app, 'replica').dispose()
+        os.remove(self.replica_path)
+        self.app_context.pop()
+
+    def test_reads_go_to_replica(self):
+        """
+        The test case for get_all_wallets view reading from a replica.
+        """
+        db.session.add(Wallet.from_json({'title': 'test_wallet',
+                                         'currency': 'usd',
+                                         'initial_balance': 0,
+                                         'owner_id': self.user.id}))
+        db.session.commit()
+
+        response = self.client.get(
+            url_for('api.get_all_wallets'),
+            headers=self.get_token_headers(self.token)
+        )
+
+        # The replica hasn't been synced since the wallet was created
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response.json['wallets']) == 0)
+
+    def test_read_your_writes(self):
+        """
+        The test case for reading from the primary right after a write.
+        """
+        self.client.post(
+            url_for('api.create_wallet'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'title': 'test_wallet', 'currency': 'usd', 'initial_balance': 0})
+        )
+        response = self.client.get(
+            url_for('api.get_all_wallets'),
+            headers=self.get_token_headers(self.token)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response.json['wallets']) == 1)
@@ -0,0 +1,85 @@
+import random
+import unittest
+
+from werkzeug.security import check_password_hash
+
+from app import create_app, db
+from app.counters import repair_counters
+from app.models import User, Wallet, ParentCategory, Category, Transaction, Change
+from app.seed import distribution, seed
+
+
+class SeedTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.engine = db.get_engine(self.app)
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_seed(self):
+        """
+        The test case for bulk seeding the database.
+        """
+        counts, seconds = seed(self.engine, 3, wallets=2, parent_categories=2, categories=2,
+                               transactions=3, password='new_password')
+
+        self.assertTrue(counts == {'users': 3, 'wallets': 6, 'parent_categories': 12,
+                                   'categories': 24, 'transactions': 72})
+        self.assertTrue(Transaction.query.count() == 72)
+        user = User.query.filter_by(username='user1').first()
+        self.assertTrue(check_password_hash(user.password, 'new_password'))
+        # Transactions are made by the owner of their wallet
+        transaction = Transaction.query.first()
+        category = Category.query.get(transaction.category_id)
+        parent_category = ParentCategory.query.get(category.parent_category_id)
+        self.assertTrue(Wallet.query.get(parent_category.wallet_id).owner_id == transaction.maker_id)
+        # Their counters are filled while seeding, there is nothing to repair
+        self.assertTrue(Wallet.query.get(parent_category.wallet_id).transactions_count == 12)
+        with self.engine.begin() as connection:
+            self.assertTrue(repair_counters(connection) ==
+                            {'categories': 0, 'parent_categories': 0, 'wallets': 0})
+        # And logged as created for clients syncing from the change log
+        self.assertTrue(Change.query.count() == 117)
+        change = Change.query.filter_by(kind='transactions', object_id=transaction.id).one()
+        self.assertTrue(change.seq == transaction.seq and change.op == 'create')
+        self.assertTrue((change.user_id, change.wallet_id) == (transaction.maker_id, parent_category.wallet_id))
+        self.assertTrue(len({change.seq for change in Change.query}) == 117)
+
+    def test_seed_is_deterministic(self):
+        """
+        The test case for generating the same rows from the same seed.
+        """
+        seed(self.engine, 2, transactions='poisson:5', seed=7)
+        first = [(t.amount, t.description, t.category_id) for t in Transaction.query.order_by(Transaction.id)]
+        Transaction.query.delete()
+        Category.query.delete()
+        ParentCategory.query.delete()
+        Wallet.query.delete()
+        User.query.delete()
+        db.session.commit()
+        seed(self.engine, 2, transactions='poisson:5', seed=7)
+        second = [(t.amount, t.description, t.category_id) for t in Transaction.query.order_by(Transaction.id)]
+
+        self.assertTrue(len(first) > 0)
+        self.assertTrue(first == second)
+
+    def test_distribution(self):
+        """
+        The test case for the children per parent distributions.
+        """
+        rng = random.Random(0)
+        self.assertTrue(distribution('3')(rng) == 3)
+        self.assertTrue(distribution('fixed:3')(rng) == 3)
+        self.assertTrue(all(1 <= distribution('uniform:1-4')(rng) <= 4 for i in range(100)))
+        mean = sum(distribution('poisson:50')(rng) for i in range(1000)) / 1000
+        self.assertTrue(45 < mean < 55)
+        self.assertTrue(all(distribution('pareto:10')(rng) >= 0 for i in range(100)))
+        with self.assertRaises(ValueError):
+            distribution('normal:3')
@@ -0,0 +1,68 @@
+import json
+import os
+import signal
+import socket
+import time
+import unittest
+import urllib.request
+
+from app import create_app, db
+from app.server import PreforkServer, after_fork, warm_up
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_after_fork(self):
+        """
+        The test case for resetting per-process state in a forked worker.
+        """
+        warm_up(self.app)
+        metrics = self.app.extensions['metrics']
+        self.assertTrue(metrics.snapshot()['counters'] != [])
+        self.app.extensions['shard_ids']._blocks['wallets'] = (1, 100)
+
+        after_fork(self.app)
+
+        self.assertTrue(metrics.snapshot()['counters'] == [])
+        self.assertTrue(self.app.extensions['shard_ids']._blocks == {})
+
+    def test_prefork_server(self):
+        """
+        The test case for serving requests from preforked workers.
+        """
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        self.app.config['SERVER_NAME'] = 'localhost:{}'.format(port)
+        db.session.remove()
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                PreforkServer(self.app, '127.0.0.1', port, workers=2).serve_forever()
+            finally:
+                os._exit(0)
+        try:
+            body = None
+            for attempt in range(50):
+                try:
+                    with urllib.request.urlopen('http://localhost:{}/api/v1.0/'.format(port)) as response:
+                        body = json.loads(response.read().decode('utf-8'))
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            self.assertTrue(body == {'message': 'Token is missing!', 'code': 401})
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
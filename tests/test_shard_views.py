@@ -0,0 +1,117 @@
+import json
+import os
+import unittest
+from base64 import b64encode
+
+from flask import url_for
+
+from app import create_app, db, sharding
+from app.models import User, Wallet
+from config import basedir
+
+
+class ShardTestCase(unittest.TestCase):
+
+    @staticmethod
+    def get_api_headers(username: str, password: str) -> dict:
+        return {
+            'Authorization': 'Basic ' + b64encode(
+                (username + ':' + password).encode('utf-8')).decode('utf-8'),
+            'Accept': 'application/json',
+            'Content-Type': 'application/json'
+        }
+
+    @staticmethod
+    def get_token_headers(token: str) -> dict:
+        return {'x-access-token': token,
+                'Accept': 'application/json',
+                'Content-Type': 'application/json'}
+
+    def setUp(self) -> None:
+        self.shard_paths = {'shard_{}'.format(i): os.path.join(basedir, 'data-test-shard{}.sqlite'.format(i))
+                            for i in range(2)}
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_BINDS'] = {bind: 'sqlite:///' + path
+                                               for bind, path in self.shard_paths.items()}
+        self.app.config['SHARD_BINDS'] = sorted(self.shard_paths)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all(bind=None)
+        sharding.create_shard_tables()
+        sharding.init_sequences()
+        self.client = self.app.test_client()
+
+        # Create user
+        self.user = User.from_json(
+            {'username': 'test_user',
+             'email': 'test_user@example.com',
+             'password': 'new_password',
+             'confirmed': True,
+             'first_name': 'test_first_name',
+             'last_name': 'test_last_name'}
+        )
+        db.session.add(self.user)
+        db.session.commit()
+
+        # Login user
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        self.token = response.json['token']
+
+    def tearDown(self) -> None:
+        db.session.remove()
+        db.drop_all(bind=None)
+        for bind, path in self.shard_paths.items():
+            db.get_engine(self.app, bind).dispose()
+            os.remove(path)
+        self.app_context.pop()
+
+    def count_wallets(self, bind):
+        engine = db.get_engine(self.app, bind)
+        return engine.execute(db.select([db.func.count()]).select_from(Wallet.__table__)).scalar()
+
+    def test_create_wallet_on_shard(self):
+        """
+        The test case for create_wallet view writing to the owner's shard.
+        """
+        shard = User.query.get(self.user.id).shard
+        other = [bind for bind in self.shard_paths if bind != shard][0]
+        self.assertTrue(shard == sharding.pick_shard(self.user.id))
+
+        response = self.client.post(
+            url_for('api.create_wallet'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'title': 'test_wallet', 'currency': 'usd', 'initial_balance': 0})
+        )
+
+        self.assertTrue(response.status_code == 201)
+        self.assertTrue(self.count_wallets(shard) == 1)
+        self.assertTrue(self.count_wallets(other) == 0)
+        self.assertTrue(self.count_wallets(None) == 0)
+
+    def test_move_user(self):
+        """
+        The test case for moving a user to another shard.
+        """
+        response = self.client.post(
+            url_for('api.create_wallet'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'title': 'test_wallet', 'currency': 'usd', 'initial_balance': 0})
+        )
+        wallet_id = response.json['id']
+        user = User.query.get(self.user.id)
+        source = user.shard
+        target = [bind for bind in self.shard_paths if bind != source][0]
+
+        sharding.move_user(user, target)
+
+        self.assertTrue(self.count_wallets(source) == 0)
+        self.assertTrue(self.count_wallets(target) == 1)
+        response = self.client.get(
+            url_for('api.get_wallet', id=wallet_id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.json['title'] == 'test_wallet')
@@ -6,7 +6,8 @@ from random import randint, choice
 from flask import url_for
 
 from app import create_app, db
-from app.models import User, Wallet, ParentCategory, Category, Transaction
+from app.idempotency import get_cache
+from app.models import User, Wallet, ParentCategory, Category, Transaction, IdempotencyKey
 
 
 class CategoryTestCase(unittest.TestCase):
@@ -183,3 +184,115 @@ class CategoryTestCase(unittest.TestCase):
 
         self.assertTrue(response.status_code == 200)
         self.assertIsNone(Transaction.query.first())
+
+    def test_create_transaction_idempotent(self):
+        """
+        The test case for retrying create_transaction view with an idempotency key.
+        """
+        headers = self.get_token_headers(self.token)
+        headers['Idempotency-Key'] = 'retry-key'
+        responses = [self.client.post(url_for('api.create_transaction'),
+                                      headers=headers,
+                                      data=json.dumps(self.data))
+                     for i in range(3)]
+
+        self.assertTrue(all(r.status_code == 201 for r in responses))
+        self.assertTrue(len(set(r.json['id'] for r in responses)) == 1)
+        self.assertTrue(responses[-1].headers['Idempotent-Replayed'] == 'true')
+        self.assertTrue(Transaction.query.count() == 2)
+
+        # The same key can't be reused for a different payload
+        self.data['amount'] += 1
+        response = self.client.post(url_for('api.create_transaction'),
+                                    headers=headers,
+                                    data=json.dumps(self.data))
+        self.assertTrue(response.status_code == 422)
+
+    def test_create_transaction_idempotent_after_crash(self):
+        """
+        The test case for retrying create_transaction view whose response was never stored.
+        """
+        self.app.config['IDEMPOTENCY_LOCK_TIMEOUT'] = 0
+        headers = self.get_token_headers(self.token)
+        headers['Idempotency-Key'] = 'crash-key'
+        self.client.post(url_for('api.create_transaction'), headers=headers, data=json.dumps(self.data))
+        key = IdempotencyKey.query.filter_by(key='crash-key').one()
+        self.assertTrue(key.applied)
+
+        # As if the process died between the commit of the view and storing its response
+        key.status_code = key.body = None
+        db.session.commit()
+        get_cache().clear()
+        response = self.client.post(url_for('api.create_transaction'), headers=headers, data=json.dumps(self.data))
+        self.assertTrue(response.status_code == 409)
+        self.assertTrue(Transaction.query.count() == 2)
+
+        # A request that died before committing anything runs again
+        key.applied = False
+        db.session.commit()
+        response = self.client.post(url_for('api.create_transaction'), headers=headers, data=json.dumps(self.data))
+        self.assertTrue(response.status_code == 201)
+        self.assertTrue(Transaction.query.count() == 3)
+
+    def search(self, query, **values):
+        return self.client.get(url_for('api.search_transactions', q=query, **values),
+                               headers=self.get_token_headers(self.token)).json
+
+    def test_search_transactions(self):
+        """
+        The test case for search_transactions view.
+        """
+        other_user = User.from_json({'username': 'other_user',
+                                     'email': 'other_user@example.com',
+                                     'password': 'new_password',
+                                     'confirmed': True})
+        db.session.add(other_user)
+        db.session.commit()
+        other_wallet = Wallet.from_json({'title': 'other_wallet', 'currency': 'usd', 'owner_id': other_user.id})
+        db.session.add(other_wallet)
+        db.session.commit()
+        other_parent_category = ParentCategory.from_json({'title': 'other', 'wallet_id': other_wallet.id})
+        db.session.add(other_parent_category)
+        db.session.commit()
+        other_category = Category.from_json({'title': 'other', 'parent_category_id': other_parent_category.id})
+        db.session.add(other_category)
+        db.session.commit()
+
+        transactions = {}
+        for description, category, maker in (('Monthly rent', self.category, self.user),
+                                              ('Rent for the car', self.category, self.user),
+                                              ('Groceries', self.category, self.user),
+                                              ('rent', other_category, other_user)):
+            transactions[description] = Transaction.from_json({'amount': 10,
+                                                               'description': description,
+                                                               'category_id': category.id,
+                                                               'maker_id': maker.id})
+            db.session.add(transactions[description])
+        db.session.commit()
+
+        response = self.search('REN')
+        self.assertTrue(sorted(t['description'] for t in response['transactions']) ==
+                        ['Monthly rent', 'Rent for the car'])
+        self.assertTrue(response['next'] is None)
+        response = self.search('car ren')
+        self.assertTrue([t['description'] for t in response['transactions']] == ['Rent for the car'])
+
+        # The index follows updates and deletes
+        self.client.put(url_for('api.update_transaction', id=transactions['Groceries'].id),
+                        headers=self.get_token_headers(self.token),
+                        data=json.dumps({'description': 'rent refund'}))
+        self.client.delete(url_for('api.delete_transaction', id=transactions['Monthly rent'].id),
+                           headers=self.get_token_headers(self.token))
+        response = self.search('rent', limit=1)
+        self.assertTrue(len(response['transactions']) == 1)
+        response = self.client.get(response['next'], headers=self.get_token_headers(self.token)).json
+        self.assertTrue(len(response['transactions']) == 1)
+        self.assertTrue(response['next'] is None)
+        self.assertTrue(self.search('groceries')['transactions'] == [])
+
+        # Pages hold at least one transaction and start at the first one at the earliest
+        response = self.search('rent', limit=0, offset=-5)
+        self.assertTrue(len(response['transactions']) == 1)
+        self.assertTrue('offset=1&limit=1' in response['next'])
+
+        self.assertTrue(self.search('?!')['code'] == 400)
@@ -1,12 +1,14 @@
 import json
 import unittest
 from base64 import b64encode
+from datetime import datetime
 
 from flask import url_for
 from werkzeug.security import check_password_hash
 
 from app import create_app, db
-from app.models import User
+from app.models import User, Wallet, ParentCategory, Category, Transaction, RefreshToken
+from app.passwords import PasswordHasher
 
 
 class UserTestCase(unittest.TestCase):
@@ -52,6 +54,7 @@ class UserTestCase(unittest.TestCase):
         )
 
         self.token = response.json['token']
+        self.refresh_token = response.json['refresh_token']
 
         self.data = {'username': 'test_user2',
                      'email': 'user2@example.com',
@@ -101,6 +104,131 @@ class UserTestCase(unittest.TestCase):
         self.assertTrue(response.json['first_name'] == user.first_name)
         self.assertTrue(response.json['last_name'] == user.last_name)
 
+    def test_get_user_transactions(self):
+        """
+        The test case for get_user_transactions view.
+        """
+        user = User.query.first()
+        wallet = Wallet.from_json({'title': 'test_wallet', 'currency': 'usd',
+                                   'initial_balance': 0, 'owner_id': user.id})
+        db.session.add(wallet)
+        db.session.commit()
+        parent_category = ParentCategory.from_json({'title': 'test_parent_category', 'budget': 0,
+                                                    'is_income': False, 'wallet_id': wallet.id})
+        db.session.add(parent_category)
+        db.session.commit()
+        category = Category.from_json({'title': 'test_category', 'budget': 0, 'has_bills': False,
+                                       'parent_category_id': parent_category.id})
+        db.session.add(category)
+        db.session.commit()
+        for i in range(5):
+            db.session.add(Transaction.from_json({'amount': i,
+                                                  'description': 'some description{}'.format(i),
+                                                  'category_id': category.id,
+                                                  'maker_id': user.id}))
+        db.session.commit()
+
+        response = self.client.get(
+            url_for('api.get_user', id=user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.json['transactions_count'] == 5)
+
+        ids = []
+        url = url_for('api.get_user_transactions', id=user.id, limit=2)
+        while url:
+            response = self.client.get(url, headers=self.get_token_headers(self.token))
+            self.assertTrue(response.status_code == 200)
+            self.assertTrue(len(response.json['transactions']) <= 2)
+            ids += [t['id'] for t in response.json['transactions']]
+            url = response.json['next']
+        self.assertTrue(ids == [t.id for t in Transaction.query.order_by(Transaction.id)])
+
+        # Limits under one are raised to one
+        for limit in (0, -1):
+            response = self.client.get(url_for('api.get_user_transactions', id=user.id, limit=limit),
+                                       headers=self.get_token_headers(self.token))
+            self.assertTrue(len(response.json['transactions']) == 1)
+            self.assertTrue('limit=1' in response.json['next'])
+        response = self.client.get(url_for('api.get_user_transactions', id=user.id, limit=-1,
+                                           after=ids[-1]),
+                                   headers=self.get_token_headers(self.token))
+        self.assertTrue(response.json == {'transactions': [], 'next': None})
+
+    def test_get_user_dashboard(self):
+        """
+        The test case for get_user_dashboard view.
+        """
+        user = User.query.first()
+        wallet = Wallet.from_json({'title': 'test_wallet', 'currency': 'usd',
+                                   'initial_balance': 100, 'owner_id': user.id})
+        empty_wallet = Wallet.from_json({'title': 'empty_wallet', 'currency': 'eur',
+                                         'initial_balance': 5, 'owner_id': user.id})
+        db.session.add_all([wallet, empty_wallet])
+        db.session.commit()
+        income = ParentCategory.from_json({'title': 'income', 'budget': 0,
+                                           'is_income': True, 'wallet_id': wallet.id})
+        expense = ParentCategory.from_json({'title': 'expense', 'budget': 0,
+                                            'is_income': False, 'wallet_id': wallet.id})
+        db.session.add_all([income, expense])
+        db.session.commit()
+        salary = Category.from_json({'title': 'salary', 'budget': 0, 'parent_category_id': income.id})
+        food = Category.from_json({'title': 'food', 'budget': 50, 'parent_category_id': expense.id})
+        rent = Category.from_json({'title': 'rent', 'budget': 0, 'parent_category_id': expense.id})
+        db.session.add_all([salary, food, rent])
+        db.session.commit()
+        for amount, category in ((1000, salary), (500, salary), (30, food), (40, food), (10, rent)):
+            db.session.add(Transaction.from_json({'amount': amount, 'category_id': category.id,
+                                                  'maker_id': user.id}))
+        db.session.commit()
+        # Last year's salary only counts towards the balance
+        Transaction.query.filter_by(amount=500).first().created_at = datetime(2000, 1, 1)
+        db.session.commit()
+
+        response = self.client.get(
+            url_for('api.get_user_dashboard', id=user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.status_code == 200)
+        summary, empty_summary = response.json['wallets']
+        self.assertTrue(summary['id'] == wallet.id)
+        self.assertTrue(summary['balance'] == 100 + 1500 - 80)
+        self.assertTrue(summary['month_income'] == 1000)
+        self.assertTrue(summary['month_expense'] == 80)
+        self.assertTrue(summary['categories_over_budget'] == 1)
+        self.assertTrue((empty_summary['balance'], empty_summary['month_income'],
+                         empty_summary['month_expense'], empty_summary['categories_over_budget']) == (5, 0, 0, 0))
+
+        # Writes through the session drop the cached dashboard
+        db.session.add(Transaction.from_json({'amount': 1, 'category_id': rent.id, 'maker_id': user.id}))
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.get_user_dashboard', id=user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.json['wallets'][0]['month_expense'] == 81)
+
+        # Anything else is seen once the entry expires
+        db.session.execute(Wallet.__table__.update().values(initial_balance=0))
+        db.session.commit()
+        response = self.client.get(
+            url_for('api.get_user_dashboard', id=user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.json['wallets'][1]['balance'] == 5)
+        self.app.extensions['dashboards'].clear()
+        response = self.client.get(
+            url_for('api.get_user_dashboard', id=user.id),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.json['wallets'][1]['balance'] == 0)
+
+        response = self.client.get(
+            url_for('api.get_user_dashboard', id=user.id + 1),
+            headers=self.get_token_headers(self.token)
+        )
+        self.assertTrue(response.json['code'] == 403)
+
     def test_create_user(self):
         """
         The test case for create_user view.
@@ -138,6 +266,50 @@ class UserTestCase(unittest.TestCase):
         self.assertTrue(response.json['first_name'] == self.data['first_name'])
         self.assertTrue(response.json['last_name'] == self.data['last_name'])
 
+    def test_update_user_without_password(self):
+        """
+        The test case for update_user view without a password.
+        """
+        user = User.query.first()
+        password_hash = user.password
+        response = self.client.put(
+            url_for('api.update_user', id=user.id),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'first_name': 'new_first_name'})
+        )
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.json['first_name'] == 'new_first_name')
+        self.assertTrue(response.json['password'] == password_hash)
+
+    def test_login_rehashes_password(self):
+        """
+        The test case for login view with an outdated password hash.
+        """
+        self.app.extensions['passwords'].method = 'pbkdf2:sha256:2000'
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+
+        self.assertTrue(response.status_code == 200)
+        user = User.query.first()
+        self.assertTrue(user.password.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(check_password_hash(user.password, 'new_password'))
+
+    def test_password_hasher_pool(self):
+        """
+        The test case for hashing passwords in worker processes.
+        """
+        hasher = PasswordHasher('pbkdf2:sha256:1000', 1)
+        try:
+            password_hash = hasher.hash('password')
+            self.assertTrue(hasher.verify(password_hash, 'password'))
+            self.assertFalse(hasher.verify(password_hash, 'wrong'))
+            self.assertFalse(hasher.needs_rehash(password_hash))
+        finally:
+            hasher.shutdown()
+
     def test_delete_user(self):
         """
         The test case for delete_user view.
@@ -151,3 +323,80 @@ class UserTestCase(unittest.TestCase):
 
         self.assertTrue(response.status_code == 200)
         self.assertIsNone(User.query.first())
+        self.assertIsNone(RefreshToken.query.first())
+
+    def test_refresh_token(self):
+        """
+        The test case for refresh_token view.
+        """
+        response = self.client.post(
+            url_for('api.refresh_token'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'refresh_token': self.refresh_token})
+        )
+
+        self.assertTrue(response.status_code == 200)
+        response = self.client.get(
+            url_for('api.get_all_users'),
+            headers=self.get_token_headers(response.json['token'])
+        )
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(len(response.json['users']) == 1)
+        # Only the hash of the token is stored
+        self.assertIsNone(RefreshToken.query.filter_by(token_hash=self.refresh_token).first())
+
+        response = self.client.post(
+            url_for('api.refresh_token'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'refresh_token': 'wrong'})
+        )
+        self.assertTrue(response.json['code'] == 401)
+
+        for token in (5, ['wrong'], {'token': 'wrong'}):
+            response = self.client.post(
+                url_for('api.refresh_token'),
+                headers=self.get_token_headers(self.token),
+                data=json.dumps({'refresh_token': token})
+            )
+            self.assertTrue(response.json['code'] == 401)
+
+    def test_purge_refresh_tokens(self):
+        """
+        The test case for deleting expired refresh tokens.
+        """
+        RefreshToken.query.update({'expires_at': datetime(2000, 1, 1)})
+        other_user = User.from_json({'username': 'other_user', 'email': 'other_user@example.com',
+                                     'password': 'new_password', 'confirmed': True})
+        db.session.add(other_user)
+        db.session.commit()
+        RefreshToken.issue(other_user.id)
+        db.session.commit()
+        self.assertTrue(RefreshToken.purge_expired() == 1)
+        db.session.commit()
+        self.assertTrue(RefreshToken.query.count() == 1)
+
+        # Logging in drops the tokens of the user that expired
+        RefreshToken.query.update({'expires_at': datetime(2000, 1, 1)})
+        db.session.commit()
+        self.client.post(url_for('api.login'), headers=self.get_api_headers('test_user', 'new_password'))
+        user = User.query.filter_by(username='test_user').first()
+        self.assertTrue(sorted(token.user_id for token in RefreshToken.query) == [user.id, other_user.id])
+        self.assertTrue(RefreshToken.query.filter_by(user_id=user.id).one().expires_at > datetime.utcnow())
+
+    def test_revoke_refresh_token(self):
+        """
+        The test case for revoke_refresh_token view.
+        """
+        response = self.client.delete(
+            url_for('api.revoke_refresh_token'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'refresh_token': self.refresh_token})
+        )
+
+        self.assertTrue(response.json['code'] == 200)
+        response = self.client.post(
+            url_for('api.refresh_token'),
+            headers=self.get_token_headers(self.token),
+            data=json.dumps({'refresh_token': self.refresh_token})
+        )
+        self.assertTrue(response.json['code'] == 401)
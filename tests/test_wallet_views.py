@@ -3,10 +3,12 @@ import unittest
 from base64 import b64encode
 from random import randint, choice
 
+import jwt
 from flask import url_for
 
 from app import create_app, db
-from app.models import User, Wallet
+from config import Config
+from app.models import User, Wallet, ParentCategory, Category, Transaction
 
 
 class WalletTestCase(unittest.TestCase):
@@ -107,6 +109,46 @@ class WalletTestCase(unittest.TestCase):
                                                           id=self.wallet.owner_id,
                                                           _external=True))
 
+    def test_get_wallet_tree(self):
+        """
+        The test case for get_wallet_tree view.
+        """
+        parent_categories = [ParentCategory.from_json({'title': 'parent_category{}'.format(i),
+                                                       'budget': randint(0, 1000),
+                                                       'is_income': False,
+                                                       'wallet_id': self.wallet.id})
+                             for i in range(2)]
+        db.session.add_all(parent_categories)
+        db.session.commit()
+        categories = [Category.from_json({'title': 'category{}'.format(i),
+                                          'budget': randint(0, 1000),
+                                          'has_bills': False,
+                                          'parent_category_id': parent_categories[0].id})
+                      for i in range(2)]
+        db.session.add_all(categories)
+        db.session.commit()
+        for amount in (10, 20):
+            db.session.add(Transaction.from_json({'amount': amount,
+                                                  'description': 'some description',
+                                                  'category_id': categories[0].id,
+                                                  'maker_id': self.user.id}))
+        db.session.commit()
+
+        response = self.client.get(
+            url_for('api.get_wallet_tree', id=self.wallet.id, totals=1),
+            headers=self.get_token_headers(self.token)
+        )
+
+        self.assertTrue(response.status_code == 200)
+        self.assertTrue(response.json['title'] == self.wallet.title)
+        tree = response.json['parent_categories']
+        self.assertTrue([pc['id'] for pc in tree] == [pc.id for pc in parent_categories])
+        self.assertTrue([c['id'] for c in tree[0]['categories']] == [c.id for c in categories])
+        self.assertTrue(tree[1]['categories'] == [])
+        self.assertTrue(tree[0]['categories'][0]['transactions_count'] == 2)
+        self.assertTrue(tree[0]['categories'][0]['transactions_total'] == 30)
+        self.assertTrue(tree[0]['categories'][1]['transactions_count'] == 0)
+
     def test_create_wallet(self):
         """
         The test case for create_wallet view.
@@ -154,3 +196,54 @@ class WalletTestCase(unittest.TestCase):
 
         self.assertTrue(response.status_code == 200)
         self.assertIsNone(Wallet.query.first())
+
+    def test_ownership_claims(self):
+        """
+        The test case for the wallet ownership claims of access tokens.
+        """
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+        token = response.json['token']
+        data = jwt.decode(token, Config.SECRET_KEY)
+        self.assertTrue(data['wallets'] == [self.wallet.id])
+        self.assertTrue(data['ov'] == User.query.first().ownership_version)
+
+        # A new wallet outdates the claims, the token falls back to the database
+        response = self.client.post(
+            url_for('api.create_wallet'),
+            headers=self.get_token_headers(token),
+            data=json.dumps(self.data)
+        )
+        wallet_id = response.json['id']
+        self.assertTrue(User.query.first().ownership_version == data['ov'] + 1)
+        response = self.client.put(
+            url_for('api.update_wallet', id=wallet_id),
+            headers=self.get_token_headers(token),
+            data=json.dumps({'title': 'new_title'})
+        )
+        self.assertTrue(response.status_code == 200)
+
+    def test_update_wallet_of_other_user(self):
+        """
+        The test case for update_wallet with the wallet of another user.
+        """
+        user = User.from_json({'username': 'other_user', 'email': 'other_user@example.com',
+                               'password': 'password'})
+        db.session.add(user)
+        db.session.commit()
+        wallet = Wallet.from_json(dict(self.data, owner_id=user.id))
+        db.session.add(wallet)
+        db.session.commit()
+        response = self.client.post(
+            url_for('api.login'),
+            headers=self.get_api_headers('test_user', 'new_password')
+        )
+
+        response = self.client.put(
+            url_for('api.update_wallet', id=wallet.id),
+            headers=self.get_token_headers(response.json['token']),
+            data=json.dumps({'title': 'new_title'})
+        )
+        self.assertTrue(response.json['code'] == 403)
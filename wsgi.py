@@ -0,0 +1,9 @@
+import os
+
+from app import create_app
+from app.server import prepare_for_fork, warm_up
+
+# For preloading servers, e.g. gunicorn --preload wsgi:app
+app = create_app(os.environ.get('WALLETS_CONFIG') or 'production')
+warm_up(app)
+prepare_for_fork(app)